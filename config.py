@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
+from typing import Optional, Union
 
 # --- Logging Configuration ---
 LOGGING_LEVEL = logging.DEBUG  # INFO para producción, DEBUG para desarrollo
@@ -9,8 +11,102 @@ LOGGING_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 DISTEN_HIGH_THRESHOLD: float = 0.95
 DISTEN_MEDIUM_THRESHOLD: float = 0.70
 DISTEN_TARGET_SIZE: tuple[int, int] = (64, 64) # Tamaño objetivo para resize antes de DistEn2D
+DISTEN_M: int = 2 # Dimensión de los patrones (m x m) de DistEn2D
+DISTEN_TAU: int = 1 # Retraso entre píxeles de un patrón
+DISTEN_BINS: Union[str, int] = 'Sturges' # Intervalos del histograma de distancias (método de EntropyHub o número)
 DISTEN_LOW_STD_THRESHOLD: float = 1e-6 # Umbral STD para considerar textura homogénea antes de DistEn
 DISTEN_LOW_STD_THRESHOLD_RESIZE: float = 1e-8 # Umbral STD después de resize
+TEXTURE_METRICS: tuple[str, ...] = () # Métricas de textura adicionales por ROI ("samp_en", "perm_en", "disp_en"); DistEn2D siempre se calcula
+TEXTURE_SAMPEN_R: float = 0.2 # Radio de SampEn2D como fracción de la STD de la ROI (valor por defecto de EntropyHub)
+TEXTURE_DISPEN_CLASSES: int = 3 # Número de símbolos (NCDF) de DispEn2D
+TEXTURE_BATCH_BUFFER_BYTES: int = 8 * 1024 * 1024 # Búferes reutilizables del núcleo DistEn2D por lotes; fija el bloque de filas (más pequeño = cabe en caché)
+SCORE_ONLY_PROXY_SIZE: tuple[int, int] = (16, 16) # Tamaño del DistEn2D reducido usado como indicador en el modo "solo puntuación" (>10)
+SCORE_ONLY_BOUND_MARGIN: float = 0.12 # Margen sobre el indicador para estimar la cota superior de DistEn (empírico, ver image_analysis)
+
+# --- ROI Wire Format / Simplification ---
+ROI_SIMPLIFY_TOLERANCE_PX: float = 0.0 # Tolerancia Douglas-Peucker por defecto (px); 0 = sin simplificar
+ROI_SIMPLIFY_MAX_TOLERANCE_PX: float = 5.0 # Límite superior para la tolerancia pedida por el cliente
+
+# --- Native Radiograph Ingestion (TIFF 16-bit / DICOM) ---
+NATIVE_IMAGE_SPOOL_DIR: Optional[str] = None # Directorio para volcar subidas nativas antes de memmap (None = tmp del sistema)
+NATIVE_IMAGE_ROI_MARGIN: int = 1 # Margen (px) alrededor de la unión de ROIs; cubre la dilatación 3x3 de la máscara
+
+# --- Canonical Image Store (normalización en la ingesta) ---
+IMAGE_STORE_ENABLED: bool = True # Guarda cada subida decodificada a escala de grises, indexada por SHA-256 del original
+IMAGE_STORE_DIR: str = os.environ.get("EOTRH_IMAGE_STORE_DIR", "data/images") # Directorio de las imágenes canónicas y sus metadatos
+IMAGE_STORE_FORMAT: str = "png" # "png" (sin pérdida, compacto) o "npy" (memmap sin decodificar al releer, ~10x más grande que el JPEG)
+IMAGE_STORE_PNG_COMPRESSION: int = 6 # Nivel zlib (0-9) para el formato "png"
+IMAGE_STORE_MAX_PENDING_WRITES: int = 8 # Escrituras en segundo plano pendientes antes de descartar nuevas
+IMAGE_STORE_RETENTION_S: float = 30 * 24 * 3600.0 # Antigüedad máxima de una imagen desde su último uso
+IMAGE_STORE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024 # Tamaño máximo del almacén (se borran las menos usadas recientemente)
+IMAGE_STORE_PURGE_INTERVAL_S: float = 300.0 # Frecuencia con la que el escritor aplica la retención
+
+# --- Memory Budget ---
+MEMORY_BUDGET_PER_REQUEST_BYTES: int = 1536 * 1024 * 1024 # Pico estimado máximo de una petición (si no, 413)
+MEMORY_BUDGET_PROCESS_BYTES: int = 3 * 1024 * 1024 * 1024 # Suma máxima de picos estimados en curso por proceso
+MEMORY_BUDGET_QUEUE_TIMEOUT_S: float = 30.0 # Espera máxima en cola por presupuesto antes de responder 503
+MEMORY_UNKNOWN_COMPRESSION_RATIO: int = 10 # Supuesto (bytes decodificados / archivo) si no se leen las dimensiones
+MEMORY_TRACEMALLOC_SAMPLE_RATE: float = 0.0 # Fracción de peticiones medidas con tracemalloc (0 = nunca; ralentiza mucho el cálculo de DistEn)
+
+# --- Load-adaptive Quality ---
+QUALITY_ADAPTIVE_ENABLED: bool = False # Reduce la calidad del análisis bajo carga (False = siempre "full")
+QUALITY_DEGRADED_TIERS: tuple[tuple[str, tuple[int, int], Optional[int]], ...] = (
+    ("reduced", (48, 48), 250_000), # (nombre, tamaño objetivo de DistEn2D, máximo de píxeles extraídos por ROI o None)
+    ("coarse", (32, 32), 60_000),   # Último nivel = límite de degradación
+)
+QUALITY_QUEUE_DEPTH_HIGH: int = 4 # Otras peticiones en curso a partir de las que se baja un nivel
+QUALITY_LATENCY_HIGH_MS: float = 3000.0 # Latencia reciente (desde la llegada de la petición hasta el fin del análisis) a partir de la que se baja un nivel
+QUALITY_LATENCY_PERCENTILE: float = 90 # Percentil de las latencias recientes comparado con el límite
+QUALITY_LATENCY_WINDOW_S: float = 60.0 # Antigüedad máxima de las latencias consideradas
+QUALITY_LATENCY_MIN_SAMPLES: int = 5 # Latencias necesarias antes de tenerlas en cuenta
+QUALITY_RECOVER_RATIO: float = 0.5 # Se sube un nivel cuando la presión cae por debajo de esta fracción del límite
+QUALITY_HOLD_S: float = 10.0 # Tiempo mínimo entre cambios de nivel (histéresis)
+
+# --- Analysis Workers (cola de trabajos compartida) ---
+ANALYSIS_WORKERS_ENABLED: bool = False # El servidor web encola los análisis para procesos `worker.py` en lugar de calcularlos
+JOB_QUEUE_BACKEND: str = os.environ.get("EOTRH_JOB_QUEUE_BACKEND", "sqlite") # "sqlite", "spool" (directorio compartible entre nodos) o "redis"
+JOB_QUEUE_SQLITE_PATH: str = "data/jobs.sqlite3"
+JOB_QUEUE_SPOOL_DIR: str = "data/jobs"
+JOB_QUEUE_REDIS_URL: str = os.environ.get("EOTRH_JOB_QUEUE_REDIS_URL", "redis://localhost:6379/0") # Cualquier servidor compatible con Redis; "memory://" = sustituto en memoria de un solo proceso (pruebas)
+JOB_QUEUE_REDIS_PREFIX: str = "eotrh:jobs" # Prefijo de las claves (permite compartir el servidor)
+JOB_QUEUE_RESULT_TIMEOUT_S: float = 120.0 # Espera máxima del servidor web por un resultado antes de responder 503
+JOB_QUEUE_RESULT_POLL_S: float = 0.05 # Intervalo inicial con el que el servidor web consulta si el resultado está listo
+JOB_QUEUE_RESULT_POLL_MAX_S: float = 0.25 # El intervalo crece (x1.5 por consulta) hasta este máximo mientras no hay resultado
+JOB_QUEUE_WORKER_POLL_S: float = 0.2 # Intervalo con el que un worker busca trabajos (backends "sqlite" y "spool")
+JOB_QUEUE_LEASE_S: float = 300.0 # Un trabajo reclamado sin resultado tras este tiempo vuelve a la cola (worker caído)
+JOB_QUEUE_REQUEUE_INTERVAL_S: float = 30.0 # Frecuencia con la que cada worker reencola trabajos caducados
+JOB_QUEUE_RESULT_TTL_S: float = 3600.0 # Antigüedad máxima de un resultado que nadie ha recogido
+
+# --- Observability ---
+SERVER_TIMING_ENABLED: bool = True # Añade la cabecera Server-Timing (duración por etapa) a /calculate y /api/calculate
+
+# --- Page Shell / Result Fragments ---
+SHELL_CACHE_MAX_AGE_S: int = 300 # Cache-Control de la página inicial (se revalida con ETag al expirar)
+SHELL_CACHE_MAX_ENTRIES: int = 8 # Variantes renderizadas en memoria (una por URL base)
+
+# --- Static Assets (huellas y variantes precomprimidas) ---
+STATIC_DIR: str = "static"
+STATIC_FINGERPRINT_LENGTH: int = 12 # Caracteres hexadecimales del SHA-256 en el nombre versionado
+STATIC_COMPRESS_EXTENSIONS: tuple[str, ...] = (".css", ".js", ".svg", ".json", ".txt", ".html") # Tipos que se comprimen (PNG/GIF ya lo están)
+STATIC_MIN_COMPRESSION_SAVING: float = 0.1 # Solo se sirve una variante comprimida si ahorra al menos esta fracción
+
+# --- On-demand Profiling ---
+PROFILING_ENABLED: bool = False # Registra el middleware de perfilado (False = coste cero, ni siquiera se comprueba la cabecera)
+PROFILING_ADMIN_TOKEN: Optional[str] = os.environ.get("EOTRH_PROFILING_TOKEN") # Token de administración (None = solo muestreo)
+PROFILING_HEADER: str = "X-Profile-Token" # Cabecera con el token para perfilar una petición concreta
+PROFILING_PATHS: tuple[str, ...] = ("/api/calculate", "/calculate") # Rutas que se pueden perfilar
+PROFILING_SAMPLE_RATE: float = 0.0 # Fracción de peticiones perfiladas automáticamente (muestreo continuo a baja tasa)
+PROFILING_INTERVAL_S: float = 0.005 # Intervalo entre muestras de pila
+PROFILING_DIR: str = "data/profiles" # Artefactos speedscope / collapsed stacks
+PROFILING_MAX_ARTIFACTS: int = 50 # Perfiles conservados (se borran los más antiguos)
+
+# --- Debug Capture (artefactos de extracción de ROIs por petición) ---
+DEBUG_CAPTURE_ENABLED: bool = False # Permite que una petición pida `capture_debug` (False = se ignora el campo)
+DEBUG_CAPTURE_DIR: str = "data/debug" # Un subdirectorio por captura
+DEBUG_CAPTURE_RETENTION_S: float = 3600.0 # Antigüedad máxima de una captura
+DEBUG_CAPTURE_MAX_CAPTURES: int = 100 # Capturas conservadas (se borran las más antiguas)
+DEBUG_CAPTURE_QUEUE_MAXSIZE: int = 16 # ROIs pendientes de escribir (cada una retiene la imagen y dos máscaras); si se llena se descartan
+DEBUG_CAPTURE_PURGE_INTERVAL_S: float = 60.0 # Frecuencia con la que el escritor aplica la retención
 
 # --- Scoring Configuration ---
 MAX_RAW_SCORES: dict[str, int] = {
@@ -42,6 +138,15 @@ DIGITAL_SCORE_MAPPING: dict[str, int] = {
     'low': 0         # si DistEn < DISTEN_MEDIUM_THRESHOLD
 }
 
+# --- Case Store (SQLite, escritura en segundo plano) ---
+CASE_STORE_ENABLED: bool = True
+CASE_STORE_PATH: str = os.environ.get("EOTRH_CASE_STORE_PATH", "data/cases.sqlite3") # `tools.load_test --start-server` lo apunta a un directorio temporal
+CASE_STORE_BATCH_SIZE: int = 64 # Máximo de casos por transacción del escritor
+CASE_STORE_FLUSH_INTERVAL_S: float = 0.5 # Espera máxima para completar un lote antes de escribirlo
+CASE_STORE_QUEUE_MAXSIZE: int = 10000 # Casos pendientes antes de descartar (nunca se bloquea la petición)
+CASE_STORE_PAGE_SIZE: int = 50 # Tamaño de página por defecto en /api/cases
+CASE_STORE_MAX_PAGE_SIZE: int = 500
+
 # --- i18n Configuration ---
 DEFAULT_LOCALE: str = "ca"
 LOCALES_PATH: str = "locales" # Ruta a la carpeta con archivos JSON
@@ -1,18 +1,26 @@
 # -*- coding: utf-8 -*-
-from fastapi import FastAPI, Request, Form, File, UploadFile, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Form, File, UploadFile, HTTPException, Query, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, FileResponse, Response
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 import logging
 import json
-from typing import Dict, Any, List, Tuple
+import os
+from typing import Dict, Any, List, Tuple, Optional
 import datetime
+import hashlib
+import time
+import numpy as np
+from pydantic import ValidationError
+from jinja2 import pass_context
 
 # Importar configuración, schemas y servicios
 import config
-from schemas import ManualFormData, RoiData, AnalysisResult, RoiAnalysisDetail
-from services import scoring, image_analysis, options
+from schemas import ManualFormData, AnalysisResult, RoiAnalysisDetail
+from services import scoring, image_analysis, options, radiograph_io, case_store, roi_codec, memory_budget, profiling, image_store, debug_capture, quality, analysis_jobs, job_queue, static_assets
 from utils.i18n import load_strings
+from utils.serialization import model_response
+from utils.timing import StageTimer
 
 # --- Configuración de Logging ---
 logging.basicConfig(level=config.LOGGING_LEVEL, format=config.LOGGING_FORMAT)
@@ -21,39 +29,289 @@ logger = logging.getLogger(__name__)
 # --- Inicialización FastAPI ---
 app = FastAPI(title="EOTRH Watch")
 
-# Montar archivos estáticos (CSS, JS, Imágenes)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Montar archivos estáticos (CSS, JS, Imágenes). Las URLs versionadas (`asset_url`) se sirven
+# precomprimidas y con caché inmutable; las demás, como archivos normales (ver services/static_assets.py).
+app.mount("/static", static_assets.FingerprintedStaticFiles(directory=config.STATIC_DIR), name="static")
 
 # Configurar plantillas Jinja2
 templates = Jinja2Templates(directory="templates")
+# Sin las líneas en blanco que dejan las etiquetas {% %}: el fragmento de resultados viaja en cada envío.
+templates.env.trim_blocks = True
+templates.env.lstrip_blocks = True
+
+@pass_context
+def _asset_url(context, path: str):
+    """`url_for('static', ...)` con la ruta versionada del recurso (cambia cuando cambia su contenido)."""
+    return context["request"].url_for("static", path=static_assets.versioned_path(path))
+
+templates.env.globals["asset_url"] = _asset_url
+
+# --- Ciclo de vida: huellas de los recursos estáticos ---
+@app.on_event("startup")
+async def _build_static_manifest():
+    await run_in_threadpool(static_assets.build_manifest)
+
+# --- Ciclo de vida: escritor del almacén de casos ---
+@app.on_event("startup")
+async def _start_case_store():
+    case_store.start_writer()
+
+@app.on_event("shutdown")
+async def _stop_case_store():
+    await run_in_threadpool(case_store.stop_writer)
+
+@app.on_event("startup")
+async def _start_debug_capture():
+    debug_capture.start_writer()
+
+@app.on_event("shutdown")
+async def _stop_debug_capture():
+    await run_in_threadpool(debug_capture.stop_writer)
+
+@app.on_event("shutdown")
+async def _flush_image_store():
+    await run_in_threadpool(image_store.flush, 10.0)
+
+# --- Perfilado bajo demanda (ver services/profiling.py) ---
+async def _profiling_middleware(request: Request, call_next):
+    """Perfila la petición completa (incluido el parseo multipart) si lo pide un administrador o toca por muestreo."""
+    if not profiling.should_profile(request.url.path, request.headers.get(config.PROFILING_HEADER)):
+        return await call_next(request)
+    sampler = profiling.StackSampler()
+    sampler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        sampler.stop()
+    profile_id = await run_in_threadpool(profiling.save_profile, sampler, f"{request.method} {request.url.path}")
+    response.headers[profiling.PROFILE_ID_HEADER] = profile_id
+    return response
+
+# Sin perfilado habilitado el middleware no se registra: las peticiones no pagan nada.
+if config.PROFILING_ENABLED:
+    app.middleware("http")(_profiling_middleware)
+
+# --- Helpers ---
+
+# Cabecera con la que el navegador pide a /calculate solo el panel de resultados (partials/results.html).
+FRAGMENT_HEADER = "X-Fragment"
+
+# Página inicial (sin resultados) ya renderizada: (cuerpo, ETag) por URL base y año del pie de página.
+_shell_cache: Dict[Tuple[str, int], Tuple[bytes, str]] = {}
+
+def _parse_rois(roi_data: str, simplify_tolerance: Optional[float]) -> List[np.ndarray]:
+    """
+    Decodifica `roi_data` (formato compacto int16-base64 o lista JSON clásica) y, si procede,
+    simplifica los polígonos con Douglas-Peucker antes de rasterizarlos.
+    """
+    rois = roi_codec.decode_roi_payload(roi_data)
+    tolerance = config.ROI_SIMPLIFY_TOLERANCE_PX if simplify_tolerance is None else simplify_tolerance
+    return roi_codec.simplify_rois(rois, tolerance)
+
+async def _read_upload(image: UploadFile) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Lee la imagen subida.
+
+    Returns:
+        (bytes, None) para imágenes comunes (JPEG/PNG...), que se decodifican en memoria, o
+        (None, ruta) para radiografías nativas TIFF/DICOM, que se vuelcan a disco para leerlas
+        por memmap. El llamador debe eliminar la ruta devuelta.
+        Un TIFF que no se puede mapear (comprimido, color, en mosaicos) se trata como imagen común:
+        OpenCV lo decodifica. Un DICOM no soportado sigue como nativo y el análisis informa del error.
+    """
+    header = await image.read(radiograph_io.NATIVE_HEADER_PEEK_BYTES)
+    await image.seek(0)
+    if radiograph_io.is_native_radiograph(header):
+        suffix = os.path.splitext(image.filename or "")[1]
+        native_path = await run_in_threadpool(profiling.sampled(radiograph_io.spool_upload_to_disk), image.file, suffix)
+        try:
+            await run_in_threadpool(radiograph_io.open_native_radiograph, native_path) # Solo lee la cabecera.
+        except ValueError as e:
+            if radiograph_io.is_tiff(header):
+                logger.info(f"TIFF '{image.filename}' cannot be memory-mapped ({e}); decoding it as a regular image.")
+                _discard_spooled_upload(native_path)
+                await image.seek(0)
+                return await image.read(), None
+        else:
+            logger.info(f"Native radiograph '{image.filename}' spooled to disk for memory-mapped analysis.")
+        return None, native_path
+    return await image.read(), None
+
+
+async def _analyze_upload(
+    image_content: Optional[bytes],
+    native_path: Optional[str],
+    rois: List[np.ndarray],
+    timer: StageTimer,
+    stored_gray: Optional[np.ndarray] = None,
+    capture_id: Optional[str] = None,
+    score_only: bool = False
+) -> Tuple[float, int, List[RoiAnalysisDetail], Optional[str], Tuple[quality.QualityTier, Optional[str]]]:
+    """
+    Despacha el análisis de textura según el tipo de entrada devuelto por `_read_upload`,
+    dentro de una reserva del presupuesto de memoria del proceso. La ingesta y el análisis se
+    ejecutan en hilos, así que el event loop sigue atendiendo peticiones y el presupuesto es el que
+    limita cuántos análisis corren a la vez. Registra en `timer` la espera por presupuesto
+    (`budget_wait`), la ingesta (`ingest`) y el análisis (`analysis`).
+
+    Las imágenes comunes pasan por `services.image_store`: si el mismo archivo ya se ingirió,
+    se reutiliza su escala de grises canónica en lugar de decodificarlo otra vez. `stored_gray`
+    permite reanalizar directamente una imagen almacenada (sin subida). `capture_id` activa la
+    captura de artefactos de depuración (`services.debug_capture`) para esta petición y
+    `score_only` el modo "solo puntuación" (omite las ROIs que no pueden cambiar la puntuación).
+
+    El nivel de calidad (`services.quality`) se elige al obtener la reserva: cuenta como carga todas las
+    peticiones de cálculo en curso (`_track_analysis_load`), estén analizando, esperando presupuesto o
+    aún validando. La latencia desde la llegada de la petición (`timer`) alimenta al controlador.
+
+    Con `config.ANALYSIS_WORKERS_ENABLED` el análisis lo hace un proceso `worker.py` (ver `_analyze_remote`).
+
+    Returns:
+        (max_disten, digital_score, roi_details, image_sha256, (tier, reason)). El hash es None para
+        radiografías nativas y para reanálisis (el llamador ya lo conoce). `reason` es None con calidad completa.
+
+    Raises:
+        memory_budget.MemoryBudgetExceeded: Si la petición no cabe en el presupuesto.
+        analysis_jobs.AnalysisJobTimeout: Si ningún worker resuelve el trabajo a tiempo (modo workers).
+    """
+    if config.ANALYSIS_WORKERS_ENABLED:
+        return await _analyze_remote(image_content, native_path, rois, timer, stored_gray, capture_id, score_only)
+    if native_path is not None:
+        try:
+            estimate = await run_in_threadpool(profiling.sampled(memory_budget.estimate_native_radiograph_bytes), native_path, rois)
+        except ValueError as e:
+            # Formato no soportado o archivo dañado: mismo detalle de error que si fallara la carga en el análisis.
+            logger.error(f"Error loading native radiograph: {e}")
+            return 0.0, 0, [RoiAnalysisDetail(roi_index=0, error=f"Image loading error: {e}")], None, (quality.full_tier(), None)
+    elif stored_gray is not None:
+        estimate = memory_budget.estimate_gray_image_bytes(stored_gray.shape)
+    else:
+        estimate = memory_budget.estimate_decoded_image_bytes(image_content)
+
+    wait_start = time.perf_counter()
+    async with memory_budget.reserve(estimate):
+        timer.add("budget_wait", (time.perf_counter() - wait_start) * 1000)
+        tier, reason = quality.select_tier()
+        tracker = memory_budget.MemoryTracker("analysis")
+        try:
+            if native_path is not None:
+                with timer.stage("analysis"):
+                    result = await image_analysis.analyze_native_radiograph(native_path, rois, tracker, capture_id, score_only, tier)
+                return (*result, None, (tier, reason))
+            digest = None
+            img_gray = stored_gray
+            if img_gray is None:
+                with timer.stage("ingest"):
+                    img_gray, digest, _ = await run_in_threadpool(profiling.sampled(image_store.ingest), image_content)
+                if img_gray is None:
+                    digest = None # Nada almacenado: no hay imagen que reanalizar.
+            with timer.stage("analysis"):
+                result = await image_analysis.analyze_gray_image(img_gray, rois, tracker, capture_id, score_only, tier)
+            return (*result, digest, (tier, reason))
+        finally:
+            quality.record_latency(timer.elapsed_ms())
+            summary = tracker.finish()
+            logger.debug(f"Memory estimate {estimate / 2**20:.1f}MB vs tracked peak {summary['peak_bytes'] / 2**20:.1f}MB.")
+
+
+async def _analyze_remote(
+    image_content: Optional[bytes],
+    native_path: Optional[str],
+    rois: List[np.ndarray],
+    timer: StageTimer,
+    stored_gray: Optional[np.ndarray],
+    capture_id: Optional[str],
+    score_only: bool
+) -> Tuple[float, int, List[RoiAnalysisDetail], Optional[str], Tuple[quality.QualityTier, Optional[str]]]:
+    """
+    Variante de `_analyze_upload` que encola el análisis para los workers (`services.analysis_jobs`).
+    El presupuesto de memoria lo aplica cada worker; aquí solo se registra la espera en cola (`queue`)
+    y el tiempo de análisis informado por el worker (`analysis`).
+    """
+    start = time.perf_counter()
+    tier, reason = quality.select_tier()
+    try:
+        meta, blob = await run_in_threadpool(
+            profiling.sampled(analysis_jobs.encode_job), image_content, native_path, stored_gray, rois, capture_id, score_only, tier
+        )
+        (max_disten, digital_score, roi_details, digest), analysis_ms = await analysis_jobs.run_remote(meta, blob)
+    finally:
+        quality.record_latency(timer.elapsed_ms())
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    timer.add("queue", max(0.0, elapsed_ms - analysis_ms))
+    timer.add("analysis", analysis_ms)
+    return max_disten, digital_score, roi_details, digest, (tier, reason)
+
+
+async def _track_analysis_load():
+    """Dependencia de los endpoints de cálculo: cuenta la petición como carga (`services.quality`) mientras dura."""
+    with quality.track_request():
+        yield
+
+
+def _require_profiling_admin(request: Request) -> None:
+    """Los endpoints de perfiles solo existen con el perfilado habilitado y exigen el token de administración."""
+    if not config.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling.is_authorized(request.headers.get(config.PROFILING_HEADER)):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+def _discard_spooled_upload(native_path: Optional[str]) -> None:
+    """Elimina el volcado temporal de una radiografía nativa, si existe."""
+    if native_path is not None:
+        try:
+            os.remove(native_path)
+        except OSError as e:
+            logger.warning(f"Could not remove spooled upload {native_path}: {e}")
 
 # --- Endpoints ---
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    """Sirve la página principal HTML."""
-    logger.info("Root endpoint requested. Serving index.html.")
-    # Carga strings y opciones para la plantilla inicial
-    i18n_strings = load_strings(config.DEFAULT_LOCALE)
-    context = {
-        "request": request,
-        "clinical_options": options.get_clinical_options(),
-        "radiographic_options": options.get_radiographic_options(),
-        "explanations": { # Mover textos de explicación a i18n
-            "upload": i18n_strings.get("upload_explanation", ""),
-            "roi": i18n_strings.get("roi_explanation", ""),
-            "manual": i18n_strings.get("manual_explanation", ""),
-            "results": i18n_strings.get("results_explanation", ""),
-        },
-        "i18n": i18n_strings, # Pasar todos los strings a la plantilla
-        "results": None, # Sin resultados al inicio
-        "config": config  # AÑADIR ESTA LÍNEA
-    }
-    context["now"] = datetime.datetime.utcnow
-    return templates.TemplateResponse("index.html", context)
+    """
+    Sirve la página principal HTML (la "carcasa" sin resultados).
+
+    Solo depende de la configuración, las opciones y los textos i18n, así que se renderiza una vez por
+    proceso y se sirve cacheable (`Cache-Control` + `ETag`, 304 si no ha cambiado). Los resultados
+    llegan después como fragmento desde /calculate.
+    """
+    now = datetime.datetime.utcnow
+    key = (str(request.base_url), now().year) # `url_for` genera URLs absolutas; el pie muestra el año.
+    cached = _shell_cache.get(key)
+    if cached is None:
+        logger.info("Rendering index.html shell.")
+        # Carga strings y opciones para la plantilla inicial
+        i18n_strings = load_strings(config.DEFAULT_LOCALE)
+        context = {
+            "request": request,
+            "clinical_options": options.get_clinical_options(),
+            "radiographic_options": options.get_radiographic_options(),
+            "explanations": { # Mover textos de explicación a i18n
+                "upload": i18n_strings.get("upload_explanation", ""),
+                "roi": i18n_strings.get("roi_explanation", ""),
+                "manual": i18n_strings.get("manual_explanation", ""),
+                "results": i18n_strings.get("results_explanation", ""),
+            },
+            "i18n": i18n_strings, # Pasar todos los strings a la plantilla
+            "results": None, # Sin resultados al inicio
+            "config": config  # AÑADIR ESTA LÍNEA
+        }
+        context["now"] = now
+        body = templates.TemplateResponse("index.html", context).body
+        if len(_shell_cache) >= config.SHELL_CACHE_MAX_ENTRIES:
+            _shell_cache.clear() # La cabecera Host la controla el cliente: acotar las variantes.
+        cached = _shell_cache[key] = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={config.SHELL_CACHE_MAX_AGE_S}"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
 
-@app.post("/api/calculate", response_class=JSONResponse)
+@app.post("/api/calculate", response_class=JSONResponse, dependencies=[Depends(_track_analysis_load)])
 async def api_calculate(
+    request: Request,
     # Datos del formulario manual (FastAPI los parsea automáticamente)
     fistulae: int = Form(...),
     gingival_recession: int = Form(...),
@@ -67,14 +325,26 @@ async def api_calculate(
     tooth_surface: int = Form(...),
     # Datos ROI (como string JSON)
     roi_data: str = Form(...), # Recibimos como string
-    # Archivo de imagen
-    image: UploadFile = File(...)
+    # Archivo de imagen (opcional si se reanaliza una imagen almacenada por `image_sha256`)
+    image: Optional[UploadFile] = File(None),
+    # Identificador opcional del caballo (para el almacén de casos)
+    horse_id: Optional[str] = Form(None),
+    # Tolerancia Douglas-Peucker (px) para simplificar las ROIs; None = valor de config
+    roi_simplify_tolerance: Optional[float] = Form(None),
+    # Hash de una imagen ya ingerida (`AnalysisResult.image_sha256`) para reanalizarla sin subirla
+    image_sha256: Optional[str] = Form(None),
+    # Guardar los artefactos de extracción de ROIs (solo si el servidor lo permite: DEBUG_CAPTURE_ENABLED)
+    capture_debug: bool = Form(False),
+    # Modo "solo puntuación": DistEn solo en las ROIs que pueden cambiar la puntuación digital
+    score_only: bool = Form(False)
 ):
     """
     API para procesar datos y devolver resultados como JSON.
     Esta función contiene la misma lógica que handle_calculation pero devuelve JSON.
     """
     logger.info("API calculation endpoint received request.")
+    native_path: Optional[str] = None
+    timer = StageTimer()
 
     try:
         # 1. Validar datos manuales con Pydantic
@@ -86,33 +356,65 @@ async def api_calculate(
         )
         
         # 2. Validar y parsear datos ROI
-        roi_model = RoiData.parse_raw(roi_data)
-        validated_rois: List[List[Tuple[int, int]]] = roi_model.root
+        with timer.stage("roi_parse"):
+            try:
+                validated_rois = _parse_rois(roi_data, roi_simplify_tolerance)
+            except ValueError as e: # Incluye ValidationError de Pydantic y json.JSONDecodeError
+                logger.error(f"ROI data validation/parsing failed: {e}")
+                return JSONResponse(status_code=422, content={"error": f"Error en datos ROI: {e}"})
         
-        # 3. Leer contenido de la imagen
-        image_content: bytes = await image.read()
+        # 3. Leer contenido de la imagen (las radiografías nativas se vuelcan a disco)
+        #    o, para un reanálisis, su escala de grises canónica del almacén de imágenes.
+        image_content, stored_gray = None, None
+        if image is not None:
+            with timer.stage("upload_read"):
+                image_content, native_path = await _read_upload(image)
+        elif image_sha256:
+            with timer.stage("upload_read"):
+                stored_gray = await run_in_threadpool(profiling.sampled(image_store.load_canonical), image_sha256.lower())
+            if stored_gray is None:
+                return JSONResponse(status_code=404, content={"error": "Stored image not found"})
+        else:
+            return JSONResponse(status_code=422, content={"error": "Either image or image_sha256 is required"})
         
         # 4. Realizar análisis de textura
-        max_disten, digital_score, roi_details = await image_analysis.analyze_rois_texture(
-            image_content, validated_rois
+        capture_id = debug_capture.new_capture(capture_debug)
+        max_disten, digital_score, roi_details, digest, (tier, quality_reason) = await _analyze_upload(
+            image_content, native_path, validated_rois, timer, stored_gray=stored_gray, capture_id=capture_id, score_only=score_only
         )
+        if stored_gray is not None:
+            digest = image_sha256.lower()
 
-        # 5. Calcular puntuaciones manuales
-        clinical_score = scoring.calculate_clinical_score(manual_data)
-        radiographic_score = scoring.calculate_radiographic_score(manual_data)
+        with timer.stage("scoring"):
+            # 5. Calcular puntuaciones manuales
+            clinical_score = scoring.calculate_clinical_score(manual_data)
+            radiographic_score = scoring.calculate_radiographic_score(manual_data)
 
-        # 6. Calcular puntuación integrada y obtener resultados finales
-        analysis_results: AnalysisResult = scoring.calculate_integrated_score(
-            clinical_score=clinical_score,
-            radio_score=radiographic_score,
-            digital_score=digital_score,
-            max_dist_en_value=max_disten,
-            roi_analysis_details=roi_details
-        )
+            # 6. Calcular puntuación integrada y obtener resultados finales
+            analysis_results: AnalysisResult = scoring.calculate_integrated_score(
+                clinical_score=clinical_score,
+                radio_score=radiographic_score,
+                digital_score=digital_score,
+                max_dist_en_value=max_disten,
+                roi_analysis_details=roi_details
+            )
+            analysis_results.image_sha256 = digest
+            analysis_results.debug_capture_id = capture_id
+            analysis_results.quality_tier = tier.name
+            analysis_results.quality_reason = quality_reason
+            analysis_results.digital_score_estimated = any(d.skipped == "bound" for d in roi_details)
+            # 7. Registrar el caso (solo encola; la escritura es en segundo plano)
+            analysis_results.case_id = case_store.record_case(horse_id, manual_data, analysis_results, digest)
         
-        # Devolver los resultados como JSON
-        return analysis_results.dict()
+        # Devolver los resultados en el formato negociado (JSON por defecto, MessagePack/CBOR si se piden)
+        with timer.stage("serialize"):
+            response = model_response(analysis_results, request.headers.get("accept"))
+        timer.apply(response)
+        return response
         
+    except (memory_budget.MemoryBudgetExceeded, analysis_jobs.AnalysisJobTimeout) as e:
+        logger.warning(f"API request rejected: {e}")
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
     except Exception as e:
         logger.error(f"API error: {e}", exc_info=True)
         return JSONResponse(
@@ -120,9 +422,11 @@ async def api_calculate(
             content={"error": f"Error procesando los datos: {str(e)}"}
         )
     finally:
-        await image.close()
+        if image is not None:
+            await image.close()
+        _discard_spooled_upload(native_path)
 
-@app.post("/calculate", response_class=HTMLResponse)
+@app.post("/calculate", response_class=HTMLResponse, dependencies=[Depends(_track_analysis_load)])
 async def handle_calculation(
     request: Request,
     # Datos del formulario manual (FastAPI los parsea automáticamente)
@@ -139,13 +443,22 @@ async def handle_calculation(
     # Datos ROI (como string JSON)
     roi_data: str = Form(...), # Recibimos como string
     # Archivo de imagen
-    image: UploadFile = File(...)
+    image: UploadFile = File(...),
+    # Identificador opcional del caballo (para el almacén de casos)
+    horse_id: Optional[str] = Form(None),
+    # Tolerancia Douglas-Peucker (px) para simplificar las ROIs; None = valor de config
+    roi_simplify_tolerance: Optional[float] = Form(None),
+    # Guardar los artefactos de extracción de ROIs (solo si el servidor lo permite: DEBUG_CAPTURE_ENABLED)
+    capture_debug: bool = Form(False),
+    # Modo "solo puntuación": DistEn solo en las ROIs que pueden cambiar la puntuación digital
+    score_only: bool = Form(False)
 ):
     """
     Recibe los datos del formulario, la imagen y las ROIs, realiza los cálculos
     y devuelve la página de resultados.
     """
     logger.info("Calculation endpoint received request.")
+    timer = StageTimer()
 
     # 1. Validar datos manuales con Pydantic
     try:
@@ -163,38 +476,44 @@ async def handle_calculation(
 
     # 2. Validar y parsear datos ROI
     try:
-        # Directamente parsear y validar usando el RootModel desde el string JSON
-        roi_model = RoiData.parse_raw(roi_data)
-        # Acceder a los datos validados via el atributo .root
-        validated_rois: List[List[Tuple[int, int]]] = roi_model.root
+        # Decodificar (formato compacto o JSON clásico validado por `RoiData`) y simplificar
+        with timer.stage("roi_parse"):
+            validated_rois = _parse_rois(roi_data, roi_simplify_tolerance)
         logger.debug(f"ROI data validated successfully. Found {len(validated_rois)} ROIs.")
     except ValidationError as e:
         logger.error(f"ROI data validation/parsing failed: {e}")
-        logger.debug(f"Received ROI data string: {roi_data}")
+        logger.debug(f"Received ROI data string of {len(roi_data)} chars.")
         # Extraer detalles del error para mejor feedback
         error_details = e.errors()
         raise HTTPException(status_code=422, detail=f"Error en datos ROI: {error_details}")
     except json.JSONDecodeError as e:
         logger.error(f"Invalid JSON format for ROI data: {e}")
-        logger.debug(f"Received ROI data string: {roi_data}")
+        logger.debug(f"Received ROI data string of {len(roi_data)} chars.")
         raise HTTPException(status_code=422, detail="Error en datos ROI: Formato JSON inválido.")
+    except ValueError as e:
+        logger.error(f"Invalid compact ROI data: {e}")
+        raise HTTPException(status_code=422, detail=f"Error en datos ROI: {e}")
 
-    # 3. Leer contenido de la imagen
+    # 3. Leer contenido de la imagen (las radiografías nativas se vuelcan a disco)
     try:
-        image_content: bytes = await image.read()
-        logger.info(f"Image '{image.filename}' read successfully ({len(image_content)} bytes).")
+        with timer.stage("upload_read"):
+            image_content, native_path = await _read_upload(image)
+        logger.info(f"Image '{image.filename}' read successfully.")
     except Exception as e:
         logger.error(f"Failed to read uploaded image file: {e}")
         raise HTTPException(status_code=400, detail=f"Error al leer el archivo de imagen: {e}")
     finally:
         await image.close() # Siempre cerrar el archivo
 
-    # 4. Realizar análisis de textura (puede ser largo)
-    # Considerar ejecutar en threadpool si es necesario: asyncio.to_thread(image_analysis.analyze_rois_texture, ...)
+    # 4. Realizar análisis de textura (puede ser largo; se ejecuta en un hilo, ver `_analyze_upload`)
+    capture_id = debug_capture.new_capture(capture_debug)
     try:
-        max_disten, digital_score, roi_details = await image_analysis.analyze_rois_texture(
-            image_content, validated_rois
+        max_disten, digital_score, roi_details, digest, (tier, quality_reason) = await _analyze_upload(
+            image_content, native_path, validated_rois, timer, capture_id=capture_id, score_only=score_only
         )
+    except (memory_budget.MemoryBudgetExceeded, analysis_jobs.AnalysisJobTimeout) as e:
+        logger.warning(f"Request rejected: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         # Captura errores inesperados del propio servicio de análisis
         logger.error(f"Unexpected error during texture analysis: {e}", exc_info=True)
@@ -202,26 +521,50 @@ async def handle_calculation(
         max_disten = 0.0
         digital_score = 0
         roi_details = [RoiAnalysisDetail(roi_index=0, error=f"Analysis service error: {e}")]
+        digest = None
+        tier, quality_reason = quality.full_tier(), None
+    finally:
+        _discard_spooled_upload(native_path)
 
 
-    # 5. Calcular puntuaciones manuales
-    clinical_score = scoring.calculate_clinical_score(manual_data)
-    radiographic_score = scoring.calculate_radiographic_score(manual_data)
+    with timer.stage("scoring"):
+        # 5. Calcular puntuaciones manuales
+        clinical_score = scoring.calculate_clinical_score(manual_data)
+        radiographic_score = scoring.calculate_radiographic_score(manual_data)
 
-    # 6. Calcular puntuación integrada y obtener resultados finales
-    analysis_results: AnalysisResult = scoring.calculate_integrated_score(
-        clinical_score=clinical_score,
-        radio_score=radiographic_score,
-        digital_score=digital_score,
-        max_dist_en_value=max_disten,
-        roi_analysis_details=roi_details
-    )
+        # 6. Calcular puntuación integrada y obtener resultados finales
+        analysis_results: AnalysisResult = scoring.calculate_integrated_score(
+            clinical_score=clinical_score,
+            radio_score=radiographic_score,
+            digital_score=digital_score,
+            max_dist_en_value=max_disten,
+            roi_analysis_details=roi_details
+        )
+        analysis_results.image_sha256 = digest
+        analysis_results.debug_capture_id = capture_id
+        analysis_results.quality_tier = tier.name
+        analysis_results.quality_reason = quality_reason
+        analysis_results.digital_score_estimated = any(d.skipped == "bound" for d in roi_details)
+        # 7. Registrar el caso (solo encola; la escritura es en segundo plano)
+        analysis_results.case_id = case_store.record_case(horse_id, manual_data, analysis_results, digest)
 
     logger.info(f"Final integrated score: {analysis_results.puntuacio_total_integrada}, Classification: {analysis_results.classificacio}")
 
-    # Redirigir a la ruta raíz con los resultados en la sesión
-    # Pero volver a TemplateResponse para mantener compatibilidad mientras añadimos el endpoint API
     i18n_strings = load_strings(config.DEFAULT_LOCALE)
+    if request.headers.get(FRAGMENT_HEADER) == "results":
+        # Envío AJAX desde la página: solo el panel de resultados; el resto ya está en el navegador.
+        context = {
+            "request": request,
+            "results": analysis_results.dict(),
+            "i18n": i18n_strings,
+            "config": config,
+        }
+        with timer.stage("render"):
+            response = templates.TemplateResponse("partials/results.html", context, headers={"Vary": FRAGMENT_HEADER})
+        timer.apply(response)
+        return response
+
+    # Envío sin JavaScript: página completa con los resultados.
     context = {
         "request": request,
         "results": analysis_results.dict(), # Pasar como diccionario a la plantilla
@@ -237,7 +580,83 @@ async def handle_calculation(
          "config": config  # AÑADIR ESTA LÍNEA
     }
     context["now"] = datetime.datetime.utcnow
-    return templates.TemplateResponse("index.html", context)
+    with timer.stage("render"):
+        response = templates.TemplateResponse("index.html", context, headers={"Vary": FRAGMENT_HEADER})
+    timer.apply(response)
+    return response
+
+@app.get("/api/cases", response_class=JSONResponse)
+async def api_list_cases(
+    horse_id: Optional[str] = None,
+    date_from: Optional[str] = None, # ISO 8601 (p.ej. 2024-01-31)
+    date_to: Optional[str] = None,   # ISO 8601, inclusivo
+    limit: int = Query(config.CASE_STORE_PAGE_SIZE, ge=1, le=config.CASE_STORE_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0)
+):
+    """Lista paginada de casos registrados, del más reciente al más antiguo."""
+    return await run_in_threadpool(case_store.list_cases, horse_id, date_from, date_to, limit, offset)
+
+@app.get("/api/cases/{case_id}", response_class=JSONResponse)
+async def api_get_case(case_id: str):
+    """Devuelve un caso registrado con sus detalles por ROI."""
+    case = await run_in_threadpool(case_store.get_case, case_id)
+    if case is None:
+        raise HTTPException(status_code=404, detail="Case not found")
+    return case
+
+@app.get("/api/metrics/memory", response_class=JSONResponse)
+async def api_memory_metrics():
+    """Métricas de memoria del proceso: picos estimados, reservas en curso, colas y rechazos."""
+    return memory_budget.stats()
+
+@app.get("/api/metrics/quality", response_class=JSONResponse)
+async def api_quality_metrics():
+    """Nivel de calidad del análisis actual, carga considerada y peticiones atendidas con calidad reducida."""
+    return quality.stats()
+
+@app.get("/api/metrics/jobs", response_class=JSONResponse)
+async def api_job_metrics():
+    """Trabajos pendientes y en curso en la cola de los workers (solo con `ANALYSIS_WORKERS_ENABLED`)."""
+    if not config.ANALYSIS_WORKERS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    queue = job_queue.get_queue()
+    return {"backend": queue.name, **await run_in_threadpool(queue.stats)}
+
+@app.get("/api/admin/profiles", response_class=JSONResponse)
+async def api_list_profiles(request: Request):
+    """Lista los perfiles guardados (requiere el token de administración)."""
+    _require_profiling_admin(request)
+    return await run_in_threadpool(profiling.list_profiles)
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def api_get_profile(request: Request, profile_id: str, format: str = Query("speedscope", pattern="^(speedscope|collapsed)$")):
+    """Descarga un perfil: `speedscope` (abrir en https://www.speedscope.app) o `collapsed` (flamegraph.pl)."""
+    _require_profiling_admin(request)
+    path = profiling.profile_artifact_path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "application/json" if format == "speedscope" else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+@app.get("/api/debug/captures/{capture_id}", response_class=JSONResponse)
+async def api_list_debug_artifacts(capture_id: str):
+    """Lista los artefactos de una captura de depuración (`AnalysisResult.debug_capture_id`)."""
+    if not config.DEBUG_CAPTURE_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    artifacts = await run_in_threadpool(debug_capture.list_artifacts, capture_id)
+    if artifacts is None:
+        raise HTTPException(status_code=404, detail="Debug capture not found")
+    return {"capture_id": capture_id, "artifacts": artifacts}
+
+@app.get("/api/debug/captures/{capture_id}/{name}")
+async def api_get_debug_artifact(capture_id: str, name: str):
+    """Descarga un artefacto PNG de una captura de depuración."""
+    if not config.DEBUG_CAPTURE_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    path = await run_in_threadpool(debug_capture.artifact_path, capture_id, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Debug artifact not found")
+    return FileResponse(path, media_type="image/png")
 
 # --- Entry point (si se ejecuta directamente con uvicorn) ---
 if __name__ == "__main__":
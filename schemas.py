@@ -48,6 +48,10 @@ class RoiAnalysisDetail(BaseModel):
     roi_index: int
     dist_en: Optional[float] = None
     error: Optional[str] = None
+    skipped: Optional[str] = None # Modo "solo puntuación": "saturated" o "bound" si no se calculó DistEn
+    dist_en_bound: Optional[float] = None # Modo "solo puntuación": cota superior estimada de DistEn
+    texture_metrics: Optional[Dict[str, Optional[float]]] = None # Métricas adicionales de config.TEXTURE_METRICS (nombre -> valor)
+    texture_timings_ms: Optional[Dict[str, float]] = None # Tiempo por métrica (ms); `shared` = patrones y distancias comunes
 
 # Modelo para la respuesta completa del análisis
 class AnalysisResult(BaseModel):
@@ -58,4 +62,10 @@ class AnalysisResult(BaseModel):
     classificacio: str
     interpretacio: str
     max_dist_en_value: float
-    roi_analysis_details: List[RoiAnalysisDetail]
\ No newline at end of file
+    roi_analysis_details: List[RoiAnalysisDetail]
+    case_id: Optional[str] = None # Identificador en el almacén de casos (si se ha registrado)
+    image_sha256: Optional[str] = None # SHA-256 de la imagen original (permite reanalizar sin volver a subirla)
+    debug_capture_id: Optional[str] = None # Captura de depuración (si se pidió y el servidor la permite)
+    quality_tier: str = "full" # Nivel de calidad del análisis (`services.quality`); otro valor = calidad reducida por carga
+    quality_reason: Optional[str] = None # Motivo de la calidad reducida (carga observada frente al límite)
+    digital_score_estimated: bool = False # Modo "solo puntuación": se omitieron ROIs por una cota empírica (`skipped="bound"`)
\ No newline at end of file
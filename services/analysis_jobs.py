@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import io
+import logging
+import os
+import tempfile
+import time
+import traceback
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from schemas import RoiAnalysisDetail
+from services import image_analysis, image_store, job_queue, memory_budget, quality
+
+logger = logging.getLogger(__name__)
+
+# --- Análisis en Workers Remotos ---
+# OBJETIVO: Con `ANALYSIS_WORKERS_ENABLED`, el servidor web no analiza: encola la petición en
+#           `services.job_queue` y espera a que un proceso `worker.py` (en este u otro nodo) la resuelva.
+# CÓMO:
+#   - Trabajo: metadatos JSON (ROIs, modo, nivel de calidad, captura) + la imagen como blob:
+#       "encoded": el archivo JPEG/PNG subido; el worker lo ingiere en su `image_store` y lo analiza.
+#       "native":  el TIFF/DICOM volcado a disco; el worker lo vuelca a su propio disco para el memmap.
+#       "gray":    la imagen canónica de un reanálisis, ya decodificada en el servidor web (enviada como `.npy`).
+#   - Resultado: los mismos valores que el análisis local (máximo, puntuación, detalles por ROI, hash) más
+#     el tiempo de análisis del worker, para separar en `Server-Timing` la espera en cola del cálculo.
+#   - El nivel de calidad lo elige el servidor web (`services.quality`): es quien ve la carga total.
+# LIMITACIÓN: El worker escribe la imagen canónica y las capturas de depuración en SU disco. Para reanalizar
+#             por `image_sha256` o descargar capturas desde el servidor web, `IMAGE_STORE_DIR` y
+#             `DEBUG_CAPTURE_DIR` deben estar en almacenamiento compartido.
+
+AnalysisOutcome = Tuple[float, int, List[RoiAnalysisDetail], Optional[str]]
+
+
+class AnalysisJobTimeout(Exception):
+    """Ningún worker resolvió el trabajo a tiempo (`JOB_QUEUE_RESULT_TIMEOUT_S`)."""
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# --- Lado del servidor web ---
+
+def encode_job(
+    image_content: Optional[bytes],
+    native_path: Optional[str],
+    stored_gray: Optional[np.ndarray],
+    rois: List[np.ndarray],
+    capture_id: Optional[str],
+    score_only: bool,
+    tier: quality.QualityTier
+) -> Tuple[Dict[str, Any], bytes]:
+    """Metadatos y blob del trabajo para una petición (mismos argumentos que `main._analyze_upload`)."""
+    meta: Dict[str, Any] = {
+        "rois": [np.asarray(roi).tolist() for roi in rois],
+        "capture_id": capture_id,
+        "score_only": score_only,
+        "tier": list(tier),
+        "submitted_at": time.time(),
+    }
+    if native_path is not None:
+        meta["kind"] = "native"
+        meta["suffix"] = os.path.splitext(native_path)[1]
+        with open(native_path, "rb") as f:
+            blob = f.read()
+    elif stored_gray is not None:
+        meta["kind"] = "gray"
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(stored_gray), allow_pickle=False)
+        blob = buffer.getvalue()
+    else:
+        meta["kind"] = "encoded"
+        blob = image_content or b""
+    return meta, blob
+
+
+def decode_result(result: Dict[str, Any]) -> AnalysisOutcome:
+    """Convierte el resultado JSON de un worker en la tupla de `main._analyze_upload`."""
+    # `model_construct`: el worker ya construyó los detalles con el mismo esquema.
+    details = [RoiAnalysisDetail.model_construct(**detail) for detail in result["details"]]
+    return float(result["max_dist_en"]), int(result["digital_score"]), details, result.get("image_sha256")
+
+
+async def run_remote(meta: Dict[str, Any], blob: bytes) -> Tuple[AnalysisOutcome, float]:
+    """
+    Encola el trabajo y espera su resultado sin bloquear el event loop (las operaciones de la cola van a
+    un hilo). Retorna (resultado, ms de análisis en el worker).
+
+    Raises:
+        AnalysisJobTimeout: Si no hay resultado tras `JOB_QUEUE_RESULT_TIMEOUT_S` (el trabajo se cancela).
+    """
+    queue = job_queue.get_queue()
+    job_id = uuid.uuid4().hex
+    await asyncio.to_thread(queue.submit, job_id, meta, blob)
+    deadline = time.monotonic() + config.JOB_QUEUE_RESULT_TIMEOUT_S
+    # Espera creciente: los análisis cortos se recogen enseguida y los largos no consultan la cola sin parar.
+    interval = config.JOB_QUEUE_RESULT_POLL_S
+    try:
+        while True:
+            result = await asyncio.to_thread(queue.fetch_result, job_id)
+            if result is not None:
+                return decode_result(result), float(result.get("analysis_ms", 0.0))
+            if time.monotonic() >= deadline:
+                raise AnalysisJobTimeout(
+                    f"No analysis worker finished job {job_id} within {config.JOB_QUEUE_RESULT_TIMEOUT_S:.0f}s."
+                )
+            await asyncio.sleep(interval)
+            interval = min(interval * 1.5, config.JOB_QUEUE_RESULT_POLL_MAX_S)
+    except BaseException:
+        # Timeout o petición cancelada: que ningún worker pierda tiempo con ella.
+        await asyncio.to_thread(queue.cancel, job_id)
+        raise
+
+
+# --- Lado del worker ---
+
+async def execute_job(meta: Dict[str, Any], blob: bytes) -> Dict[str, Any]:
+    """
+    Ejecuta el análisis de un trabajo dentro del presupuesto de memoria del worker y devuelve el
+    resultado JSON. Los errores se devuelven como detalle de error (igual que en el análisis local).
+    """
+    rois = [np.asarray(roi, dtype=np.int32) for roi in meta["rois"]]
+    name, target_size, max_roi_pixels = meta["tier"]
+    tier = quality.QualityTier(name, tuple(target_size), max_roi_pixels)
+    capture_id, score_only = meta.get("capture_id"), bool(meta.get("score_only"))
+    kind = meta["kind"]
+    native_path = None
+    digest = None
+    start = time.perf_counter()
+    try:
+        if kind == "native":
+            fd, native_path = tempfile.mkstemp(suffix=meta.get("suffix", ""), dir=config.NATIVE_IMAGE_SPOOL_DIR)
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            estimate = memory_budget.estimate_native_radiograph_bytes(native_path, rois)
+        elif kind == "gray":
+            img_gray = np.load(io.BytesIO(blob), allow_pickle=False)
+            estimate = memory_budget.estimate_gray_image_bytes(img_gray.shape)
+        else:
+            estimate = memory_budget.estimate_decoded_image_bytes(blob)
+
+        async with memory_budget.reserve(estimate):
+            tracker = memory_budget.MemoryTracker("analysis")
+            try:
+                if kind == "native":
+                    outcome = await image_analysis.analyze_native_radiograph(native_path, rois, tracker, capture_id, score_only, tier)
+                else:
+                    if kind == "encoded":
+                        img_gray, digest, _ = await asyncio.to_thread(image_store.ingest, blob)
+                        if img_gray is None:
+                            digest = None # Nada almacenado: no hay imagen que reanalizar.
+                    outcome = await image_analysis.analyze_gray_image(img_gray, rois, tracker, capture_id, score_only, tier)
+            finally:
+                tracker.finish()
+        max_disten, digital_score, details = outcome
+    except memory_budget.MemoryBudgetExceeded as e:
+        logger.warning(f"Analysis job rejected by the worker memory budget: {e}")
+        max_disten, digital_score = 0.0, 0
+        details = [RoiAnalysisDetail(roi_index=0, error=str(e))]
+    except Exception as e:
+        logger.error(f"Unexpected error during texture analysis: {e}")
+        logger.debug(traceback.format_exc())
+        max_disten, digital_score = 0.0, 0
+        details = [RoiAnalysisDetail(roi_index=0, error=f"Analysis service error: {e}")]
+    finally:
+        if native_path is not None:
+            try:
+                os.remove(native_path)
+            except OSError as e:
+                logger.warning(f"Could not remove spooled job image {native_path}: {e}")
+    return {
+        "max_dist_en": max_disten,
+        "digital_score": digital_score,
+        "details": [detail.model_dump() for detail in details],
+        "image_sha256": digest,
+        "analysis_ms": (time.perf_counter() - start) * 1000,
+    }
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+from schemas import ManualFormData, AnalysisResult
+
+logger = logging.getLogger(__name__)
+
+# --- Almacén Persistente de Casos (SQLite) ---
+# OBJETIVO: Guardar cada caso analizado (puntuaciones manuales, resultado integrado y
+#           detalle por ROI) para poder comparar revisiones de un mismo caballo en el tiempo.
+# CÓMO:
+#   - La ruta HTTP solo encola el caso (`record_case`), sin tocar disco.
+#   - Un hilo escritor en segundo plano agrupa los casos pendientes y los inserta en
+#     lotes dentro de una única transacción (`executemany`).
+#   - La base de datos usa WAL para que las lecturas (endpoints de consulta) no
+#     bloqueen al escritor ni viceversa.
+#   - Índices por caballo + fecha y por fecha respaldan las consultas paginadas.
+
+MANUAL_FIELDS: Tuple[str, ...] = tuple(ManualFormData.model_fields)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS cases (
+    case_id TEXT PRIMARY KEY,
+    horse_id TEXT,
+    created_at TEXT NOT NULL,
+    image_sha256 TEXT,
+    {", ".join(f"{field} INTEGER NOT NULL" for field in MANUAL_FIELDS)},
+    puntuacio_clinica INTEGER NOT NULL,
+    puntuacio_radio INTEGER NOT NULL,
+    puntuacio_digital INTEGER NOT NULL,
+    puntuacio_total_integrada INTEGER NOT NULL,
+    classificacio TEXT NOT NULL,
+    max_dist_en_value REAL NOT NULL,
+    quality_tier TEXT
+);
+CREATE TABLE IF NOT EXISTS roi_details (
+    case_id TEXT NOT NULL REFERENCES cases(case_id),
+    roi_index INTEGER NOT NULL,
+    dist_en REAL,
+    error TEXT,
+    detail_json TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cases_horse_created ON cases(horse_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_cases_created ON cases(created_at);
+CREATE INDEX IF NOT EXISTS idx_roi_details_case ON roi_details(case_id);
+"""
+
+_CASE_COLUMNS: Tuple[str, ...] = (
+    "case_id", "horse_id", "created_at", "image_sha256", *MANUAL_FIELDS,
+    "puntuacio_clinica", "puntuacio_radio", "puntuacio_digital",
+    "puntuacio_total_integrada", "classificacio", "max_dist_en_value", "quality_tier",
+)
+_INSERT_CASE_SQL = f"INSERT INTO cases ({', '.join(_CASE_COLUMNS)}) VALUES ({', '.join('?' * len(_CASE_COLUMNS))})"
+_INSERT_ROI_SQL = "INSERT INTO roi_details (case_id, roi_index, dist_en, error, detail_json) VALUES (?, ?, ?, ?, ?)"
+
+# Estado del escritor en segundo plano (un único hilo por proceso).
+_queue: "queue.Queue[Optional[Tuple[tuple, List[tuple]]]]" = queue.Queue(maxsize=config.CASE_STORE_QUEUE_MAXSIZE)
+_writer_thread: Optional[threading.Thread] = None
+
+
+def _connect() -> sqlite3.Connection:
+    """Abre una conexión con WAL activado (el modo WAL persiste en el archivo)."""
+    conn = sqlite3.connect(config.CASE_STORE_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL") # Seguro con WAL; evita un fsync por transacción.
+    return conn
+
+
+def init_store() -> None:
+    """Crea el archivo, las tablas y los índices si no existen."""
+    directory = os.path.dirname(config.CASE_STORE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = _connect()
+    try:
+        conn.executescript(_SCHEMA)
+        # Migraciones: almacenes creados antes de guardar el hash de la imagen / el nivel de calidad.
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(cases)")}
+        if "image_sha256" not in columns:
+            conn.execute("ALTER TABLE cases ADD COLUMN image_sha256 TEXT")
+        if "quality_tier" not in columns:
+            conn.execute("ALTER TABLE cases ADD COLUMN quality_tier TEXT") # NULL en casos antiguos = "full".
+        # `detail_json`: `RoiAnalysisDetail` completo (omisiones, cotas, métricas adicionales...).
+        roi_columns = {row["name"] for row in conn.execute("PRAGMA table_info(roi_details)")}
+        if "detail_json" not in roi_columns:
+            conn.execute("ALTER TABLE roi_details ADD COLUMN detail_json TEXT")
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info(f"Case store ready at {config.CASE_STORE_PATH} (WAL mode).")
+
+
+def start_writer() -> None:
+    """Inicializa el almacén y arranca el hilo escritor si no está en marcha."""
+    global _writer_thread
+    if not config.CASE_STORE_ENABLED or (_writer_thread is not None and _writer_thread.is_alive()):
+        return
+    init_store()
+    _writer_thread = threading.Thread(target=_writer_loop, name="case-store-writer", daemon=True)
+    _writer_thread.start()
+
+
+def stop_writer(timeout: float = 5.0) -> None:
+    """Vacía la cola pendiente y detiene el hilo escritor."""
+    global _writer_thread
+    if _writer_thread is None:
+        return
+    _queue.put(None) # Centinela de parada (bloqueante: nunca debe perderse).
+    _writer_thread.join(timeout)
+    _writer_thread = None
+
+
+def _writer_loop() -> None:
+    """Bucle del hilo escritor: agrupa casos de la cola y los inserta por lotes."""
+    conn = _connect()
+    try:
+        running = True
+        while running:
+            item = _queue.get() # Espera bloqueante hasta el primer caso del lote.
+            batch = []
+            if item is None:
+                running = False
+            else:
+                batch.append(item)
+            # Acumular más casos durante como máximo FLUSH_INTERVAL o hasta BATCH_SIZE.
+            deadline = time.monotonic() + config.CASE_STORE_FLUSH_INTERVAL_S
+            while running and len(batch) < config.CASE_STORE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = _queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                else:
+                    batch.append(item)
+            if batch:
+                _write_batch(conn, batch)
+    finally:
+        conn.close()
+
+
+def _write_batch(conn: sqlite3.Connection, batch: List[Tuple[tuple, List[tuple]]]) -> None:
+    try:
+        with conn: # Una transacción por lote.
+            conn.executemany(_INSERT_CASE_SQL, [case_row for case_row, _ in batch])
+            conn.executemany(_INSERT_ROI_SQL, [roi_row for _, roi_rows in batch for roi_row in roi_rows])
+        logger.debug(f"Case store: wrote batch of {len(batch)} cases.")
+    except sqlite3.Error as e:
+        logger.error(f"Case store: failed to write batch of {len(batch)} cases: {e}")
+
+
+def record_case(
+    horse_id: Optional[str],
+    manual_data: ManualFormData,
+    result: AnalysisResult,
+    image_sha256: Optional[str] = None
+) -> Optional[str]:
+    """
+    Encola un caso para su escritura en segundo plano. No realiza E/S.
+
+    Returns:
+        El identificador asignado al caso, o None si el almacén está desactivado o la cola está llena
+        (en ese caso el caso se descarta y se registra un aviso; nunca se bloquea la petición).
+    """
+    if not config.CASE_STORE_ENABLED:
+        return None
+    case_id = uuid.uuid4().hex
+    created_at = datetime.datetime.utcnow().isoformat(timespec="seconds")
+    case_row = (
+        case_id, horse_id or None, created_at, image_sha256,
+        *(getattr(manual_data, field) for field in MANUAL_FIELDS),
+        result.puntuacio_clinica, result.puntuacio_radio, result.puntuacio_digital,
+        result.puntuacio_total_integrada, result.classificacio, result.max_dist_en_value, result.quality_tier,
+    )
+    # `dist_en`/`error` en columnas propias para consultas; el detalle completo, como JSON.
+    roi_rows = [(case_id, d.roi_index, d.dist_en, d.error, json.dumps(d.model_dump()))
+                for d in result.roi_analysis_details]
+    try:
+        _queue.put_nowait((case_row, roi_rows))
+    except queue.Full:
+        logger.warning("Case store queue is full; case not recorded.")
+        return None
+    return case_id
+
+
+# --- Consultas (se ejecutan en el threadpool desde los endpoints) ---
+
+def _store_exists() -> bool:
+    """Con el almacén desactivado o aún sin crear no hay casos (y no se crea un archivo vacío al consultar)."""
+    return config.CASE_STORE_ENABLED and os.path.isfile(config.CASE_STORE_PATH)
+
+
+def list_cases(
+    horse_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = config.CASE_STORE_PAGE_SIZE,
+    offset: int = 0
+) -> Dict[str, Any]:
+    """
+    Lista casos ordenados del más reciente al más antiguo, filtrando por caballo y/o rango de fechas
+    (ISO 8601, `date_to` inclusivo a nivel de prefijo). Usa los índices `idx_cases_*`.
+
+    Returns:
+        {"items": [...], "limit": int, "offset": int, "has_more": bool}
+    """
+    limit = max(1, min(limit, config.CASE_STORE_MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    empty = {"items": [], "limit": limit, "offset": offset, "has_more": False}
+    if not _store_exists():
+        return empty
+    clauses, params = [], []
+    if horse_id:
+        clauses.append("horse_id = ?")
+        params.append(horse_id)
+    if date_from:
+        clauses.append("created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        clauses.append("created_at <= ?")
+        params.append(date_to + "\uffff") # Incluye todo el día/hora indicada como prefijo.
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"SELECT * FROM cases {where} ORDER BY created_at DESC, case_id DESC LIMIT ? OFFSET ?"
+
+    conn = _connect()
+    try:
+        # Se pide una fila extra para saber si hay página siguiente sin un COUNT(*).
+        rows = conn.execute(sql, (*params, limit + 1, offset)).fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Case store not readable ({e}); returning no cases.")
+        return empty
+    finally:
+        conn.close()
+    return {
+        "items": [dict(row) for row in rows[:limit]],
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(rows) > limit,
+    }
+
+
+def get_case(case_id: str) -> Optional[Dict[str, Any]]:
+    """Devuelve un caso con sus detalles por ROI, o None si no existe (o no hay almacén)."""
+    if not _store_exists():
+        return None
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM cases WHERE case_id = ?", (case_id,)).fetchone()
+        if row is None:
+            return None
+        rois = conn.execute(
+            "SELECT roi_index, dist_en, error, detail_json FROM roi_details WHERE case_id = ? ORDER BY roi_index",
+            (case_id,)
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Case store not readable ({e}); case {case_id} not found.")
+        return None
+    finally:
+        conn.close()
+    case = dict(row)
+    # Casos anteriores a `detail_json`: solo se guardaron `dist_en` y `error`.
+    case["roi_analysis_details"] = [
+        json.loads(r["detail_json"]) if r["detail_json"] else
+        {"roi_index": r["roi_index"], "dist_en": r["dist_en"], "error": r["error"]}
+        for r in rois
+    ]
+    return case
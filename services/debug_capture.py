@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Captura de Artefactos de Depuración por Petición ---
+# OBJETIVO: Poder inspeccionar la extracción de ROIs (máscara, dilatación, píxeles extraídos) en un
+#           servidor con carga, sin que las peticiones se pisen entre sí ni bloqueen el event loop.
+# CÓMO:
+#   - La captura se pide POR PETICIÓN (campo de formulario `capture_debug`) y solo se concede si el
+#     servidor la permite (`DEBUG_CAPTURE_ENABLED`). Cada captura recibe un identificador propio y
+#     sus archivos van a `DEBUG_CAPTURE_DIR/<capture_id>/roi<N>_*.png`: no hay nombres fijos compartidos.
+#   - `_extract_roi_pixels` solo ENCOLA referencias a los arrays ya calculados; el dibujo y la
+#     codificación PNG los hace un hilo escritor en segundo plano. Sin captura, el coste es una
+#     comprobación `if capture_id is None`.
+#   - Las capturas se borran pasado `DEBUG_CAPTURE_RETENTION_S` o si se supera `DEBUG_CAPTURE_MAX_CAPTURES`.
+#   - Se sirven desde `/api/debug/captures/{capture_id}`.
+
+ARTIFACT_NAMES = ("original_with_roi", "mask", "mask_dilated", "extracted_pixels")
+
+# Elemento de la cola: (capture_id, roi_index, image, roi_vertices, polygon, mask, mask_dilated)
+_queue: "queue.Queue[Optional[Tuple[Any, ...]]]" = queue.Queue(maxsize=config.DEBUG_CAPTURE_QUEUE_MAXSIZE)
+_writer_thread: Optional[threading.Thread] = None
+_last_purge = 0.0
+
+
+def new_capture(requested: bool) -> Optional[str]:
+    """Devuelve un identificador de captura si la petición la pide y el servidor la permite; si no, None."""
+    if not requested:
+        return None
+    if not config.DEBUG_CAPTURE_ENABLED:
+        logger.warning("Debug capture requested but DEBUG_CAPTURE_ENABLED is False; ignoring.")
+        return None
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def submit_roi(
+    capture_id: str,
+    roi_index: int,
+    image: np.ndarray,
+    roi_vertices: np.ndarray,
+    polygon: np.ndarray,
+    mask: np.ndarray,
+    mask_dilated: np.ndarray
+) -> None:
+    """Encola los artefactos de una ROI. No realiza E/S ni copia la imagen (los arrays no se modifican después)."""
+    try:
+        _queue.put_nowait((capture_id, roi_index, image, roi_vertices, polygon, mask, mask_dilated))
+    except queue.Full:
+        logger.warning(f"Debug capture queue is full; ROI {roi_index} of capture {capture_id} not saved.")
+
+
+# --- Hilo escritor ---
+
+def start_writer() -> None:
+    """Arranca el hilo escritor si la captura está permitida y no está en marcha."""
+    global _writer_thread
+    if not config.DEBUG_CAPTURE_ENABLED or (_writer_thread is not None and _writer_thread.is_alive()):
+        return
+    os.makedirs(config.DEBUG_CAPTURE_DIR, exist_ok=True)
+    _writer_thread = threading.Thread(target=_writer_loop, name="debug-capture-writer", daemon=True)
+    _writer_thread.start()
+
+
+def stop_writer(timeout: float = 10.0) -> None:
+    """Termina de escribir lo pendiente y detiene el hilo escritor."""
+    global _writer_thread
+    if _writer_thread is None:
+        return
+    _queue.put(None) # Centinela de parada (bloqueante: nunca debe perderse).
+    _writer_thread.join(timeout)
+    _writer_thread = None
+
+
+def _writer_loop() -> None:
+    while True:
+        try:
+            item = _queue.get(timeout=config.DEBUG_CAPTURE_PURGE_INTERVAL_S)
+        except queue.Empty:
+            item = ()
+        if item is None:
+            break
+        if item:
+            try:
+                _write_roi_artifacts(*item)
+            except Exception as e:
+                logger.error(f"Error saving debug artifacts for capture {item[0]}: {e}")
+        _maybe_purge()
+
+
+def _write_roi_artifacts(
+    capture_id: str,
+    roi_index: int,
+    image: np.ndarray,
+    roi_vertices: np.ndarray,
+    polygon: np.ndarray,
+    mask: np.ndarray,
+    mask_dilated: np.ndarray
+) -> None:
+    directory = os.path.join(config.DEBUG_CAPTURE_DIR, capture_id)
+    os.makedirs(directory, exist_ok=True)
+
+    # Imagen original con los vértices del ROI dibujados.
+    img_with_roi = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image.copy()
+    for x, y in roi_vertices.tolist():
+        cv2.circle(img_with_roi, (x, y), 5, (0, 0, 255), -1) # Rojo para originales
+    for x, y in polygon.tolist():
+        cv2.circle(img_with_roi, (x, y), 3, (0, 255, 0), -1) # Verde para ajustados
+    cv2.polylines(img_with_roi, [polygon], True, (255, 255, 0), 2) # Amarillo para el polígono
+
+    # Visualizar los píxeles extraídos.
+    extracted_visualization = np.zeros_like(image)
+    selected = mask_dilated == 255
+    extracted_visualization[selected] = image[selected]
+
+    for name, artifact in zip(ARTIFACT_NAMES, (img_with_roi, mask, mask_dilated, extracted_visualization)):
+        cv2.imwrite(os.path.join(directory, f"roi{roi_index}_{name}.png"), artifact)
+    logger.debug(f"Debug artifacts for ROI {roi_index} saved to capture {capture_id}.")
+
+
+def _maybe_purge() -> None:
+    """Aplica la retención (antigüedad y número máximo de capturas) como mucho una vez por intervalo."""
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < config.DEBUG_CAPTURE_PURGE_INTERVAL_S:
+        return
+    _last_purge = now
+    captures = list_captures()
+    for index, capture in enumerate(captures): # Del más reciente al más antiguo.
+        if index >= config.DEBUG_CAPTURE_MAX_CAPTURES or now - capture["created_at"] > config.DEBUG_CAPTURE_RETENTION_S:
+            shutil.rmtree(os.path.join(config.DEBUG_CAPTURE_DIR, capture["capture_id"]), ignore_errors=True)
+            logger.debug(f"Debug capture {capture['capture_id']} purged.")
+
+
+# --- Consulta (endpoints) ---
+
+def _is_valid_id(capture_id: str) -> bool:
+    return bool(capture_id) and capture_id.replace("-", "").isalnum()
+
+
+def list_captures() -> List[Dict[str, Any]]:
+    """Capturas existentes, de la más reciente a la más antigua."""
+    if not os.path.isdir(config.DEBUG_CAPTURE_DIR):
+        return []
+    captures = [
+        {"capture_id": entry.name, "created_at": entry.stat().st_mtime}
+        for entry in os.scandir(config.DEBUG_CAPTURE_DIR) if entry.is_dir()
+    ]
+    captures.sort(key=lambda c: c["capture_id"], reverse=True)
+    return captures
+
+
+def list_artifacts(capture_id: str) -> Optional[List[str]]:
+    """Nombres de los archivos de una captura, o None si no existe."""
+    directory = os.path.join(config.DEBUG_CAPTURE_DIR, capture_id)
+    if not _is_valid_id(capture_id) or not os.path.isdir(directory):
+        return None
+    return sorted(os.listdir(directory))
+
+
+def artifact_path(capture_id: str, name: str) -> Optional[str]:
+    """Ruta de un artefacto concreto, o None si no existe o el nombre no es válido."""
+    artifacts = list_artifacts(capture_id)
+    if artifacts is None or name not in artifacts:
+        return None
+    return os.path.join(config.DEBUG_CAPTURE_DIR, capture_id, name)
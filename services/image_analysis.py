@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import cv2
 import numpy as np
 from skimage.transform import resize
@@ -6,7 +7,7 @@ from skimage import exposure
 import json
 import logging
 import traceback
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Optional, Union
 
 # --- Dependencia Externa Clave: EntropyHub ---
 # OBJETIVO: Utilizar la función DistEn2D para cuantificar la complejidad textural.
@@ -22,54 +23,64 @@ except ImportError:
 # --- Importaciones Internas ---
 import config # Archivo de configuración (umbrales, tamaño de ROI, mapeo de puntuación).
 from schemas import RoiData, RoiAnalysisDetail # Modelos Pydantic para validación y estructura de datos.
+from services import radiograph_io # Ingesta de radiografías nativas (TIFF 16-bit / DICOM) vía memmap.
+from services import debug_capture # Artefactos de depuración por petición (escritos en segundo plano).
+from services import texture_metrics # Motor de métricas de textura 2D (DistEn2D y métricas adicionales en una pasada).
+from services import quality # Niveles de calidad del análisis adaptativos a la carga.
+from services import profiling # Perfilado bajo demanda (muestrea los hilos de la petición).
+from services.memory_budget import MemoryTracker # Contabilidad de memoria por etapa.
 from utils.i18n import load_strings # Para cargar mensajes de error traducibles.
 
 logger = logging.getLogger(__name__) # Logger estándar de Python.
 # Cargar cadenas de texto (mensajes de error, etc.) para el idioma por defecto.
 i18n_strings = load_strings(config.DEFAULT_LOCALE)
 
-# Flag para habilitar visualizaciones de depuración
-DEBUG_VISUALIZE = False  # Cambiar a True para habilitar visualizaciones de depuración
-
 # --- Funciones Auxiliares (Descomposición Funcional) ---
 # Dividir el proceso en funciones más pequeñas mejora la legibilidad y mantenibilidad.
 
 # --- PASO 3 (por ROI): Extracción de Píxeles ---
-def _extract_roi_pixels(image: np.ndarray, roi_vertices: List[Tuple[int, int]]) -> Optional[np.ndarray]:
+def _extract_roi_pixels(
+    image: np.ndarray,
+    roi_vertices: np.ndarray,
+    capture_id: Optional[str] = None,
+    roi_index: int = 0
+) -> Optional[np.ndarray]:
     """
     Extrae los píxeles de la imagen que caen dentro de una ROI poligonal.
 
     OBJETIVO: Aislar los píxeles específicos que el usuario ha seleccionado para analizar.
     ORIGEN: `image` es la imagen original en escala de grises (`img_prepared`).
             `roi_vertices` son las coordenadas [x, y] de UN polígono ROI, provenientes
-            del frontend (transformadas a coordenadas originales).
+            del frontend (transformadas a coordenadas originales) y decodificadas por
+            `services.roi_codec` como array (n, 2).
     DESTINO: El array 1D de valores de píxeles (uint8) de la ROI, que se pasará a `_preprocess_roi_for_disten`.
 
     Args:
         image: Imagen NumPy en escala de grises (preparada).
-        roi_vertices: Lista de tuplas (x, y) definiendo los vértices de la ROI en coordenadas de la imagen original.
+        roi_vertices: Array (n, 2) de vértices (x, y) de la ROI en coordenadas de la imagen original.
+        capture_id: Captura de depuración de la petición (`services.debug_capture`), o None si no se pidió.
+        roi_index: Índice 1-based de la ROI (nombre de los artefactos de depuración).
 
     Returns:
         Array NumPy 1D con los valores de los píxeles de la ROI, o None si la ROI es inválida o no contiene píxeles.
     """
     logger.debug(f"[DEBUG] _extract_roi_pixels: Input image shape={image.shape}, dtype={image.dtype}")
-    # Los vértices vienen del frontend (JSON), ya validados >= 3 puntos por `RoiData` schema.
-    logger.debug(f"[DEBUG] _extract_roi_pixels: Input roi_vertices={roi_vertices}")
+    # Los vértices vienen del frontend, ya validados >= 3 puntos por `services.roi_codec`.
+    # No se registran completos: un trazo a mano alzada puede tener miles de vértices.
+    roi_vertices = np.asarray(roi_vertices, dtype=np.int32).reshape(-1, 2) # OpenCV necesita int32.
+    logger.debug(f"[DEBUG] _extract_roi_pixels: Input roi_vertices count={len(roi_vertices)}")
     
     # Verificar y ajustar las coordenadas para asegurarse de que estén dentro de los límites de la imagen
     h, w = image.shape[:2]
-    adjusted_vertices = []
-    for x, y in roi_vertices:
-        # Limitar las coordenadas al rango válido de la imagen
-        adj_x = max(0, min(x, w-1))
-        adj_y = max(0, min(y, h-1))
-        adjusted_vertices.append((adj_x, adj_y))
+    polygon = roi_vertices.copy()
+    np.clip(polygon[:, 0], 0, w - 1, out=polygon[:, 0])
+    np.clip(polygon[:, 1], 0, h - 1, out=polygon[:, 1])
     
     # Registrar si hubo ajustes
-    if adjusted_vertices != roi_vertices:
-        logger.warning(f"ROI vertices were adjusted to fit image boundaries. Original: {roi_vertices}, Adjusted: {adjusted_vertices}")
-    
-    polygon = np.array(adjusted_vertices, dtype=np.int32) # OpenCV necesita int32.
+    n_adjusted = int(np.count_nonzero((polygon != roi_vertices).any(axis=1)))
+    if n_adjusted:
+        logger.warning(f"{n_adjusted} of {len(roi_vertices)} ROI vertices were adjusted to fit image boundaries ({w}x{h}).")
+
     logger.debug(f"[DEBUG] _extract_roi_pixels: Polygon array shape={polygon.shape}, dtype={polygon.dtype}")
 
     # Validación básica (aunque redundante si el schema funcionó).
@@ -93,38 +104,10 @@ def _extract_roi_pixels(image: np.ndarray, roi_vertices: List[Tuple[int, int]])
     mask_dilated = cv2.dilate(mask, kernel, iterations = 1) # 1 iteración es suficiente para una expansión mínima.
     logger.debug(f"[DEBUG] _extract_roi_pixels: Non-zero in mask after dilation={np.count_nonzero(mask_dilated)}")
 
-    # Guardar imágenes de debug si la visualización está habilitada
-    if DEBUG_VISUALIZE:
-        try:
-            import os
-            os.makedirs("debug_images", exist_ok=True)
-            
-            # Guardar la imagen original con los vértices del ROI dibujados
-            img_with_roi = image.copy()
-            if len(img_with_roi.shape) == 2:  # Si es grayscale, convertir a RGB
-                img_with_roi = cv2.cvtColor(img_with_roi, cv2.COLOR_GRAY2BGR)
-            
-            # Dibujar los vértices originales (en rojo) y ajustados (en verde)
-            for i, (x, y) in enumerate(roi_vertices):
-                cv2.circle(img_with_roi, (x, y), 5, (0, 0, 255), -1)  # Rojo para originales
-            
-            for i, (x, y) in enumerate(adjusted_vertices):
-                cv2.circle(img_with_roi, (x, y), 3, (0, 255, 0), -1)  # Verde para ajustados
-            
-            cv2.polylines(img_with_roi, [polygon], True, (255, 255, 0), 2)  # Amarillo para el polígono
-            
-            cv2.imwrite(f"debug_images/original_with_roi.png", img_with_roi)
-            cv2.imwrite(f"debug_images/mask.png", mask)
-            cv2.imwrite(f"debug_images/mask_dilated.png", mask_dilated)
-            
-            # Visualizar los píxeles extraídos
-            extracted_visualization = np.zeros_like(image)
-            extracted_visualization[mask_dilated == 255] = image[mask_dilated == 255]
-            cv2.imwrite(f"debug_images/extracted_pixels.png", extracted_visualization)
-            
-            logger.info(f"Debug images saved to 'debug_images/' directory")
-        except Exception as e:
-            logger.error(f"Error saving debug images: {e}")
+    # Artefactos de depuración: solo se encolan referencias; el dibujo y la escritura PNG
+    # los hace el hilo de `services.debug_capture`, fuera del event loop.
+    if capture_id is not None:
+        debug_capture.submit_roi(capture_id, roi_index, image, roi_vertices, polygon, mask, mask_dilated)
 
     # --- Extracción Final ---
     # CÓMO: Usar la máscara dilatada (donde los píxeles son 255) como índice booleano
@@ -135,14 +118,18 @@ def _extract_roi_pixels(image: np.ndarray, roi_vertices: List[Tuple[int, int]])
     # Validación post-extracción.
     if roi_pixels.size == 0:
         # Esto puede ocurrir si la ROI es extremadamente pequeña o cae fuera de la imagen.
-        logger.warning(f"ROI with vertices {roi_vertices} resulted in zero pixels AFTER DILATION.")
+        logger.warning(f"ROI with {len(roi_vertices)} vertices resulted in zero pixels AFTER DILATION.")
         return None # No hay píxeles para analizar.
 
     # Devuelve un array 1D plano con los valores de intensidad de los píxeles.
     return roi_pixels
 
 # --- PASO 4 (por ROI): Preprocesamiento para DistEn2D ---
-def _preprocess_roi_for_disten(roi_pixels: np.ndarray, roi_index: int) -> Optional[np.ndarray]:
+def _preprocess_roi_for_disten(
+    roi_pixels: np.ndarray,
+    roi_index: int,
+    target_size: Optional[Tuple[int, int]] = None
+) -> Optional[np.ndarray]:
     """
     Prepara los píxeles extraídos de una ROI para el cálculo de DistEn2D.
 
@@ -162,12 +149,15 @@ def _preprocess_roi_for_disten(roi_pixels: np.ndarray, roi_index: int) -> Option
     Args:
         roi_pixels: Array 1D NumPy con los píxeles de la ROI.
         roi_index: Índice numérico de la ROI (para logging).
+        target_size: Tamaño objetivo del redimensionado. None = `config.DISTEN_TARGET_SIZE`
+                     (otros valores los usan los niveles de calidad reducida de `services.quality`
+                     y el arnés de evaluación `tools.disten_eval`).
 
     Returns:
         Array 2D NumPy preprocesado (float32), o array de ceros, o None si falla.
     """
     # Tamaño objetivo para redimensionar la ROI (ej. 64x64), definido en config.py.
-    target_size = config.DISTEN_TARGET_SIZE
+    target_size = tuple(target_size or config.DISTEN_TARGET_SIZE)
 
     # --- 1. Comprobar STD Inicial ---
     # POR QUÉ: Si la ROI es casi completamente homogénea (todos los píxeles casi iguales),
@@ -256,7 +246,13 @@ def _preprocess_roi_for_disten(roi_pixels: np.ndarray, roi_index: int) -> Option
 
 
 # --- PASO 5 (por ROI): Cálculo de Entropía ---
-def _calculate_disten_safe(processed_roi: np.ndarray, roi_index: int) -> Tuple[Optional[float], Optional[str]]:
+def _calculate_disten_safe(
+    processed_roi: np.ndarray,
+    roi_index: int,
+    m: Optional[int] = None,
+    tau: Optional[int] = None,
+    bins: Optional[Union[str, int]] = None
+) -> Tuple[Optional[float], Optional[str]]:
     """
     Calcula la Entropía de Distribución 2D (DistEn2D) de forma segura para una ROI preprocesada.
 
@@ -267,6 +263,7 @@ def _calculate_disten_safe(processed_roi: np.ndarray, roi_index: int) -> Tuple[O
     Args:
         processed_roi: Matriz 2D NumPy preprocesada.
         roi_index: Índice numérico de la ROI (para logging).
+        m, tau, bins: Parámetros de DistEn2D. None = `config.DISTEN_M` / `DISTEN_TAU` / `DISTEN_BINS`.
 
     Returns:
         Tupla (valor_disten, error_msg):
@@ -287,11 +284,17 @@ def _calculate_disten_safe(processed_roi: np.ndarray, roi_index: int) -> Tuple[O
     # --- Llamada a EntropyHub.DistEn2D ---
     try:
         logger.info(f"Calculating DistEn2D for ROI {roi_index} with shape {processed_roi.shape}...")
-        # Parámetros `m` y `tau`:
+        # Parámetros `m`, `tau` y `bins` (ver config.py):
         #   - `m=2`: Dimensión de los patrones a comparar (vectores de 2x2 en este caso, común para 2D).
         #   - `tau=1`: Retraso entre píxeles al formar los patrones (adyacentes).
-        # Estos valores son típicos pero podrían ajustarse según estudios específicos.
-        dist_en_result = DistEn2D(processed_roi, m=2, tau=1)
+        #   - `bins='Sturges'`: Método (o número) de intervalos del histograma de distancias.
+        # Estos valores son típicos pero podrían ajustarse según estudios específicos
+        # (`python -m tools.disten_eval` mide su efecto en precisión y tiempo).
+        m = config.DISTEN_M if m is None else m
+        tau = config.DISTEN_TAU if tau is None else tau
+        bins = config.DISTEN_BINS if bins is None else bins
+        # EntropyHub limita la matriz a 128x128 salvo que se desactive `Lock` explícitamente.
+        dist_en_result = DistEn2D(processed_roi, m=m, tau=tau, Bins=bins, Lock=max(processed_roi.shape) <= 128)
         logger.info(f"DistEn2D calculation for ROI {roi_index} complete.")
 
         # Procesar resultado:
@@ -319,8 +322,56 @@ def _calculate_disten_safe(processed_roi: np.ndarray, roi_index: int) -> Tuple[O
         return None, error_msg # Indicar fallo.
 
 
+def _calculate_texture_metrics_safe(
+    processed_rois: List[np.ndarray],
+    roi_indices: List[int],
+    tracker: Optional[MemoryTracker] = None
+) -> List[Tuple[Optional[float], Optional[Dict[str, Optional[float]]], Dict[str, float], Optional[str]]]:
+    """
+    PASO 5 de la ruta de producción: DistEn2D y las métricas de `config.TEXTURE_METRICS` de varias ROIs
+    a la vez (`services.texture_metrics.compute_batch`: todas tienen `DISTEN_TARGET_SIZE`, se apilan y
+    se calculan juntas compartiendo patrones, distancias y búferes).
+
+    `texture_metrics` reproduce `EntropyHub.DistEn2D` (mismo valor con los mismos parámetros);
+    `_calculate_disten_safe` (EntropyHub) queda como referencia; `tools.disten_eval` y
+    `tests/test_texture_metrics.py` miden el núcleo por lotes.
+
+    Returns:
+        Una tupla por ROI (valor_disten, metricas_extra, tiempos_ms, error_msg):
+            - valor_disten: como `_calculate_disten_safe` (redondeado, 0.0 si homogénea, None si error).
+            - metricas_extra: métricas adicionales redondeadas (None si no hay ninguna seleccionada).
+            - tiempos_ms: milisegundos por métrica y del trabajo compartido (`shared`).
+            - error_msg: mensaje si falló DistEn2D (el fallo de una métrica adicional solo deja su valor a None).
+    """
+    if tracker is not None:
+        tracker.alloc("texture_metrics", texture_metrics.working_bytes(processed_rois[0].shape))
+    try:
+        logger.info(f"Calculating texture metrics for ROIs {roi_indices} with shape {processed_rois[0].shape}...")
+        batch_values, batch_timings = texture_metrics.compute_batch(np.stack(processed_rois))
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        failures = []
+        for roi_index in roi_indices:
+            error_msg = i18n_strings.get("error_calculating_roi", "error_calculating_roi").format(roi_index=roi_index, error=str(e))
+            logger.error(error_msg)
+            failures.append((None, None, {}, error_msg))
+        return failures
+    finally:
+        if tracker is not None:
+            tracker.free("texture_metrics")
+
+    results = []
+    for roi_index, values, timings in zip(roi_indices, batch_values, batch_timings):
+        timings_ms = {name: round(ms, 2) for name, ms in timings.items()}
+        extra = {name: (round(value, 4) if value is not None else None) for name, value in values.items() if name != "dist_en"}
+        dist_en_value = round(values["dist_en"], 4)
+        logger.info(f"ROI {roi_index} DistEn2D value: {dist_en_value}" + (f", other metrics: {extra}" if extra else ""))
+        results.append((dist_en_value, extra or None, timings_ms, None))
+    return results
+
+
 # --- PASO 6: Cálculo de la Puntuación Digital Final ---
-def _calculate_digital_score(max_dist_en_value: float) -> int:
+def _calculate_digital_score(max_dist_en_value: float, log: bool = True) -> int:
     """Determina la puntuación digital final basada en el valor MÁXIMO de DistEn2D encontrado entre todas las ROIs.
 
     OBJETIVO: Traducir la métrica técnica de máxima complejidad textural (`max_dist_en_value`)
@@ -328,6 +379,7 @@ def _calculate_digital_score(max_dist_en_value: float) -> int:
 
     Args:
         max_dist_en_value (float): El valor máximo de DistEn2D (esperado en [0, 1]).
+        log (bool): Registrar el cálculo (False en las comprobaciones intermedias del modo "solo puntuación").
 
     Returns:
         int: Puntuación digital (0-10).
@@ -357,37 +409,101 @@ def _calculate_digital_score(max_dist_en_value: float) -> int:
     score = int(round(scaled_score))
     score = max(0, min(score, 10)) # Asegurar que esté estrictamente en [0, 10]
 
-    logger.info(f"Max DistEn2D: {max_dist_en_value:.4f} -> Clamped: {clamped_value:.4f} -> Linearly Scaled: {scaled_score:.4f} -> Score: {score}/10")
+    if log:
+        logger.info(f"Max DistEn2D: {max_dist_en_value:.4f} -> Clamped: {clamped_value:.4f} -> Linearly Scaled: {scaled_score:.4f} -> Score: {score}/10")
     return score
 
 
+# --- PASO 1: Carga y Preparación de la Imagen ---
+def decode_to_gray(file_content: bytes, tracker: Optional[MemoryTracker] = None) -> Optional[np.ndarray]:
+    """
+    Decodifica la imagen y la convierte a escala de grises (uint8), sin reescalar.
+
+    Es la representación canónica que guarda `services.image_store`: a partir de ella el resto del
+    análisis es determinista, así que no hace falta volver a decodificar el original.
+
+    Returns:
+        La imagen en escala de grises, o None si OpenCV no puede decodificar los bytes.
+    """
+    tracker = tracker or MemoryTracker("decode", sample_tracemalloc=False)
+    # Decodificar los bytes de la imagen usando OpenCV.
+    nparr = np.frombuffer(file_content, np.uint8)
+    img_color = cv2.imdecode(nparr, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img_color is None:
+        return None
+    tracker.alloc("decoded_color", img_color.nbytes)
+
+    # Convertir a escala de grises para análisis de textura.
+    img_gray = cv2.cvtColor(img_color, cv2.COLOR_BGR2GRAY)
+    tracker.alloc("gray", img_gray.nbytes)
+    # La imagen en color ya no se necesita: liberarla antes del reescalado (pico más bajo).
+    del img_color, nparr
+    tracker.free("decoded_color")
+    return img_gray
+
+
+def _rescale_gray(img_gray: np.ndarray, tracker: MemoryTracker) -> np.ndarray:
+    """Reescala la intensidad de una imagen en escala de grises a 0-255 (uint8)."""
+    # POR QUÉ: Asegura un rango de valores consistente independientemente del rango original
+    #         de la imagen (que podría variar), antes de pasar a la extracción/normalización.
+    tracker.alloc("rescale_tmp", img_gray.size * 8) # rescale_intensity calcula en float64.
+    img_prepared = exposure.rescale_intensity(img_gray, in_range='image', out_range=(0, 255)).astype(np.uint8)
+    tracker.alloc("prepared", img_prepared.nbytes)
+    tracker.free("rescale_tmp", "gray")
+    return img_prepared
+
+
+def _prepare_image(file_content: bytes, tracker: MemoryTracker) -> Optional[np.ndarray]:
+    """
+    Decodifica la imagen, la convierte a escala de grises y reescala su intensidad a 0-255 (uint8).
+
+    Returns:
+        La imagen preparada, o None si OpenCV no puede decodificar los bytes.
+    """
+    img_gray = decode_to_gray(file_content, tracker)
+    if img_gray is None:
+        return None
+    return _rescale_gray(img_gray, tracker)
+
+
 # --- Función Principal del Servicio de Análisis de Textura ---
 # Esta es la función que será llamada por la ruta de la API (ej. en main.py).
 
 async def analyze_rois_texture(
     file_content: bytes,                 # Contenido binario de la imagen subida.
-    rois: List[List[Tuple[int, int]]]  # Lista de ROIs [[(x,y), ...], [(x,y), ...]] en COORDS ORIGINALES.
-                                         # Se asume que viene validada por el schema `RoiData`.
+    rois: List[np.ndarray],            # Lista de ROIs, arrays (n, 2) de vértices (x, y) en COORDS ORIGINALES.
+                                         # Se asume que viene validada por `services.roi_codec`.
+    tracker: Optional[MemoryTracker] = None, # Contabilidad de memoria de la petición (opcional).
+    capture_id: Optional[str] = None,    # Captura de depuración de la petición (opcional).
+    score_only: bool = False,            # Omitir las ROIs que no pueden cambiar la puntuación.
+    tier: Optional[quality.QualityTier] = None # Nivel de calidad (None = completo).
 ) -> Tuple[float, int, List[RoiAnalysisDetail]]: # Retorna: (Max DistEn, Puntuación Final, Detalles por ROI)
     """
     Analiza la textura (usando DistEn2D) dentro de múltiples ROIs definidas por el usuario en una imagen.
 
     FLUJO PRINCIPAL:
     1. Cargar y preparar la imagen (decode, grayscale, rescale intensity).
-    2. Iterar sobre cada ROI recibida del frontend.
-    3. Para cada ROI:
+    2. Para cada ROI recibida del frontend:
         a. Extraer los píxeles correspondientes (`_extract_roi_pixels`).
         b. Preprocesar los píxeles para DistEn2D (`_preprocess_roi_for_disten`).
-        c. Calcular DistEn2D de forma segura (`_calculate_disten_safe`).
-        d. Registrar el resultado (valor o error) para esta ROI.
-        e. Actualizar el valor máximo de DistEn2D encontrado hasta ahora.
+    3. Calcular DistEn2D (y las métricas de `config.TEXTURE_METRICS`) de todas las ROIs válidas en un
+       solo lote (`_calculate_texture_metrics_safe`), registrar el resultado (valor o error) de cada
+       ROI y quedarse con el valor máximo de DistEn2D.
     4. Calcular la puntuación digital final basada en el máximo DistEn2D (`_calculate_digital_score`).
     5. Retornar el máximo DistEn, la puntuación final, y la lista de detalles de cada ROI.
 
     Args:
         file_content: Contenido binario de la imagen (bytes).
-        rois: Lista de listas de vértices [(x, y), ...], donde cada lista interna representa una ROI
+        rois: Lista de arrays (n, 2) de vértices (x, y), donde cada array representa una ROI
               en las coordenadas originales de la imagen.
+        tracker: `MemoryTracker` donde registrar los bytes de cada etapa. Si es None se usa uno local
+                 (sin muestreo tracemalloc) que no se reporta.
+        capture_id: Identificador de `services.debug_capture.new_capture`; si es None no se genera
+                    ningún artefacto de depuración.
+        score_only: Modo "solo puntuación": DistEn2D solo en las ROIs que pueden cambiar la puntuación
+                    digital (las demás se devuelven con `skipped`).
+        tier: Nivel de `services.quality.select_tier()`; un nivel reducido limita los píxeles por ROI y
+              calcula DistEn2D a menor tamaño. None = `quality.full_tier()`.
 
     Returns:
         Tupla (max_disten, digital_score, details_list):
@@ -398,38 +514,28 @@ async def analyze_rois_texture(
         Retorna (0.0, 0, [detalles_error]) o (0.0, 0, []) si hay errores irrecuperables (ej. carga de imagen,
         EntropyHub no disponible) o si no se proporcionan ROIs.
     """
-    max_dist_en_value = 0.0 # Inicializar el máximo encontrado.
-    all_rois_data: List[RoiAnalysisDetail] = [] # Lista para almacenar detalles de cada ROI.
-    error_occurred = False # Flag para errores globales que impiden el cálculo.
+    return await asyncio.to_thread(profiling.sampled(_analyze_encoded_image), file_content, rois, tracker, capture_id, score_only, tier)
 
-    # Comprobación inicial crucial: ¿Está EntropyHub disponible?
-    if not ENTROPYHUB_AVAILABLE:
-         error_msg = i18n_strings.get("error_entropyhub_missing", "error_entropyhub_missing")
-         logger.critical(error_msg)
-         # Si no hay ROIs para iterar, añadir un error general.
-         if not rois:
-              all_rois_data.append(RoiAnalysisDetail(roi_index=0, error=error_msg))
-         # Marcar error fatal. El bucle for añadirá este error a cada ROI si se itera.
-         error_occurred = True
+
+def _analyze_encoded_image(
+    file_content: bytes,
+    rois: List[np.ndarray],
+    tracker: Optional[MemoryTracker],
+    capture_id: Optional[str],
+    score_only: bool,
+    tier: Optional[quality.QualityTier]
+) -> Tuple[float, int, List[RoiAnalysisDetail]]:
+    """Cuerpo síncrono de `analyze_rois_texture` (trabajo de CPU, se ejecuta en un hilo)."""
+    tracker = tracker or MemoryTracker("analysis", sample_tracemalloc=False)
 
     # --- PASO 1: Cargar y Preparar Imagen ---
     try:
-        # Decodificar los bytes de la imagen usando OpenCV.
-        nparr = np.frombuffer(file_content, np.uint8)
-        img_color = cv2.imdecode(nparr, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
-        if img_color is None:
+        img_prepared = _prepare_image(file_content, tracker)
+        if img_prepared is None:
             # Error si OpenCV no puede decodificar la imagen.
             logger.error(i18n_strings.get("error_decoding_image", "error_decoding_image"))
             # Devolver valores por defecto y un detalle de error.
             return 0.0, 0, [RoiAnalysisDetail(roi_index=0, error=i18n_strings.get("error_decoding_image"))]
-
-        # Convertir a escala de grises para análisis de textura.
-        img_gray = cv2.cvtColor(img_color, cv2.COLOR_BGR2GRAY)
-
-        # Reescalar intensidad a 0-255.
-        # POR QUÉ: Asegura un rango de valores consistente independientemente del rango original
-        #         de la imagen (que podría variar), antes de pasar a la extracción/normalización.
-        img_prepared = exposure.rescale_intensity(img_gray, in_range='image', out_range=(0, 255)).astype(np.uint8)
         logger.info("Image loaded and prepared successfully.")
         logger.debug(f"[DEBUG] Prepared image shape: {img_prepared.shape}, dtype: {img_prepared.dtype}")
 
@@ -440,6 +546,233 @@ async def analyze_rois_texture(
         # Error fatal, devolver valores por defecto y detalle de error.
         return 0.0, 0, [RoiAnalysisDetail(roi_index=0, error=f"Image loading error: {e}")]
 
+    return _analyze_prepared_image(img_prepared, rois, tracker, capture_id, score_only, tier)
+
+
+async def analyze_gray_image(
+    img_gray: Optional[np.ndarray],      # Imagen canónica en escala de grises (p.ej. de `services.image_store`).
+    rois: List[np.ndarray],            # ROIs (n, 2) en COORDS ORIGINALES, validadas por `services.roi_codec`.
+    tracker: Optional[MemoryTracker] = None, # Contabilidad de memoria de la petición (opcional).
+    capture_id: Optional[str] = None,    # Captura de depuración de la petición (opcional).
+    score_only: bool = False,            # Omitir las ROIs que no pueden cambiar la puntuación.
+    tier: Optional[quality.QualityTier] = None # Nivel de calidad (None = completo).
+) -> Tuple[float, int, List[RoiAnalysisDetail]]:
+    """
+    Variante de `analyze_rois_texture` que parte de la imagen ya decodificada a escala de grises
+    (`decode_to_gray`), evitando `cv2.imdecode` y `cvtColor`. El resultado es idéntico.
+    `img_gray = None` indica que la subida no se pudo decodificar (se devuelve el error habitual).
+    """
+    return await asyncio.to_thread(profiling.sampled(_analyze_gray_image), img_gray, rois, tracker, capture_id, score_only, tier)
+
+
+def _analyze_gray_image(
+    img_gray: Optional[np.ndarray],
+    rois: List[np.ndarray],
+    tracker: Optional[MemoryTracker],
+    capture_id: Optional[str],
+    score_only: bool,
+    tier: Optional[quality.QualityTier]
+) -> Tuple[float, int, List[RoiAnalysisDetail]]:
+    """Cuerpo síncrono de `analyze_gray_image` (trabajo de CPU, se ejecuta en un hilo)."""
+    tracker = tracker or MemoryTracker("analysis", sample_tracemalloc=False)
+    if img_gray is None:
+        # `decode_to_gray` no pudo decodificar la subida.
+        logger.error(i18n_strings.get("error_decoding_image", "error_decoding_image"))
+        return 0.0, 0, [RoiAnalysisDetail(roi_index=0, error=i18n_strings.get("error_decoding_image"))]
+    try:
+        tracker.alloc("gray", img_gray.nbytes)
+        img_prepared = _rescale_gray(img_gray, tracker)
+    except Exception as e:
+        logger.error(f"Error preparing grayscale image: {e}")
+        logger.debug(traceback.format_exc())
+        return 0.0, 0, [RoiAnalysisDetail(roi_index=0, error=f"Image loading error: {e}")]
+    return _analyze_prepared_image(img_prepared, rois, tracker, capture_id, score_only, tier)
+
+
+async def analyze_native_radiograph(
+    path: str,                           # Ruta a un TIFF/DICOM nativo en disco (p.ej. la subida volcada a disco).
+    rois: List[np.ndarray],            # ROIs (n, 2) en COORDS ORIGINALES, validadas por `services.roi_codec`.
+    tracker: Optional[MemoryTracker] = None, # Contabilidad de memoria de la petición (opcional).
+    capture_id: Optional[str] = None,    # Captura de depuración de la petición (opcional).
+    score_only: bool = False,            # Omitir las ROIs que no pueden cambiar la puntuación.
+    tier: Optional[quality.QualityTier] = None # Nivel de calidad (None = completo).
+) -> Tuple[float, int, List[RoiAnalysisDetail]]:
+    """
+    Variante de `analyze_rois_texture` para radiografías nativas de 16 bits (TIFF/DICOM sin comprimir).
+
+    DIFERENCIAS respecto a la ruta JPEG/PNG:
+    - Los píxeles se leen mediante `np.memmap` (`services.radiograph_io`); nunca se carga el estudio completo.
+    - Solo se materializa la caja envolvente de la unión de las ROIs (más un margen para la dilatación).
+    - El reescalado de intensidad a 0-255 se hace dentro de esa región, aprovechando el rango dinámico
+      del detector en lugar de perderlo en una exportación previa a 8 bits.
+
+    Las ROIs se trasladan al sistema de coordenadas del recorte y se analizan con el mismo flujo por ROI.
+    """
+    return await asyncio.to_thread(profiling.sampled(_analyze_native_radiograph), path, rois, tracker, capture_id, score_only, tier)
+
+
+def _analyze_native_radiograph(
+    path: str,
+    rois: List[np.ndarray],
+    tracker: Optional[MemoryTracker],
+    capture_id: Optional[str],
+    score_only: bool,
+    tier: Optional[quality.QualityTier]
+) -> Tuple[float, int, List[RoiAnalysisDetail]]:
+    """Cuerpo síncrono de `analyze_native_radiograph` (trabajo de CPU, se ejecuta en un hilo)."""
+    tracker = tracker or MemoryTracker("analysis", sample_tracemalloc=False)
+    try:
+        pixels, inverted = radiograph_io.open_native_radiograph(path)
+        bbox = radiograph_io.roi_union_bbox(rois, pixels.shape, margin=config.NATIVE_IMAGE_ROI_MARGIN)
+        if bbox is None:
+            # Sin ROIs no hace falta leer ningún píxel.
+            img_prepared = np.zeros((0, 0), dtype=np.uint8)
+            local_rois: List[np.ndarray] = []
+        else:
+            x0, y0, x1, y1 = bbox
+            # Solo estas filas/columnas se paginan desde disco.
+            region = np.array(pixels[y0:y1, x0:x1])
+            tracker.alloc("native_region", region.nbytes)
+            tracker.alloc("rescale_tmp", region.size * 8)
+            img_prepared = exposure.rescale_intensity(region, in_range='image', out_range=(0, 255)).astype(np.uint8)
+            tracker.alloc("prepared", img_prepared.nbytes)
+            del region
+            tracker.free("rescale_tmp", "native_region")
+            if inverted:
+                img_prepared = 255 - img_prepared # MONOCHROME1 / WhiteIsZero: blanco = valor mínimo.
+            offset = np.array([x0, y0], dtype=np.int32)
+            local_rois = [np.asarray(roi, dtype=np.int32) - offset for roi in rois]
+            logger.info(f"Native radiograph {pixels.shape[1]}x{pixels.shape[0]} ({pixels.dtype}): "
+                        f"read ROI region {x1 - x0}x{y1 - y0} at ({x0},{y0}).")
+        del pixels # Liberar el mapeo antes de que el llamador elimine el archivo.
+    except Exception as e:
+        logger.error(f"Error loading native radiograph: {e}")
+        logger.debug(traceback.format_exc())
+        return 0.0, 0, [RoiAnalysisDetail(roi_index=0, error=f"Image loading error: {e}")]
+
+    return _analyze_prepared_image(img_prepared, local_rois, tracker, capture_id, score_only, tier)
+
+
+def _extract_and_preprocess_roi(
+    img_prepared: np.ndarray,
+    roi_verts: np.ndarray,
+    roi_index: int,
+    tracker: MemoryTracker,
+    capture_id: Optional[str] = None,
+    tier: Optional[quality.QualityTier] = None
+) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """
+    PASOS 3-4 para una ROI: extracción de píxeles y preprocesamiento para DistEn2D.
+    Con un nivel de calidad reducido (`tier`) se muestrean los píxeles y se redimensiona a `tier.target_size`.
+
+    Returns:
+        (processed_roi, error_msg): la matriz lista para `_calculate_texture_metrics_safe`, o None y el motivo.
+        Las excepciones inesperadas se propagan al llamador.
+    """
+    # PASO 3: Extraer píxeles.
+    # Máscara + máscara dilatada + comparación booleana (tamaño imagen) viven durante la extracción.
+    tracker.alloc("roi_masks", img_prepared.size * 3)
+    roi_pixels = _extract_roi_pixels(img_prepared, roi_verts, capture_id, roi_index)
+    tracker.free("roi_masks")
+
+    if roi_pixels is None:
+        # Error si no se pudieron extraer píxeles (ROI inválida/vacía).
+        error_msg = "ROI resulted in zero pixels or was invalid" # Mensaje técnico.
+        logger.warning(f"ROI {roi_index}: {error_msg}")
+        return None, error_msg
+    logger.debug(f"[DEBUG] ROI {roi_index}: Successfully extracted {roi_pixels.size} pixels.")
+    tier = tier or quality.full_tier()
+    roi_pixels = quality.sample_roi_pixels(roi_pixels, tier)
+
+    # PASO 4: Preprocesar píxeles para DistEn.
+    # Normalización float32 + padding + resize/z-score float64.
+    tracker.alloc("resize_buffers", roi_pixels.size * 8 + int(np.prod(tier.target_size)) * 8 * 2)
+    processed_roi = _preprocess_roi_for_disten(roi_pixels, roi_index, tier.target_size)
+    tracker.free("resize_buffers")
+
+    if processed_roi is None:
+        # Error durante el preprocesamiento (resize, normalize, NaN/Inf).
+        error_msg = "Failed during preprocessing (resize/normalize)" # Mensaje técnico.
+        logger.error(f"ROI {roi_index}: {error_msg}")
+        return None, error_msg
+    return processed_roi, None
+
+
+# --- Modo "solo puntuación" (cribado) ---
+# OBJETIVO: Cuando solo interesa la clasificación final, no calcular DistEn2D (~1 s por ROI a 64x64)
+#           en las ROIs que no pueden cambiar el resultado.
+# CÓMO:
+#   1. Se extraen y preprocesan todas las ROIs (barato) y se calcula para cada una DistEn2D sobre una
+#      versión reducida (`SCORE_ONLY_PROXY_SIZE`, ~200 veces más barata): es el indicador de complejidad.
+#   2. Se calcula DistEn2D completo de la ROI con mayor indicador: su puntuación digital es la referencia.
+#   3. Se omiten las ROIs cuya cota superior estimada (`indicador + SCORE_ONLY_BOUND_MARGIN`, nunca más de 1,
+#      el máximo de la entropía normalizada) no da una puntuación digital mayor que la referencia (o
+#      todas, si la referencia ya es 10). Las demás se calculan juntas en un lote (como en el modo normal).
+#      Las ROIs homogéneas tienen cota exacta 0.
+#   Lo que se compara es la PUNTUACIÓN: `max_dist_en_value` es el máximo de las ROIs calculadas y puede
+#   ser menor que en el modo normal aunque la puntuación coincida.
+# LIMITACIÓN: La cota es EMPÍRICA, no una cota superior demostrada. En las radiografías de prueba, DistEn2D
+#             a 16x16 fue mayor que a 64x64 en promedio (+0.06), pero en ROIs pequeñas o irregulares llegó
+#             a ser 0.10 menor; el margen por defecto cubre ese caso. Por eso, si se omite alguna ROI por
+#             la cota (`skipped="bound"`), el resultado lo indica con `digital_score_estimated`. Las
+#             omisiones por puntuación saturada (`skipped="saturated"`) son exactas. Con el modo normal
+#             (por defecto) se calculan todas las ROIs.
+
+def _screening_bound(processed_roi: np.ndarray, roi_index: int) -> Tuple[float, float]:
+    """
+    Indicador de complejidad y cota superior estimada de DistEn2D para una ROI preprocesada.
+
+    Returns:
+        (proxy, bound). Si el indicador no se puede calcular, (1.0, 1.0): la ROI nunca se omite.
+    """
+    if np.all(processed_roi == 0):
+        return 0.0, 0.0 # Homogénea: `_calculate_texture_metrics_safe` devolverá exactamente 0.
+    try:
+        small = resize(processed_roi, config.SCORE_ONLY_PROXY_SIZE, anti_aliasing=True, preserve_range=True)
+        std_val = np.std(small)
+        small = (small - np.mean(small)) / (std_val if std_val >= config.DISTEN_LOW_STD_THRESHOLD_RESIZE else 1.0)
+        result = DistEn2D(small, m=config.DISTEN_M, tau=config.DISTEN_TAU, Bins=config.DISTEN_BINS)
+        proxy = float(result[0] if isinstance(result, (list, tuple)) else result)
+        if not np.isfinite(proxy):
+            raise ValueError("screening DistEn2D resulted in NaN or Inf")
+    except Exception as e:
+        logger.warning(f"ROI {roi_index}: screening failed ({e}); it will not be skipped.")
+        return 1.0, 1.0
+    return proxy, min(1.0, proxy + config.SCORE_ONLY_BOUND_MARGIN)
+
+
+def _analyze_prepared_image(
+    img_prepared: np.ndarray,
+    rois: List[np.ndarray],
+    tracker: MemoryTracker,
+    capture_id: Optional[str] = None,
+    score_only: bool = False,
+    tier: Optional[quality.QualityTier] = None
+) -> Tuple[float, int, List[RoiAnalysisDetail]]:
+    """
+    Ejecuta los PASOS 2-6 (análisis por ROI y puntuación digital) sobre una imagen ya preparada
+    (escala de grises uint8 0-255). Compartido por las rutas de entrada JPEG/PNG y nativa.
+
+    Con `score_only=True` se omiten las ROIs que (según su cota estimada) no pueden cambiar la puntuación
+    digital (ver "Modo solo puntuación"); quedan marcadas con `skipped` y `max_dist_en_value` es el
+    máximo de las ROIs calculadas.
+    `tier` (ver `services.quality`) fija el tamaño al que se calcula DistEn2D; None = calidad completa.
+    """
+    tier = tier or quality.full_tier()
+    max_dist_en_value = 0.0 # Inicializar el máximo encontrado.
+    all_rois_data: List[RoiAnalysisDetail] = [] # Lista para almacenar detalles de cada ROI.
+    error_occurred = False # Flag para errores globales que impiden el cálculo.
+
+    # Comprobación inicial crucial: ¿Está EntropyHub disponible?
+    if not ENTROPYHUB_AVAILABLE:
+         error_msg = i18n_strings.get("error_entropyhub_missing", "error_entropyhub_missing")
+         logger.critical(error_msg)
+         # Si no hay ROIs para iterar, añadir un error general.
+         if not rois:
+              all_rois_data.append(RoiAnalysisDetail(roi_index=0, error=error_msg))
+         # Marcar error fatal. Este error se registrará para cada ROI.
+         error_occurred = True
+
     # --- Manejo del caso sin ROIs ---
     if not rois:
         logger.warning("No valid ROIs provided for analysis. Returning score 0.")
@@ -447,67 +780,90 @@ async def analyze_rois_texture(
         # (que podría contener el error de EntropyHub si ocurrió).
         return 0.0, 0, all_rois_data
 
-    # --- PASO 2: Analizar Cada ROI (Iteración) ---
+    # --- PASOS 3-4: Extraer y Preprocesar Todas las ROIs ---
+    # Todas quedan con `tier.target_size`, así que el PASO 5 puede calcularlas apiladas en un lote.
+    # Para cada ROI: (processed_roi, error_msg, indicador, cota); indicador y cota solo en modo "solo puntuación".
     logger.info(f"Analyzing {len(rois)} ROIs...")
-    for i, roi_verts in enumerate(rois):
-        roi_index = i + 1 # Índice 1-based para mostrar al usuario.
-        dist_en_value: Optional[float] = None # Resultado de DistEn para esta ROI.
-        error_msg: Optional[str] = None # Mensaje de error para esta ROI.
-
-        # Log de las coordenadas originales recibidas del frontend para esta ROI.
-        logger.debug(f"[DEBUG] Processing ROI {roi_index} with vertices: {roi_verts}")
-
-        # Si ya hubo un error fatal (EntropyHub ausente), no intentar procesar.
-        # Simplemente registrar el error para esta ROI también.
-        if error_occurred:
-             error_msg = i18n_strings.get("error_entropyhub_missing", "error_entropyhub_missing")
-             all_rois_data.append(RoiAnalysisDetail(roi_index=roi_index, error=error_msg))
-             continue # Pasar a la siguiente ROI.
-
-        # --- Flujo de Procesamiento por ROI (Try/Except para errores específicos de ROI) ---
-        try:
-            logger.info(f"Processing ROI {roi_index}...")
-
-            # PASO 3: Extraer píxeles.
-            roi_pixels = _extract_roi_pixels(img_prepared, roi_verts)
-
-            if roi_pixels is None:
-                # Error si no se pudieron extraer píxeles (ROI inválida/vacía).
-                error_msg = "ROI resulted in zero pixels or was invalid" # Mensaje técnico.
-                logger.warning(f"ROI {roi_index}: {error_msg}")
+    prepared: List[Tuple[Optional[np.ndarray], Optional[str], float, Optional[float]]] = []
+    if not error_occurred:
+        for i, roi_verts in enumerate(rois):
+            roi_index = i + 1 # Índice 1-based para mostrar al usuario.
+            # Log de las coordenadas originales recibidas del frontend para esta ROI.
+            logger.debug(f"[DEBUG] Processing ROI {roi_index} with {len(roi_verts)} vertices.")
+            try:
+                processed_roi, error_msg = _extract_and_preprocess_roi(img_prepared, roi_verts, roi_index, tracker, capture_id, tier)
+            except Exception as e:
+                # Captura cualquier error inesperado durante el procesamiento de ESTA ROI.
+                processed_roi = None
+                error_msg = i18n_strings.get("error_processing_roi", "error_processing_roi").format(roi_index=roi_index, error=str(e))
+                logger.error(error_msg)
+                logger.debug(traceback.format_exc())
+            # Liberar la contabilidad de la ROI también si hubo una excepción a mitad.
+            tracker.free("roi_masks", "resize_buffers")
+            proxy, bound = -1.0, None
+            if score_only and processed_roi is not None:
+                proxy, bound = _screening_bound(processed_roi, roi_index)
+            prepared.append((processed_roi, error_msg, proxy, bound))
+        tracker.alloc("prepared_rois", len(rois) * int(np.prod(tier.target_size)) * 8)
+
+    # --- PASO 5: Métricas de Textura ---
+    # Modo normal: todas las ROIs válidas en un solo lote. Modo "solo puntuación": primero la ROI de mayor
+    # indicador y después, en un lote, las que aún pueden subir la puntuación digital.
+    results: Dict[int, Tuple[Optional[float], Optional[Dict[str, Optional[float]]], Dict[str, float], Optional[str]]] = {}
+    skipped: Dict[int, str] = {}
+    valid = [i for i, item in enumerate(prepared) if item[0] is not None]
+    if valid and not score_only:
+        batch = _calculate_texture_metrics_safe([prepared[i][0] for i in valid], [i + 1 for i in valid], tracker)
+        results.update(zip(valid, batch))
+    elif valid:
+        valid.sort(key=lambda i: -prepared[i][2])
+        logger.info(f"Score-only mode: ROI order by estimated complexity {[i + 1 for i in valid]}.")
+        first, rest = valid[0], valid[1:]
+        results[first] = _calculate_texture_metrics_safe([prepared[first][0]], [first + 1], tracker)[0]
+        reference_score = _calculate_digital_score(results[first][0] or 0.0, log=False)
+        remaining = []
+        for i in rest:
+            bound = prepared[i][3]
+            if reference_score >= 10:
+                skipped[i] = "saturated" # La puntuación digital ya es la máxima.
+            elif _calculate_digital_score(bound, log=False) <= reference_score:
+                skipped[i] = "bound" # Ni con la cota estimada subiría la puntuación.
             else:
-                logger.debug(f"[DEBUG] ROI {roi_index}: Successfully extracted {roi_pixels.size} pixels.")
-
-                # PASO 4: Preprocesar píxeles para DistEn.
-                processed_roi = _preprocess_roi_for_disten(roi_pixels, roi_index)
-
-                if processed_roi is None:
-                    # Error durante el preprocesamiento (resize, normalize, NaN/Inf).
-                    error_msg = "Failed during preprocessing (resize/normalize)" # Mensaje técnico.
-                    logger.error(f"ROI {roi_index}: {error_msg}")
-                else:
-                    # PASO 5: Calcular DistEn2D.
-                    dist_en_value, error_msg = _calculate_disten_safe(processed_roi, roi_index)
-                    # `dist_en_value` será float, 0.0, o None.
-                    # `error_msg` será None si el cálculo fue exitoso.
-
-        except Exception as e:
-            # Captura cualquier error inesperado durante el procesamiento de ESTA ROI.
-            error_msg = i18n_strings.get("error_processing_roi", "error_processing_roi").format(roi_index=roi_index, error=str(e))
-            logger.error(error_msg)
-            logger.debug(traceback.format_exc())
-            # Asegurar que dist_en_value sea None si hubo una excepción aquí.
-            dist_en_value = None
-
-        # --- Registrar resultado de esta ROI ---.
-        # Añadir los detalles (índice, valor DistEn, error) a la lista de resultados.
-        all_rois_data.append(RoiAnalysisDetail(roi_index=roi_index, dist_en=dist_en_value, error=error_msg))
-
-        # --- Actualizar Máximo DistEn ---.
-        # Si el cálculo fue exitoso (dist_en_value no es None) Y no hubo error fatal previo.
-        if dist_en_value is not None and not error_occurred:
+                remaining.append(i)
+                continue
+            logger.info(f"ROI {i + 1}: skipped ({skipped[i]}, bound {bound:.4f}, reference score {reference_score}).")
+        if remaining:
+            batch = _calculate_texture_metrics_safe([prepared[i][0] for i in remaining], [i + 1 for i in remaining], tracker)
+            results.update(zip(remaining, batch))
+
+    # --- Registrar el resultado de cada ROI (en el orden original) ---
+    for i in range(len(rois)):
+        roi_index = i + 1
+        # Si ya hubo un error fatal (EntropyHub ausente), registrar el error para cada ROI.
+        if error_occurred:
+            error_msg = i18n_strings.get("error_entropyhub_missing", "error_entropyhub_missing")
+            all_rois_data.append(RoiAnalysisDetail(roi_index=roi_index, error=error_msg))
+            continue
+        _, prepare_error, _, bound = prepared[i]
+        rounded_bound = round(bound, 4) if bound is not None else None
+        if i in skipped:
+            all_rois_data.append(RoiAnalysisDetail.model_construct(
+                roi_index=roi_index, dist_en=None, error=None, skipped=skipped[i], dist_en_bound=rounded_bound,
+                texture_metrics=None, texture_timings_ms=None
+            ))
+            continue
+        # `dist_en_value` será float, 0.0, o None; `error_msg` será None si el cálculo fue exitoso.
+        dist_en_value, extra_metrics, metric_timings, error_msg = results.get(i, (None, None, None, prepare_error))
+        # `model_construct`: resultado interno de confianza, no necesita validación.
+        all_rois_data.append(RoiAnalysisDetail.model_construct(
+            roi_index=roi_index, dist_en=dist_en_value, error=error_msg, skipped=None, dist_en_bound=rounded_bound,
+            texture_metrics=extra_metrics, texture_timings_ms=metric_timings
+        ))
+        # --- Actualizar Máximo DistEn ---
+        if dist_en_value is not None:
             max_dist_en_value = max(max_dist_en_value, dist_en_value)
             logger.debug(f"ROI {roi_index}: DistEn = {dist_en_value:.4f}. Current max_dist_en = {max_dist_en_value:.4f}")
+    tracker.free("prepared_rois")
 
     # --- PASO 6: Calcular Puntuación Digital Final ---
     # Solo calcular si no hubo un error fatal inicial (ej. EntropyHub).
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+from services import image_analysis
+
+logger = logging.getLogger(__name__)
+
+# --- Normalización de Imágenes en la Ingesta ---
+# OBJETIVO: Decodificar cada imagen subida UNA sola vez. Las clínicas envían JPEG en color de
+#           12 MB, capturas PNG o conversiones de HEIC; reanalizar un estudio obligaba a repetir
+#           `cv2.imdecode` + `cvtColor` sobre el original.
+# CÓMO:
+#   - Cada subida se identifica por el SHA-256 de sus bytes originales.
+#   - La primera vez se decodifica a escala de grises uint8 (`image_analysis.decode_to_gray`,
+#     la misma conversión que usa el análisis) y se guarda en segundo plano como:
+#       * `png` (por defecto): PNG sin pérdida; ocupa del orden del JPEG original, pero hay que decodificarlo, o
+#       * `npy`: array crudo, se abre con memmap sin decodificar nada, pero ocupa alto x ancho bytes
+#         (~5 MB por radiografía frente a ~0.3 MB del JPEG).
+#     Junto a él se guarda `<sha256>.json` con los metadatos del original (tamaño, formato, forma).
+#   - Las siguientes subidas del mismo archivo, o los reanálisis por `image_sha256`, leen la
+#     representación canónica directamente (y renuevan su fecha de último uso).
+#   - Retención: el hilo escritor borra las imágenes sin usar desde hace `IMAGE_STORE_RETENTION_S` y,
+#     si el almacén supera `IMAGE_STORE_MAX_BYTES`, las usadas menos recientemente.
+# Ambos formatos son sin pérdida respecto a la escala de grises, así que el análisis es idéntico.
+# LIMITACIÓN: Reanalizar por `image_sha256` una imagen ya borrada responde 404 (hay que volver a subirla).
+
+_CANONICAL_EXTENSIONS = {"npy": ".npy", "png": ".png"}
+
+# Escritura en segundo plano: un único hilo, con un límite de escrituras pendientes.
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-store-writer")
+_pending_lock = threading.Lock()
+_pending: set = set() # Hashes con escritura en curso (evita duplicados simultáneos)
+_last_purge = 0.0 # Solo lo usa el hilo escritor
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _base_path(digest: str) -> str:
+    # Dos niveles de directorio para no acumular miles de archivos en una sola carpeta.
+    return os.path.join(config.IMAGE_STORE_DIR, digest[:2], digest)
+
+
+def is_valid_digest(digest: str) -> bool:
+    return len(digest) == 64 and all(c in "0123456789abcdef" for c in digest)
+
+
+def load_canonical(digest: str) -> Optional[np.ndarray]:
+    """
+    Devuelve la imagen canónica en escala de grises para un hash, o None si no está almacenada.
+    Los `.npy` se abren con memmap (solo se leen las páginas que el análisis toca).
+    """
+    if not is_valid_digest(digest):
+        return None
+    base = _base_path(digest)
+    for fmt, ext in _CANONICAL_EXTENSIONS.items():
+        path = base + ext
+        if not os.path.isfile(path):
+            continue
+        try:
+            if fmt == "npy":
+                img = np.load(path, mmap_mode="r")
+            else:
+                img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            if img is not None:
+                _touch(path)
+                return img
+        except (OSError, ValueError) as e:
+            logger.warning(f"Image store: unreadable canonical image {path}: {e}")
+    return None
+
+
+def _touch(path: str) -> None:
+    """Marca la imagen como usada ahora (la retención borra primero las menos usadas recientemente)."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass # Solo afecta al orden de borrado.
+
+
+def get_metadata(digest: str) -> Optional[Dict[str, Any]]:
+    """Metadatos del original asociados a un hash (o None)."""
+    if not is_valid_digest(digest):
+        return None
+    try:
+        with open(_base_path(digest) + ".json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ingest(file_content: bytes) -> Tuple[Optional[np.ndarray], str, bool]:
+    """
+    Obtiene la imagen en escala de grises de una subida, decodificándola solo si su hash no está almacenado.
+
+    Returns:
+        (img_gray, sha256, cache_hit). `img_gray` es None si la imagen no se puede decodificar.
+        Si se ha decodificado, la escritura de la representación canónica queda encolada.
+    """
+    digest = sha256_hex(file_content)
+    if config.IMAGE_STORE_ENABLED:
+        cached = load_canonical(digest)
+        if cached is not None:
+            logger.info(f"Image store hit for {digest[:12]}: skipped decoding.")
+            return cached, digest, True
+
+    img_gray = image_analysis.decode_to_gray(file_content)
+    if img_gray is not None and config.IMAGE_STORE_ENABLED:
+        _schedule_write(digest, img_gray, file_content)
+    return img_gray, digest, False
+
+
+def _schedule_write(digest: str, img_gray: np.ndarray, file_content: bytes) -> None:
+    with _pending_lock:
+        if digest in _pending:
+            return
+        if len(_pending) >= config.IMAGE_STORE_MAX_PENDING_WRITES:
+            logger.warning(f"Image store: write queue full; {digest[:12]} not stored.")
+            return
+        _pending.add(digest)
+    metadata = {
+        "sha256": digest,
+        "original_bytes": len(file_content),
+        "original_format": _sniff_format(file_content),
+        "shape": list(img_gray.shape),
+        "created_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+    }
+    _writer.submit(_write_canonical, digest, img_gray, metadata)
+
+
+def _write_canonical(digest: str, img_gray: np.ndarray, metadata: Dict[str, Any]) -> None:
+    fmt = config.IMAGE_STORE_FORMAT
+    base = _base_path(digest)
+    path = base + _CANONICAL_EXTENSIONS[fmt]
+    try:
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        # Escritura atómica: los lectores nunca ven un archivo a medias.
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        if fmt == "npy":
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(img_gray))
+        else:
+            ok, buf = cv2.imencode(".png", img_gray, [cv2.IMWRITE_PNG_COMPRESSION, config.IMAGE_STORE_PNG_COMPRESSION])
+            if not ok:
+                raise ValueError("PNG encoding failed")
+            with open(tmp_path, "wb") as f:
+                f.write(buf.tobytes())
+        os.replace(tmp_path, path)
+        metadata["format"] = fmt
+        metadata["stored_bytes"] = os.path.getsize(path)
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+        os.replace(base + ".json.tmp", base + ".json")
+        logger.debug(f"Image store: {digest[:12]} stored as {fmt} "
+                     f"({metadata['original_bytes']} -> {metadata['stored_bytes']} bytes).")
+    except Exception as e:
+        logger.error(f"Image store: failed to store {digest[:12]}: {e}")
+    finally:
+        with _pending_lock:
+            _pending.discard(digest)
+    _maybe_purge()
+
+
+# --- Retención ---
+
+def _list_entries() -> List[Dict[str, Any]]:
+    """Imágenes almacenadas con sus archivos, tamaño total y último uso (mtime de la imagen canónica)."""
+    entries: Dict[str, Dict[str, Any]] = {}
+    if not os.path.isdir(config.IMAGE_STORE_DIR):
+        return []
+    for shard in os.scandir(config.IMAGE_STORE_DIR):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            digest = entry.name.split(".", 1)[0]
+            if not is_valid_digest(digest):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue # Borrado mientras se recorría.
+            item = entries.setdefault(digest, {"digest": digest, "paths": [], "bytes": 0, "last_used": 0.0})
+            item["paths"].append(entry.path)
+            item["bytes"] += stat.st_size
+            if not entry.name.endswith(".json"):
+                item["last_used"] = max(item["last_used"], stat.st_mtime)
+    return list(entries.values())
+
+
+def purge(now: Optional[float] = None) -> int:
+    """
+    Aplica la retención: borra las imágenes sin usar desde hace `IMAGE_STORE_RETENTION_S` y, mientras el
+    almacén supere `IMAGE_STORE_MAX_BYTES`, las usadas menos recientemente. Retorna cuántas se borraron.
+    """
+    now = time.time() if now is None else now
+    entries = sorted(_list_entries(), key=lambda e: e["last_used"], reverse=True) # Más recientes primero.
+    total = 0
+    removed = 0
+    for entry in entries:
+        total += entry["bytes"]
+        with _pending_lock:
+            if entry["digest"] in _pending:
+                continue # Escritura en curso: aún no se puede borrar.
+        if now - entry["last_used"] > config.IMAGE_STORE_RETENTION_S or total > config.IMAGE_STORE_MAX_BYTES:
+            for path in entry["paths"]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= entry["bytes"]
+            removed += 1
+    if removed:
+        logger.info(f"Image store: purged {removed} image(s); {total / 2**20:.0f}MB kept.")
+    return removed
+
+
+def _maybe_purge() -> None:
+    """Aplica la retención desde el hilo escritor como mucho una vez por `IMAGE_STORE_PURGE_INTERVAL_S`."""
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < config.IMAGE_STORE_PURGE_INTERVAL_S:
+        return
+    _last_purge = now
+    try:
+        purge(now)
+    except OSError as e:
+        logger.warning(f"Image store: retention pass failed: {e}")
+
+
+def _sniff_format(data: bytes) -> str:
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:2] == b"BM":
+        return "bmp"
+    return "unknown"
+
+
+def flush(timeout: Optional[float] = None) -> None:
+    """Espera a que terminen las escrituras pendientes (apagado ordenado y scripts)."""
+    _writer.submit(lambda: None).result(timeout=timeout)
@@ -0,0 +1,631 @@
+# -*- coding: utf-8 -*-
+import abc
+import fnmatch
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+
+# --- Dependencia Opcional: cliente Redis ---
+# Solo la necesita el backend "redis"; los backends "sqlite" y "spool" funcionan sin él.
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# --- Cola de Trabajos Compartida (servidor web -> procesos `worker.py`) ---
+# OBJETIVO: Separar la atención HTTP del análisis de textura para escalar el análisis en horizontal,
+#           con tantos procesos `worker.py` como se quiera en cualquier nodo.
+# CÓMO:
+#   - Un trabajo = metadatos JSON + un blob binario (la imagen). El servidor web lo encola (`submit`) y
+#     espera su resultado (`fetch_result`); un worker lo reclama (`claim`), lo analiza y deja el
+#     resultado JSON (`complete`). El formato de trabajos y resultados está en `services.analysis_jobs`.
+#   - Backends intercambiables (`config.JOB_QUEUE_BACKEND`), todos con la misma interfaz `JobQueue`:
+#       "sqlite": una tabla en un archivo SQLite (WAL). Para un nodo o pruebas locales.
+#       "spool":  un directorio (pending/, claimed/, results/); reclamar = `os.rename` atómico, así que
+#                 varios nodos pueden compartirlo por un sistema de archivos en red.
+#       "redis":  cualquier servidor compatible con el protocolo Redis (Redis >= 6.2, Valkey, KeyDB);
+#                 requiere el paquete `redis`. Con `JOB_QUEUE_REDIS_URL = "memory://"` usa `LocalRedis`,
+#                 un sustituto en memoria para pruebas (sin servidor ni paquete, un solo proceso).
+#   - Un trabajo reclamado sin resultado tras `JOB_QUEUE_LEASE_S` vuelve a la cola (`requeue_expired`,
+#     la llaman los workers): si un worker muere, otro retoma su trabajo.
+# LIMITACIÓN: Entrega "al menos una vez": un worker lento (más que la concesión) puede acabar analizando
+#             lo mismo que otro. El análisis es determinista, así que solo se pierde tiempo de cálculo.
+#             Los resultados que nadie recoge (petición cancelada) caducan tras `JOB_QUEUE_RESULT_TTL_S`.
+
+# Un trabajo reclamado: (job_id, metadatos, blob).
+Job = Tuple[str, Dict[str, Any], bytes]
+
+
+class JobQueue(abc.ABC):
+    """
+    Interfaz común de los backends. Todas las operaciones son bloqueantes (llamar desde un hilo).
+    Un backend al que le falte alguna operación no se puede instanciar (TypeError al crearlo).
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def submit(self, job_id: str, meta: Dict[str, Any], blob: bytes) -> None:
+        """Encola un trabajo."""
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str, timeout: float) -> Optional[Job]:
+        """Reclama el trabajo pendiente más antiguo, esperando como máximo `timeout` segundos."""
+
+    @abc.abstractmethod
+    def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        """Publica el resultado de un trabajo reclamado."""
+
+    @abc.abstractmethod
+    def fetch_result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Devuelve y elimina el resultado de un trabajo, o None si aún no está."""
+
+    @abc.abstractmethod
+    def cancel(self, job_id: str) -> None:
+        """Descarta un trabajo (pendiente o reclamado) y su resultado, si existen."""
+
+    @abc.abstractmethod
+    def requeue_expired(self) -> int:
+        """Devuelve a la cola los trabajos reclamados hace más de `JOB_QUEUE_LEASE_S`; retorna cuántos."""
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Trabajos pendientes, reclamados y resultados por recoger."""
+
+
+def _poll(fn, timeout: float):
+    """Repite `fn()` hasta que devuelva algo distinto de None o se agote `timeout`."""
+    deadline = time.monotonic() + timeout
+    while True:
+        item = fn()
+        if item is not None or time.monotonic() >= deadline:
+            return item
+        time.sleep(min(config.JOB_QUEUE_WORKER_POLL_S, max(0.0, deadline - time.monotonic())))
+
+
+# --- Backend SQLite ---
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    claimed_at REAL,
+    worker_id TEXT,
+    meta TEXT NOT NULL,
+    blob BLOB,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+"""
+
+
+class SqliteJobQueue(JobQueue):
+    """Tabla `jobs` con estado pending -> claimed -> done. El blob se borra al completar el trabajo."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(_SQLITE_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Conexión del hilo actual, abierta y configurada la primera vez: el servidor web consulta
+        `fetch_result` con frecuencia desde los hilos de `asyncio.to_thread`, y abrir una conexión con sus
+        PRAGMA en cada consulta era más caro que la consulta. Por hilo porque `sqlite3` no comparte
+        conexiones entre hilos; se reabre tras un `fork` (`worker.py --processes`).
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # `isolation_level=None`: transacciones explícitas (BEGIN IMMEDIATE al reclamar).
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def submit(self, job_id, meta, blob):
+        self._connect().execute("INSERT INTO jobs (job_id, status, created_at, meta, blob) VALUES (?, 'pending', ?, ?, ?)",
+                                (job_id, time.time(), json.dumps(meta), blob))
+
+    def _claim_once(self, worker_id: str) -> Optional[Job]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE") # Bloqueo de escritura: dos workers no reclaman el mismo trabajo.
+            row = conn.execute("SELECT job_id, meta, blob FROM jobs WHERE status = 'pending' "
+                               "ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            # El blob se conserva hasta completar el trabajo: si el worker muere, otro lo necesita.
+            conn.execute("UPDATE jobs SET status = 'claimed', claimed_at = ?, worker_id = ? WHERE job_id = ?",
+                         (time.time(), worker_id, row[0]))
+            conn.execute("COMMIT")
+            return row[0], json.loads(row[1]), bytes(row[2] or b"")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, worker_id, timeout):
+        return _poll(lambda: self._claim_once(worker_id), timeout)
+
+    def complete(self, job_id, result):
+        # `claimed_at` pasa a ser el instante del resultado (caducidad con `JOB_QUEUE_RESULT_TTL_S`).
+        self._connect().execute("UPDATE jobs SET status = 'done', result = ?, blob = NULL, claimed_at = ? WHERE job_id = ?",
+                                (json.dumps(result), time.time(), job_id))
+
+    def fetch_result(self, job_id):
+        conn = self._connect()
+        row = conn.execute("SELECT result FROM jobs WHERE job_id = ? AND status = 'done'", (job_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return json.loads(row[0])
+
+    def cancel(self, job_id):
+        self._connect().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def requeue_expired(self):
+        now = time.time()
+        conn = self._connect()
+        requeued = conn.execute("UPDATE jobs SET status = 'pending', claimed_at = NULL, worker_id = NULL "
+                                "WHERE status = 'claimed' AND claimed_at < ?",
+                                (now - config.JOB_QUEUE_LEASE_S,)).rowcount
+        conn.execute("DELETE FROM jobs WHERE status = 'done' AND claimed_at < ?",
+                     (now - config.JOB_QUEUE_RESULT_TTL_S,))
+        return requeued
+
+    def stats(self):
+        counts = dict(self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"pending": counts.get("pending", 0), "claimed": counts.get("claimed", 0), "results": counts.get("done", 0)}
+
+
+# --- Backend de directorio (spool) ---
+
+# Archivo de trabajo: longitud de los metadatos (uint32) + metadatos JSON + blob.
+_SPOOL_HEADER = struct.Struct("<I")
+
+
+class SpoolJobQueue(JobQueue):
+    """
+    Un archivo por trabajo que se mueve entre subdirectorios. `os.rename` es atómico dentro del mismo
+    sistema de archivos: de dos workers que reclaman a la vez, solo uno lo consigue.
+    El nombre empieza por el instante de creación (ns), así que el orden alfabético es el de llegada.
+    """
+
+    name = "spool"
+
+    def __init__(self, directory: str):
+        self.pending = os.path.join(directory, "pending")
+        self.claimed = os.path.join(directory, "claimed")
+        self.results = os.path.join(directory, "results")
+        for path in (self.pending, self.claimed, self.results):
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _job_files(self, directory: str, job_id: str):
+        return [name for name in os.listdir(directory) if name.endswith(f"-{job_id}.job")]
+
+    def submit(self, job_id, meta, blob):
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        name = f"{time.time_ns():020d}-{job_id}.job"
+        self._write_atomic(os.path.join(self.pending, name), _SPOOL_HEADER.pack(len(meta_bytes)) + meta_bytes + blob)
+
+    def _claim_once(self, worker_id: str) -> Optional[Job]:
+        for name in sorted(n for n in os.listdir(self.pending) if n.endswith(".job")):
+            target = os.path.join(self.claimed, name)
+            try:
+                os.rename(os.path.join(self.pending, name), target)
+            except FileNotFoundError:
+                continue # Otro worker lo reclamó primero.
+            os.utime(target) # mtime = instante de la reclamación (concesión).
+            with open(target, "rb") as f:
+                data = f.read()
+            (meta_len,) = _SPOOL_HEADER.unpack_from(data)
+            meta_end = _SPOOL_HEADER.size + meta_len
+            job_id = name[:-len(".job")].split("-", 1)[1]
+            return job_id, json.loads(data[_SPOOL_HEADER.size:meta_end]), data[meta_end:]
+        return None
+
+    def claim(self, worker_id, timeout):
+        return _poll(lambda: self._claim_once(worker_id), timeout)
+
+    def complete(self, job_id, result):
+        self._write_atomic(os.path.join(self.results, f"{job_id}.json"), json.dumps(result).encode("utf-8"))
+        for name in self._job_files(self.claimed, job_id):
+            try:
+                os.remove(os.path.join(self.claimed, name))
+            except FileNotFoundError:
+                pass
+
+    def fetch_result(self, job_id):
+        path = os.path.join(self.results, f"{job_id}.json")
+        try:
+            with open(path, "rb") as f:
+                result = json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        os.remove(path)
+        return result
+
+    def cancel(self, job_id):
+        for directory in (self.pending, self.claimed):
+            for name in self._job_files(directory, job_id):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        try:
+            os.remove(os.path.join(self.results, f"{job_id}.json"))
+        except FileNotFoundError:
+            pass
+
+    def requeue_expired(self):
+        now = time.time()
+        requeued = 0
+        for directory, max_age, requeue in ((self.claimed, config.JOB_QUEUE_LEASE_S, True),
+                                            (self.results, config.JOB_QUEUE_RESULT_TTL_S, False)):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    if now - os.path.getmtime(path) <= max_age:
+                        continue
+                    if requeue:
+                        os.rename(path, os.path.join(self.pending, name))
+                        requeued += 1
+                    else:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue # Completado o retomado por otro proceso mientras tanto.
+        return requeued
+
+    def stats(self):
+        count = lambda directory: sum(1 for name in os.listdir(directory) if not name.endswith(".tmp"))
+        return {"pending": count(self.pending), "claimed": count(self.claimed), "results": count(self.results)}
+
+
+# --- Backend Redis (o compatible) ---
+
+class RedisJobQueue(JobQueue):
+    """
+    Claves bajo `config.JOB_QUEUE_REDIS_PREFIX`:
+      `<p>:pending` (lista de ids), `<p>:processing` (lista de ids reclamados), `<p>:job:<id>` (hash meta/blob),
+      `<p>:claimed` (zset id -> instante de la reclamación), `<p>:result:<id>` (JSON con caducidad
+      `JOB_QUEUE_RESULT_TTL_S`).
+    Reclamar = `BLMOVE` atómico de `pending` a `processing` + alta en `claimed`. Si el worker muere entre
+    ambos pasos, el trabajo sigue en `processing`: `requeue_expired` le asigna la concesión al verlo por
+    primera vez sin instante y lo devuelve a la cola cuando caduca (no se pierde).
+    `JOB_QUEUE_REDIS_URL = "memory://"` usa `LocalRedis` en lugar de un servidor.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str):
+        if url.startswith(LOCAL_REDIS_URL):
+            self.client = _local_redis()
+        elif not REDIS_AVAILABLE:
+            raise RuntimeError("JOB_QUEUE_BACKEND='redis' requires the 'redis' package (pip install redis).")
+        else:
+            self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix, *parts))
+
+    def submit(self, job_id, meta, blob):
+        pipe = self.client.pipeline()
+        pipe.hset(self._key("job", job_id), mapping={"meta": json.dumps(meta), "blob": blob})
+        pipe.lpush(self._key("pending"), job_id)
+        pipe.execute()
+
+    def claim(self, worker_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            # El más antiguo (derecha de `pending`) pasa a `processing` en un solo comando.
+            item = self.client.blmove(self._key("pending"), self._key("processing"),
+                                      max(0.1, deadline - time.monotonic()), "RIGHT", "LEFT")
+            if item is None:
+                return None
+            job_id = item.decode("utf-8")
+            self.client.zadd(self._key("claimed"), {job_id: time.time()})
+            meta, blob = self.client.hmget(self._key("job", job_id), "meta", "blob")
+            if meta is not None:
+                return job_id, json.loads(meta), blob or b""
+            self._release(job_id) # Cancelado mientras esperaba.
+            if time.monotonic() >= deadline:
+                return None
+
+    def _release(self, job_id: str) -> None:
+        pipe = self.client.pipeline()
+        pipe.lrem(self._key("processing"), 0, job_id)
+        pipe.zrem(self._key("claimed"), job_id)
+        pipe.execute()
+
+    def complete(self, job_id, result):
+        pipe = self.client.pipeline()
+        pipe.set(self._key("result", job_id), json.dumps(result), ex=int(config.JOB_QUEUE_RESULT_TTL_S))
+        pipe.delete(self._key("job", job_id))
+        pipe.lrem(self._key("processing"), 0, job_id)
+        pipe.zrem(self._key("claimed"), job_id)
+        pipe.execute()
+
+    def fetch_result(self, job_id):
+        pipe = self.client.pipeline()
+        pipe.get(self._key("result", job_id))
+        pipe.delete(self._key("result", job_id))
+        result, _ = pipe.execute()
+        return json.loads(result) if result is not None else None
+
+    def cancel(self, job_id):
+        pipe = self.client.pipeline()
+        pipe.lrem(self._key("pending"), 0, job_id)
+        pipe.lrem(self._key("processing"), 0, job_id)
+        pipe.zrem(self._key("claimed"), job_id)
+        pipe.delete(self._key("job", job_id), self._key("result", job_id))
+        pipe.execute()
+
+    def requeue_expired(self):
+        now = time.time()
+        requeued = 0
+        for raw_id in self.client.lrange(self._key("processing"), 0, -1):
+            job_id = raw_id.decode("utf-8")
+            claimed_at = self.client.zscore(self._key("claimed"), job_id)
+            if claimed_at is None:
+                # Reclamado por un worker que murió antes del ZADD (o que está a punto de hacerlo):
+                # la concesión empieza ahora. NX: no pisar el instante si el worker llega a escribirlo.
+                self.client.zadd(self._key("claimed"), {job_id: now}, nx=True)
+                claimed_at = self.client.zscore(self._key("claimed"), job_id) or now
+            if claimed_at >= now - config.JOB_QUEUE_LEASE_S:
+                continue
+            # `LREM` devuelve 1 solo a un proceso: el trabajo no se reencola dos veces.
+            if self.client.lrem(self._key("processing"), 1, job_id):
+                pipe = self.client.pipeline()
+                pipe.zrem(self._key("claimed"), job_id)
+                pipe.rpush(self._key("pending"), job_id) # Al frente de la cola: ya esperó.
+                pipe.execute()
+                requeued += 1
+        return requeued
+
+    def stats(self):
+        results = sum(1 for _ in self.client.scan_iter(match=self._key("result", "*"), count=1000))
+        return {"pending": self.client.llen(self._key("pending")),
+                "claimed": self.client.llen(self._key("processing")),
+                "results": results}
+
+
+# --- Sustituto local de Redis ---
+
+LOCAL_REDIS_URL = "memory://"
+
+
+class LocalRedis:
+    """
+    Sustituto en memoria de un servidor Redis con los comandos (y tipos de retorno, `bytes`) que usa
+    `RedisJobQueue`. Permite probar ese backend sin servidor ni el paquete `redis`.
+    LIMITACIÓN: Vive dentro de un proceso: la cola solo se comparte entre hilos de ese proceso
+                (tests, o `worker.run_worker` en el mismo proceso que el servidor web). Para varios
+                procesos o nodos hace falta un servidor real (Redis, Valkey, KeyDB...).
+    """
+
+    def __init__(self):
+        self._data: Dict[bytes, Any] = {}
+        self._expires: Dict[bytes, float] = {}
+        self._changed = threading.Condition()
+
+    @staticmethod
+    def _bytes(value: Any) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode("utf-8")
+
+    def _get(self, key: Any, default: Any = None) -> Any:
+        key = self._bytes(key)
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key, default)
+
+    def _container(self, key: Any, factory: type) -> Any:
+        value = self._get(key)
+        if value is None:
+            value = self._data[self._bytes(key)] = factory()
+        return value
+
+    # Cadenas y claves
+    def set(self, name, value, ex=None):
+        with self._changed:
+            key = self._bytes(name)
+            self._data[key] = self._bytes(value)
+            self._expires.pop(key, None)
+            if ex is not None:
+                self._expires[key] = time.time() + ex
+            return True
+
+    def get(self, name):
+        with self._changed:
+            return self._get(name)
+
+    def delete(self, *names):
+        with self._changed:
+            removed = 0
+            for name in names:
+                removed += self._get(name) is not None
+                self._data.pop(self._bytes(name), None)
+                self._expires.pop(self._bytes(name), None)
+            return removed
+
+    def scan_iter(self, match="*", count=None):
+        with self._changed:
+            keys = [key for key in list(self._data) if self._get(key) is not None]
+        pattern = self._bytes(match).decode("utf-8")
+        return iter([key for key in keys if fnmatch.fnmatchcase(key.decode("utf-8"), pattern)])
+
+    # Hashes
+    def hset(self, name, mapping):
+        with self._changed:
+            self._container(name, dict).update({self._bytes(k): self._bytes(v) for k, v in mapping.items()})
+            return len(mapping)
+
+    def hmget(self, name, *keys):
+        with self._changed:
+            values = self._get(name, {})
+            return [values.get(self._bytes(key)) for key in keys]
+
+    # Listas
+    def lpush(self, name, *values):
+        with self._changed:
+            items = self._container(name, list)
+            for value in values:
+                items.insert(0, self._bytes(value))
+            self._changed.notify_all()
+            return len(items)
+
+    def rpush(self, name, *values):
+        with self._changed:
+            items = self._container(name, list)
+            items.extend(self._bytes(value) for value in values)
+            self._changed.notify_all()
+            return len(items)
+
+    def blmove(self, first_list, second_list, timeout, src="LEFT", dest="RIGHT"):
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while not self._get(first_list):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+            source = self._get(first_list)
+            item = source.pop(0 if src == "LEFT" else -1)
+            target = self._container(second_list, list)
+            if dest == "LEFT":
+                target.insert(0, item)
+            else:
+                target.append(item)
+            return item
+
+    def lrem(self, name, count, value):
+        with self._changed:
+            items, value = self._get(name, []), self._bytes(value)
+            positions = [index for index, item in enumerate(items) if item == value]
+            if count < 0:
+                positions.reverse() # Desde el final.
+            if count:
+                positions = positions[:abs(count)]
+            for index in sorted(positions, reverse=True):
+                del items[index]
+            return len(positions)
+
+    def lrange(self, name, start, end):
+        with self._changed:
+            items = self._get(name, [])
+            return list(items[start:None if end == -1 else end + 1])
+
+    def llen(self, name):
+        with self._changed:
+            return len(self._get(name, []))
+
+    # Conjuntos ordenados
+    def zadd(self, name, mapping, nx=False):
+        with self._changed:
+            scores = self._container(name, dict)
+            added = 0
+            for member, score in mapping.items():
+                member = self._bytes(member)
+                if nx and member in scores:
+                    continue
+                added += member not in scores
+                scores[member] = float(score)
+            return added
+
+    def zrem(self, name, *values):
+        with self._changed:
+            scores = self._get(name, {})
+            return sum(scores.pop(self._bytes(value), None) is not None for value in values)
+
+    def zscore(self, name, value):
+        with self._changed:
+            return self._get(name, {}).get(self._bytes(value))
+
+    def pipeline(self) -> "_LocalPipeline":
+        return _LocalPipeline(self)
+
+
+class _LocalPipeline:
+    """Pipeline de `LocalRedis`: acumula comandos y los ejecuta en bloque (sin intercalar otros)."""
+
+    def __init__(self, client: LocalRedis):
+        self._client = client
+        self._commands: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, command: str):
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List[Any]:
+        # La condición es reentrante (RLock): los comandos vuelven a tomarla sin bloquearse.
+        with self._client._changed:
+            results = [getattr(self._client, command)(*args, **kwargs) for command, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+_local_redis_instance: Optional[LocalRedis] = None
+_local_redis_lock = threading.Lock()
+
+
+def _local_redis() -> LocalRedis:
+    """Instancia compartida por el proceso (servidor web y workers en hilos ven la misma cola)."""
+    global _local_redis_instance
+    with _local_redis_lock:
+        if _local_redis_instance is None:
+            _local_redis_instance = LocalRedis()
+        return _local_redis_instance
+
+
+# --- Selección del backend ---
+
+_BACKENDS = {
+    "sqlite": lambda: SqliteJobQueue(config.JOB_QUEUE_SQLITE_PATH),
+    "spool": lambda: SpoolJobQueue(config.JOB_QUEUE_SPOOL_DIR),
+    "redis": lambda: RedisJobQueue(config.JOB_QUEUE_REDIS_URL, config.JOB_QUEUE_REDIS_PREFIX),
+}
+_queues: Dict[str, JobQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(backend: Optional[str] = None) -> JobQueue:
+    """Backend configurado (`config.JOB_QUEUE_BACKEND`) o el indicado; una instancia por proceso."""
+    backend = backend or config.JOB_QUEUE_BACKEND
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown job queue backend '{backend}' (expected one of {sorted(_BACKENDS)}).")
+    with _queues_lock:
+        if backend not in _queues:
+            _queues[backend] = _BACKENDS[backend]()
+        return _queues[backend]
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import random
+import struct
+import threading
+import tracemalloc
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from services import radiograph_io, texture_metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Contabilidad de Memoria por Petición y Presupuesto Global ---
+# OBJETIVO: Evitar que varias radiografías grandes simultáneas agoten la memoria del worker.
+# CÓMO:
+#   1. Antes de analizar, se ESTIMA el pico de memoria a partir de las dimensiones de la imagen
+#      (leídas de la cabecera, sin decodificar) y de los factores por etapa de abajo.
+#   2. La petición RESERVA esa cantidad del presupuesto del proceso. Si supera el límite por
+#      petición se rechaza (413); si el proceso no tiene margen, espera en cola hasta
+#      `MEMORY_BUDGET_QUEUE_TIMEOUT_S` y después se rechaza (503).
+#   3. Durante el análisis, `MemoryTracker` contabiliza los bytes de cada etapa (a partir de
+#      `ndarray.nbytes`) y, opcionalmente, el pico real medido con `tracemalloc` (muestreado).
+#   4. El pico se registra en el log y en las métricas del proceso (`stats()`).
+#   La ingesta y el análisis se ejecutan en hilos (`image_analysis.analyze_*`, `image_store.ingest` vía
+#   `run_in_threadpool`), así que el event loop sigue libre y varias peticiones pueden analizar a la vez:
+#   la reserva es lo que limita cuántas.
+#   Las estimaciones incluyen además la memoria de trabajo del núcleo por lotes de las métricas de
+#   textura (`texture_metrics.working_bytes`): todas las ROIs se calculan juntas, pero sus búferes están
+#   acotados por `TEXTURE_BATCH_BUFFER_BYTES` sea cual sea el número de ROIs (salvo con `samp_en`, que
+#   construye la matriz completa de distancias de una ROI cada vez).
+
+# Bytes por píxel de cada etapa de la ruta JPEG/PNG (ver `analyze_rois_texture`).
+_BYTES_PER_PIXEL_DECODE = {
+    "decoded_color": 3,  # cv2.imdecode BGR uint8.
+    "gray": 1,           # cv2.cvtColor -> uint8.
+    "rescale_tmp": 8,    # exposure.rescale_intensity trabaja en float64.
+    "prepared": 1,       # Resultado uint8.
+    "roi_masks": 3,      # Máscara + máscara dilatada (uint8) + comparación booleana.
+}
+# Etapas de la ruta nativa (solo sobre la caja envolvente de las ROIs).
+_BYTES_PER_PIXEL_NATIVE_EXTRA = {
+    "rescale_tmp": 8,
+    "prepared": 1,
+    "roi_masks": 3,
+}
+
+
+class MemoryBudgetExceeded(Exception):
+    """La petición no cabe en el presupuesto de memoria (por petición o del proceso)."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# --- Estimación a partir de cabeceras ---
+
+def _png_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    if data[:8] != b"\x89PNG\r\n\x1a\n" or len(data) < 24:
+        return None
+    width, height = struct.unpack(">II", data[16:24])
+    return height, width
+
+
+def _jpeg_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    if data[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7: # Marcadores sin longitud.
+            pos += 2
+            continue
+        (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+        # SOF0..SOF15 excepto DHT (C4), JPG (C8) y DAC (CC).
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return height, width
+        pos += 2 + length
+    return None
+
+
+def image_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """Lee (alto, ancho) de la cabecera de un JPEG o PNG sin decodificarlo."""
+    return _png_dimensions(data) or _jpeg_dimensions(data)
+
+
+def estimate_decoded_image_bytes(file_content: bytes) -> int:
+    """
+    Estima el pico de memoria de `analyze_rois_texture` para una imagen comprimida.
+
+    Si las dimensiones no se pueden leer de la cabecera, se asume una tasa de compresión
+    conservadora (`MEMORY_UNKNOWN_COMPRESSION_RATIO`) sobre el tamaño del archivo.
+    """
+    dims = image_dimensions(file_content)
+    if dims is None:
+        pixels = len(file_content) * config.MEMORY_UNKNOWN_COMPRESSION_RATIO // 3
+    else:
+        pixels = dims[0] * dims[1]
+    return len(file_content) + pixels * sum(_BYTES_PER_PIXEL_DECODE.values()) + texture_metrics.working_bytes()
+
+
+def estimate_gray_image_bytes(shape: Tuple[int, ...]) -> int:
+    """Estima el pico de memoria de `analyze_gray_image` (imagen ya en escala de grises, sin decodificar)."""
+    pixels = int(np.prod(shape[:2]))
+    return pixels * sum(v for k, v in _BYTES_PER_PIXEL_DECODE.items() if k != "decoded_color") + texture_metrics.working_bytes()
+
+
+def estimate_native_radiograph_bytes(path: str, rois: List[np.ndarray]) -> int:
+    """Estima el pico de memoria de `analyze_native_radiograph` (solo la región de las ROIs)."""
+    pixels, _ = radiograph_io.open_native_radiograph(path)
+    bbox = radiograph_io.roi_union_bbox(rois, pixels.shape, margin=config.NATIVE_IMAGE_ROI_MARGIN)
+    if bbox is None:
+        return 0
+    x0, y0, x1, y1 = bbox
+    area = (x1 - x0) * (y1 - y0)
+    return area * (pixels.dtype.itemsize + sum(_BYTES_PER_PIXEL_NATIVE_EXTRA.values())) + texture_metrics.working_bytes()
+
+
+# --- Contabilidad por etapas ---
+
+# `tracemalloc` es global al proceso: se activa mientras haya al menos una petición muestreada.
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+class MemoryTracker:
+    """
+    Contabiliza la memoria estimada de cada etapa de una petición.
+
+    `alloc(stage, nbytes)` marca una etapa como viva y `free(stage)` la libera; el pico es el
+    máximo de la suma de etapas vivas. Con muestreo `tracemalloc` activo se añade el pico real
+    de asignaciones Python/NumPy (las matrices internas de OpenCV no son visibles para tracemalloc,
+    y con peticiones concurrentes el valor incluye las asignaciones de las demás).
+    """
+
+    def __init__(self, label: str, sample_tracemalloc: Optional[bool] = None):
+        self.label = label
+        self.live: Dict[str, int] = {}
+        self.stage_peaks: Dict[str, int] = {}
+        self.peak_bytes = 0
+        self.tracemalloc_peak_bytes: Optional[int] = None
+        if sample_tracemalloc is None:
+            sample_tracemalloc = random.random() < config.MEMORY_TRACEMALLOC_SAMPLE_RATE
+        self._sampling = sample_tracemalloc
+        if self._sampling:
+            _tracemalloc_acquire()
+
+    def alloc(self, stage: str, nbytes: int) -> None:
+        self.live[stage] = self.live.get(stage, 0) + int(nbytes)
+        self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), self.live[stage])
+        self.peak_bytes = max(self.peak_bytes, sum(self.live.values()))
+
+    def free(self, *stages: str) -> None:
+        for stage in stages:
+            self.live.pop(stage, None)
+
+    def finish(self) -> Dict[str, Any]:
+        """Cierra la contabilidad, registra el resumen y actualiza las métricas del proceso."""
+        if self._sampling:
+            self.tracemalloc_peak_bytes = tracemalloc.get_traced_memory()[1]
+            _tracemalloc_release()
+            self._sampling = False
+        summary = {
+            "label": self.label,
+            "peak_bytes": self.peak_bytes,
+            "tracemalloc_peak_bytes": self.tracemalloc_peak_bytes,
+            "stages": dict(self.stage_peaks),
+        }
+        stages_mb = ", ".join(f"{k}={v / 2**20:.1f}MB" for k, v in self.stage_peaks.items())
+        traced = f", tracemalloc peak={self.tracemalloc_peak_bytes / 2**20:.1f}MB" if self.tracemalloc_peak_bytes is not None else ""
+        logger.info(f"[{self.label}] Memory peak (estimated) {self.peak_bytes / 2**20:.1f}MB{traced} [{stages_mb}]")
+        _budget.record_peak(self.peak_bytes, self.tracemalloc_peak_bytes)
+        return summary
+
+
+def _tracemalloc_acquire() -> None:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+
+
+def _tracemalloc_release() -> None:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+# --- Presupuesto del proceso ---
+
+class _ProcessBudget:
+    """Reserva de memoria compartida por todas las peticiones del proceso (event loop único)."""
+
+    def __init__(self):
+        self.reserved_bytes = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self.metrics: Dict[str, Any] = {
+            "requests": 0,
+            "queued": 0,
+            "rejected_per_request": 0,
+            "rejected_process": 0,
+            "max_estimated_peak_bytes": 0,
+            "last_estimated_peak_bytes": 0,
+            "max_tracemalloc_peak_bytes": None,
+        }
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Se crea perezosamente para ligarla al event loop en ejecución.
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int) -> AsyncIterator[None]:
+        self.metrics["requests"] += 1
+        if nbytes > config.MEMORY_BUDGET_PER_REQUEST_BYTES:
+            self.metrics["rejected_per_request"] += 1
+            raise MemoryBudgetExceeded(
+                f"Estimated memory {nbytes / 2**20:.0f}MB exceeds the per-request budget "
+                f"of {config.MEMORY_BUDGET_PER_REQUEST_BYTES / 2**20:.0f}MB",
+                status_code=413
+            )
+        condition = self._get_condition()
+        async with condition:
+            if self.reserved_bytes + nbytes > config.MEMORY_BUDGET_PROCESS_BYTES:
+                self.metrics["queued"] += 1
+                logger.info(f"Memory budget: queuing request needing {nbytes / 2**20:.0f}MB "
+                            f"({self.reserved_bytes / 2**20:.0f}MB reserved).")
+                try:
+                    await asyncio.wait_for(
+                        condition.wait_for(lambda: self.reserved_bytes + nbytes <= config.MEMORY_BUDGET_PROCESS_BYTES),
+                        timeout=config.MEMORY_BUDGET_QUEUE_TIMEOUT_S
+                    )
+                except asyncio.TimeoutError:
+                    self.metrics["rejected_process"] += 1
+                    raise MemoryBudgetExceeded("Server memory budget exhausted, try again later", status_code=503)
+            self.reserved_bytes += nbytes
+        try:
+            yield
+        finally:
+            async with condition:
+                self.reserved_bytes -= nbytes
+                condition.notify_all()
+
+    def record_peak(self, peak_bytes: int, tracemalloc_peak: Optional[int]) -> None:
+        self.metrics["last_estimated_peak_bytes"] = peak_bytes
+        self.metrics["max_estimated_peak_bytes"] = max(self.metrics["max_estimated_peak_bytes"], peak_bytes)
+        if tracemalloc_peak is not None:
+            self.metrics["max_tracemalloc_peak_bytes"] = max(self.metrics["max_tracemalloc_peak_bytes"] or 0, tracemalloc_peak)
+
+
+_budget = _ProcessBudget()
+
+
+def reserve(nbytes: int):
+    """Context manager asíncrono que reserva `nbytes` del presupuesto del proceso (ver `_ProcessBudget`)."""
+    return _budget.reserve(nbytes)
+
+
+def stats() -> Dict[str, Any]:
+    """Métricas de memoria del proceso (para el endpoint de métricas)."""
+    return {
+        **_budget.metrics,
+        "reserved_bytes": _budget.reserved_bytes,
+        "per_request_budget_bytes": config.MEMORY_BUDGET_PER_REQUEST_BYTES,
+        "process_budget_bytes": config.MEMORY_BUDGET_PROCESS_BYTES,
+    }
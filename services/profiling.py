@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+import functools
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Perfilado Bajo Demanda por Petición ---
+# OBJETIVO: Poder ver por qué UNA radiografía concreta es lenta en un nodo de producción,
+#           sin reproducirla en local y sin coste para el resto de peticiones.
+# CÓMO:
+#   - Un hilo muestreador lee periódicamente (`sys._current_frames`) la pila del hilo del event loop
+#     (parseo multipart, puntuación) y la de los hilos que trabajan para la petición: el trabajo de CPU
+#     (ingesta, decodificación, extracción, preprocesado, DistEn2D) va a `asyncio.to_thread` /
+#     `run_in_threadpool` envuelto en `sampled(func)`, que registra el hilo en el muestreador de la
+#     petición (variable de contexto, que ambos propagan al hilo) mientras dura la llamada.
+#     Cada hilo es un perfil aparte en speedscope y una raíz `[hilo]` en "collapsed".
+#     El coste es proporcional a la frecuencia de muestreo, no al número de llamadas (a diferencia de `cProfile`).
+#   - Se activa por petición con la cabecera de administración (`PROFILING_HEADER`) o, opcionalmente,
+#     por muestreo aleatorio a baja tasa (`PROFILING_SAMPLE_RATE`).
+#   - El resultado se guarda como artefacto speedscope (https://www.speedscope.app) y en formato
+#     "collapsed stacks" (flamegraph.pl / inferno), descargables desde `/api/admin/profiles`.
+#   - Con `PROFILING_ENABLED = False` el middleware ni siquiera se registra: coste cero.
+# LIMITACIÓN: Solo aparece el trabajo en hilos lanzado con `sampled`. Si hay peticiones concurrentes en el
+#             mismo proceso, sus pasos en el event loop también se mezclan en el perfil (sus hilos no).
+#             Los workers remotos (`worker.py`) no se perfilan: la petición solo muestra la espera.
+
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+T = TypeVar("T")
+
+# Muestreador de la petición en curso (lo fija `StackSampler.start`; se hereda en tareas e hilos).
+_active_sampler: ContextVar[Optional["StackSampler"]] = ContextVar("profiling_sampler", default=None)
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    """Comprueba el token de administración (comparación en tiempo constante)."""
+    expected = config.PROFILING_ADMIN_TOKEN
+    return bool(expected) and token is not None and hmac.compare_digest(token, expected)
+
+
+def should_profile(path: str, token: Optional[str]) -> bool:
+    """Decide si una petición se perfila: token de administración válido o muestreo aleatorio."""
+    if path not in config.PROFILING_PATHS:
+        return False
+    if token is not None and is_authorized(token):
+        return True
+    return config.PROFILING_SAMPLE_RATE > 0 and random.random() < config.PROFILING_SAMPLE_RATE
+
+
+class StackSampler:
+    """
+    Muestreador de pila de los hilos de una petición. `start()` lanza un hilo daemon que, cada `interval`
+    segundos, registra la pila actual del hilo objetivo (el que llama a `start`, el del event loop) y de
+    los hilos registrados con `add_thread` (ver `sampled`); `stop()` lo detiene.
+    """
+
+    def __init__(self, target_thread_id: Optional[int] = None, interval: Optional[float] = None):
+        self.target_thread_id = target_thread_id or threading.get_ident()
+        self.interval = interval or config.PROFILING_INTERVAL_S
+        self.frames: List[Tuple[str, str, int]] = [] # (función, archivo, línea de definición)
+        self._frame_index: Dict[Tuple[str, str, int], int] = {}
+        self.samples: List[List[int]] = [] # Índices de `frames`, de la raíz a la hoja.
+        self.weights: List[float] = []     # Segundos representados por cada muestra.
+        self.sample_threads: List[str] = [] # Hilo de cada muestra.
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._threads: Dict[int, str] = {self.target_thread_id: "event-loop"} # ident -> nombre en el perfil.
+        self._threads_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._context_token = None
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._context_token = _active_sampler.set(self)
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._context_token is not None:
+            _active_sampler.reset(self._context_token)
+            self._context_token = None
+        self.duration = time.perf_counter() - self.started_at
+
+    def add_thread(self, ident: int, name: str) -> bool:
+        """Muestrea también el hilo `ident`. Retorna False si ya se muestreaba."""
+        with self._threads_lock:
+            if ident in self._threads:
+                return False
+            self._threads[ident] = name
+            return True
+
+    def remove_thread(self, ident: int) -> None:
+        with self._threads_lock:
+            self._threads.pop(ident, None)
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            current = sys._current_frames()
+            now = time.perf_counter()
+            with self._threads_lock:
+                threads = list(self._threads.items())
+            for ident, name in threads:
+                frame = current.get(ident)
+                if frame is not None:
+                    self._record(frame, now - last, name)
+            last = now
+
+    def _record(self, frame, weight: float, thread: str) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self._frame_index.get(key)
+            if index is None:
+                index = self._frame_index[key] = len(self.frames)
+                self.frames.append(key)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        self.samples.append(stack)
+        self.weights.append(weight)
+        self.sample_threads.append(thread)
+
+    # --- Exportación ---
+
+    def to_speedscope(self, name: str) -> Dict[str, Any]:
+        """Perfil en el formato de archivo de speedscope (perfil "sampled", unidades en segundos)."""
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "eotrh-watch",
+            "activeProfileIndex": 0,
+            "shared": {"frames": [
+                {"name": func, "file": _short_path(filename), "line": line} for func, filename, line in self.frames
+            ]},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{name} [{thread}]",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": [s for s, t in zip(self.samples, self.sample_threads) if t == thread],
+                "weights": [w for w, t in zip(self.weights, self.sample_threads) if t == thread],
+            } for thread in dict.fromkeys(self.sample_threads)], # Un perfil por hilo, en orden de aparición.
+        }
+
+    def to_collapsed(self) -> str:
+        """Pilas agregadas "raíz;...;hoja peso_ms" (entrada de flamegraph.pl / inferno)."""
+        totals: Dict[str, float] = {}
+        for stack, weight, thread in zip(self.samples, self.weights, self.sample_threads):
+            key = ";".join([f"[{thread}]", *(f"{self.frames[i][0]} ({_short_path(self.frames[i][1])}:{self.frames[i][2]})" for i in stack)])
+            totals[key] = totals.get(key, 0.0) + weight
+        return "\n".join(f"{key} {max(1, round(ms * 1000))}" for key, ms in totals.items()) + "\n"
+
+
+def sampled(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Envuelve una función que se va a ejecutar en un hilo (`asyncio.to_thread(sampled(f), ...)`,
+    `run_in_threadpool(sampled(f), ...)`): si la petición que la lanza se está perfilando, su hilo se
+    muestrea mientras dura la llamada. Sin perfil activo solo cuesta leer la variable de contexto.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        sampler = _active_sampler.get()
+        if sampler is None:
+            return func(*args, **kwargs)
+        ident = threading.get_ident()
+        added = sampler.add_thread(ident, threading.current_thread().name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if added:
+                sampler.remove_thread(ident)
+    return wrapper
+
+
+def _short_path(filename: str) -> str:
+    """Ruta relativa al proyecto o a site-packages, para que el perfil no exponga rutas absolutas."""
+    for marker in ("site-packages" + os.sep, os.getcwd() + os.sep):
+        position = filename.find(marker)
+        if position != -1:
+            return filename[position + len(marker):]
+    return os.path.basename(filename)
+
+
+# --- Almacén de artefactos ---
+
+def _artifact_path(profile_id: str, fmt: str) -> str:
+    suffix = ".speedscope.json" if fmt == "speedscope" else ".collapsed.txt"
+    return os.path.join(config.PROFILING_DIR, profile_id + suffix)
+
+
+def save_profile(sampler: StackSampler, label: str) -> str:
+    """
+    Guarda el perfil (speedscope + collapsed) y aplica la retención (`PROFILING_MAX_ARTIFACTS`).
+    Bloqueante: llamar desde el threadpool.
+
+    Returns:
+        El identificador del perfil.
+    """
+    os.makedirs(config.PROFILING_DIR, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    with open(_artifact_path(profile_id, "speedscope"), "w", encoding="utf-8") as f:
+        json.dump(sampler.to_speedscope(f"{label} {profile_id}"), f)
+    with open(_artifact_path(profile_id, "collapsed"), "w", encoding="utf-8") as f:
+        f.write(sampler.to_collapsed())
+    logger.info(f"Profile {profile_id} saved ({label}, {len(sampler.samples)} samples, {sampler.duration * 1000:.0f}ms).")
+    _enforce_retention()
+    return profile_id
+
+
+def _enforce_retention() -> None:
+    profiles = list_profiles()
+    for stale in profiles[config.PROFILING_MAX_ARTIFACTS:]:
+        for fmt in ("speedscope", "collapsed"):
+            try:
+                os.remove(_artifact_path(stale["profile_id"], fmt))
+            except OSError:
+                pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Perfiles guardados, del más reciente al más antiguo."""
+    if not os.path.isdir(config.PROFILING_DIR):
+        return []
+    profiles = []
+    for entry in os.scandir(config.PROFILING_DIR):
+        if entry.name.endswith(".speedscope.json"):
+            stat = entry.stat()
+            profiles.append({
+                "profile_id": entry.name[:-len(".speedscope.json")],
+                "created_at": stat.st_mtime,
+                "size_bytes": stat.st_size,
+            })
+    profiles.sort(key=lambda p: p["profile_id"], reverse=True)
+    return profiles
+
+
+def profile_artifact_path(profile_id: str, fmt: str) -> Optional[str]:
+    """Ruta del artefacto pedido, o None si no existe (o el identificador no es válido)."""
+    if fmt not in ("speedscope", "collapsed") or not profile_id.replace("-", "").isalnum():
+        return None
+    path = _artifact_path(profile_id, fmt)
+    return path if os.path.isfile(path) else None
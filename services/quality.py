@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Calidad de Análisis Adaptativa a la Carga ---
+# OBJETIVO: En horas punta, devolver rápido una puntuación digital algo más gruesa en lugar de
+#           agotar el tiempo de espera, e informar siempre del nivel de calidad usado.
+# CÓMO:
+#   - Niveles (`tiers()`): "full" (`DISTEN_TARGET_SIZE`, todos los píxeles de la ROI) seguido de
+#     `QUALITY_DEGRADED_TIERS`, cada uno más barato: menor tamaño objetivo (DistEn2D es O(P^2) en el
+#     número de patrones) y, opcionalmente, un máximo de píxeles por ROI (muestreo con paso fijo).
+#     Esa lista es el límite: nunca se baja del último nivel configurado.
+#   - Presión = max(peticiones en curso / `QUALITY_QUEUE_DEPTH_HIGH`,
+#                   percentil `QUALITY_LATENCY_PERCENTILE` de las latencias recientes / `QUALITY_LATENCY_HIGH_MS`).
+#     Peticiones en curso = las que están dentro de un endpoint de cálculo (`track_request`), desde que
+#     entran hasta que responden: analizando, esperando presupuesto de memoria o en la cola de workers.
+#     Latencia = desde la llegada de la petición al endpoint hasta el final de su análisis, así que crece
+#     con el tiempo que pasa esperando detrás de las demás.
+#   - Con presión >= 1 se baja un nivel; con presión <= `QUALITY_RECOVER_RATIO` se sube uno. Entre
+#     cambios pasan al menos `QUALITY_HOLD_S` y las latencias se descartan (eran de otro nivel).
+#   - Sin peticiones en curso ni latencias recientes (todas más antiguas que `QUALITY_LATENCY_WINDOW_S`),
+#     se vuelve directamente a "full".
+# LIMITACIÓN: Con una carga estable justo en el límite, el nivel puede alternar entre dos vecinos
+#             (como mucho una vez cada `QUALITY_HOLD_S`). Los niveles reducidos cambian algo DistEn2D
+#             (los umbrales se calibraron a `DISTEN_TARGET_SIZE`): por eso se informa en el resultado.
+
+FULL_TIER_NAME = "full"
+
+
+class QualityTier(NamedTuple):
+    name: str
+    target_size: Tuple[int, int] # Tamaño de la ROI preprocesada para DistEn2D.
+    max_roi_pixels: Optional[int] # Máximo de píxeles extraídos por ROI antes de preprocesar (None = todos).
+
+
+def tiers() -> List[QualityTier]:
+    """Niveles de calidad, del mejor al más barato."""
+    full = QualityTier(FULL_TIER_NAME, tuple(config.DISTEN_TARGET_SIZE), None)
+    return [full, *(QualityTier(name, tuple(size), max_pixels) for name, size, max_pixels in config.QUALITY_DEGRADED_TIERS)]
+
+
+def full_tier() -> QualityTier:
+    return tiers()[0]
+
+
+def sample_roi_pixels(roi_pixels: np.ndarray, tier: QualityTier) -> np.ndarray:
+    """Limita los píxeles de una ROI a `tier.max_roi_pixels` tomando uno de cada `paso` (sin copiar)."""
+    if tier.max_roi_pixels is None or roi_pixels.size <= tier.max_roi_pixels:
+        return roi_pixels
+    step = -(-roi_pixels.size // tier.max_roi_pixels) # Techo de la división.
+    return roi_pixels[::step]
+
+
+class _QualityController:
+    """Estado del nivel de calidad del proceso (event loop único, como `memory_budget._ProcessBudget`)."""
+
+    def __init__(self):
+        self.level = 0
+        self.in_flight = 0
+        self.changed_at = 0.0
+        self.latencies: Deque[Tuple[float, float]] = deque(maxlen=256) # (instante, ms)
+        self.metrics: Dict[str, Any] = {"requests": 0, "degraded_requests": 0, "tier_changes": 0}
+
+    def _recent_latency_ms(self, now: float) -> Optional[float]:
+        while self.latencies and now - self.latencies[0][0] > config.QUALITY_LATENCY_WINDOW_S:
+            self.latencies.popleft()
+        if len(self.latencies) < config.QUALITY_LATENCY_MIN_SAMPLES:
+            return None
+        return float(np.percentile([ms for _, ms in self.latencies], config.QUALITY_LATENCY_PERCENTILE))
+
+    def select(self) -> Tuple[QualityTier, Optional[str]]:
+        """Nivel para la petición que va a analizarse ahora y, si no es "full", el motivo."""
+        available = tiers()
+        self.metrics["requests"] += 1
+        if not config.QUALITY_ADAPTIVE_ENABLED or len(available) == 1:
+            return available[0], None
+
+        now = time.monotonic()
+        depth = self.in_flight - 1 # Otras peticiones en curso (esta ya está contada).
+        latency = self._recent_latency_ms(now)
+        depth_pressure = depth / config.QUALITY_QUEUE_DEPTH_HIGH
+        latency_pressure = (latency or 0.0) / config.QUALITY_LATENCY_HIGH_MS
+        pressure = max(depth_pressure, latency_pressure)
+
+        previous = self.level
+        if depth <= 0 and not self.latencies:
+            self.level = 0 # Sin carga reciente: calidad completa inmediatamente.
+        elif now - self.changed_at >= config.QUALITY_HOLD_S:
+            if pressure >= 1.0 and self.level < len(available) - 1:
+                self.level += 1
+            elif pressure <= config.QUALITY_RECOVER_RATIO and self.level > 0:
+                self.level -= 1
+        self.level = min(self.level, len(available) - 1)
+        if self.level != previous:
+            self.changed_at = now
+            self.latencies.clear()
+            self.metrics["tier_changes"] += 1
+            logger.warning(
+                f"Analysis quality {available[previous].name} -> {available[self.level].name} "
+                f"(in flight {depth}, recent latency {latency if latency is None else round(latency)} ms)."
+            )
+
+        tier = available[self.level]
+        if self.level == 0:
+            return tier, None
+        self.metrics["degraded_requests"] += 1
+        if depth_pressure >= latency_pressure:
+            reason = f"{depth} other analyses in progress (limit {config.QUALITY_QUEUE_DEPTH_HIGH})"
+        else:
+            reason = (f"p{config.QUALITY_LATENCY_PERCENTILE:g} latency {latency:.0f} ms "
+                      f"(limit {config.QUALITY_LATENCY_HIGH_MS:.0f} ms)")
+        return tier, reason
+
+    def record_latency(self, latency_ms: float) -> None:
+        self.latencies.append((time.monotonic(), latency_ms))
+
+
+_controller = _QualityController()
+
+
+@contextmanager
+def track_request() -> Iterator[None]:
+    """Cuenta la petición como "en curso" (profundidad de cola) mientras dura el bloque."""
+    _controller.in_flight += 1
+    try:
+        yield
+    finally:
+        _controller.in_flight -= 1
+
+
+def select_tier() -> Tuple[QualityTier, Optional[str]]:
+    """Nivel de calidad para la petición actual (ver `_QualityController.select`)."""
+    return _controller.select()
+
+
+def record_latency(latency_ms: float) -> None:
+    """Registra la latencia (ms) de una petición analizada."""
+    _controller.record_latency(latency_ms)
+
+
+def stats() -> Dict[str, Any]:
+    """Estado del control de calidad (para el endpoint de métricas)."""
+    return {
+        **_controller.metrics,
+        "enabled": config.QUALITY_ADAPTIVE_ENABLED,
+        "tier": tiers()[min(_controller.level, len(tiers()) - 1)].name,
+        "in_flight": _controller.in_flight,
+        "recent_latency_ms": _controller._recent_latency_ms(time.monotonic()),
+    }
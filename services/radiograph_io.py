@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import shutil
+import struct
+import tempfile
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Ingesta de Radiografías Nativas (TIFF 16-bit / DICOM sin comprimir) ---
+# OBJETIVO: Leer radiografías digitales nativas sin pasar por `cv2.imdecode`, que
+#           carga la imagen entera en RAM y la reduce a 8 bits.
+# CÓMO: Se interpreta únicamente la cabecera del archivo para localizar el bloque de
+#       píxeles y se devuelve un `np.memmap` sobre el archivo en disco. Quien lo use
+#       solo leerá (paginará) la región que recorte.
+# LIMITACIONES: Solo formatos sin compresión y de un único canal:
+#   - TIFF baseline (strips contiguos, Compression=1, SamplesPerPixel=1, 8/16 bits).
+#   - DICOM Little Endian (implícito o explícito), Pixel Data no encapsulado.
+#   Los demás TIFF (LZW/Deflate, color, en mosaicos) los decodifica OpenCV por la ruta común
+#   (`main._read_upload` comprueba `open_native_radiograph` y, si falla, vuelve a esa ruta).
+
+TIFF_MAGICS = (b"II*\x00", b"MM\x00*")
+DICOM_MAGIC_OFFSET = 128
+DICOM_MAGIC = b"DICM"
+
+# Transfer Syntax UIDs DICOM soportados (sin compresión, little endian).
+_DICOM_IMPLICIT_LE = "1.2.840.10008.1.2"
+_DICOM_EXPLICIT_LE = "1.2.840.10008.1.2.1"
+_DICOM_SUPPORTED_SYNTAXES = (_DICOM_IMPLICIT_LE, _DICOM_EXPLICIT_LE)
+# VRs explícitos con 2 bytes reservados + longitud de 4 bytes.
+_DICOM_LONG_VRS = {b"OB", b"OD", b"OF", b"OL", b"OV", b"OW", b"SQ", b"SV", b"UC", b"UN", b"UR", b"UT", b"UV"}
+_DICOM_UNDEFINED_LENGTH = 0xFFFFFFFF
+
+# Bytes necesarios para reconocer el formato a partir del inicio del archivo.
+NATIVE_HEADER_PEEK_BYTES = DICOM_MAGIC_OFFSET + len(DICOM_MAGIC)
+
+
+def is_native_radiograph(header: bytes) -> bool:
+    """Indica si los primeros bytes de un archivo corresponden a un TIFF o un DICOM."""
+    if is_tiff(header):
+        return True
+    return header[DICOM_MAGIC_OFFSET:DICOM_MAGIC_OFFSET + len(DICOM_MAGIC)] == DICOM_MAGIC
+
+
+def is_tiff(header: bytes) -> bool:
+    """Indica si los primeros bytes de un archivo corresponden a un TIFF."""
+    return header[:4] in TIFF_MAGICS
+
+
+def spool_upload_to_disk(fileobj: BinaryIO, suffix: str = "") -> str:
+    """
+    Copia por bloques un archivo subido a un archivo temporal en disco.
+
+    POR QUÉ: `np.memmap` necesita una ruta real. Copiar por bloques evita tener
+             el estudio completo en memoria como `bytes`.
+
+    Returns:
+        Ruta del archivo temporal. El llamador es responsable de eliminarlo.
+    """
+    fileobj.seek(0)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=config.NATIVE_IMAGE_SPOOL_DIR)
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(fileobj, out, length=1024 * 1024)
+    logger.debug(f"Upload spooled to {path} ({os.path.getsize(path)} bytes).")
+    return path
+
+
+def open_native_radiograph(path: str) -> Tuple[np.ndarray, bool]:
+    """
+    Abre una radiografía nativa como `np.memmap` 2D de solo lectura.
+
+    Args:
+        path: Ruta a un archivo TIFF o DICOM.
+
+    Returns:
+        Tupla (pixels, inverted):
+            - pixels: `np.memmap` 2D (alto, ancho) con el dtype nativo del archivo.
+            - inverted: True si la fotometría indica blanco = 0 (MONOCHROME1 / WhiteIsZero).
+
+    Raises:
+        ValueError: Si el formato no se reconoce o no está soportado.
+    """
+    with open(path, "rb") as f:
+        header = f.read(NATIVE_HEADER_PEEK_BYTES)
+        try:
+            if is_tiff(header):
+                return _open_tiff(f, path)
+            if header[DICOM_MAGIC_OFFSET:] == DICOM_MAGIC:
+                return _open_dicom(f, path)
+        except struct.error as e:
+            # Cabecera truncada: un campo no tiene los bytes que indica su tipo.
+            raise ValueError(f"Truncated or malformed radiograph header: {e}") from e
+    raise ValueError("Unrecognised native radiograph format (expected TIFF or DICOM)")
+
+
+# --- TIFF ---
+
+_TIFF_TYPE_FORMATS = {3: "H", 4: "I"} # SHORT, LONG (únicos tipos usados por las etiquetas que leemos).
+
+def _read_tiff_tags(f: BinaryIO, endian: str, ifd_offset: int) -> Dict[int, List[int]]:
+    """Lee las entradas del primer IFD de un TIFF (solo tipos SHORT/LONG)."""
+    f.seek(ifd_offset)
+    (n_entries,) = struct.unpack(endian + "H", f.read(2))
+    raw_entries = f.read(12 * n_entries)
+    tags: Dict[int, List[int]] = {}
+    for i in range(n_entries):
+        entry = raw_entries[i * 12:(i + 1) * 12]
+        tag, typ, count = struct.unpack(endian + "HHI", entry[:8])
+        fmt = _TIFF_TYPE_FORMATS.get(typ)
+        if fmt is None:
+            continue # Etiquetas de otros tipos (ASCII, RATIONAL...) no son necesarias.
+        size = struct.calcsize(fmt) * count
+        if size <= 4:
+            data = entry[8:8 + size]
+        else:
+            (value_offset,) = struct.unpack(endian + "I", entry[8:12])
+            pos = f.tell()
+            f.seek(value_offset)
+            data = f.read(size)
+            f.seek(pos)
+        tags[tag] = list(struct.unpack(endian + fmt * count, data))
+    return tags
+
+
+def _open_tiff(f: BinaryIO, path: str) -> Tuple[np.ndarray, bool]:
+    f.seek(0)
+    byte_order = f.read(2)
+    endian = "<" if byte_order == b"II" else ">"
+    f.seek(4)
+    (ifd_offset,) = struct.unpack(endian + "I", f.read(4))
+    tags = _read_tiff_tags(f, endian, ifd_offset)
+
+    width = tags.get(256, [0])[0]
+    height = tags.get(257, [0])[0]
+    bits = tags.get(258, [1])[0]
+    compression = tags.get(259, [1])[0]
+    photometric = tags.get(262, [1])[0]
+    samples = tags.get(277, [1])[0]
+    sample_format = tags.get(339, [1])[0]
+    strip_offsets = tags.get(273)
+    strip_counts = tags.get(279)
+
+    if compression != 1:
+        raise ValueError(f"Compressed TIFF is not supported (Compression={compression})")
+    if samples != 1 or photometric not in (0, 1):
+        raise ValueError("Only single-channel grayscale TIFF is supported")
+    if bits not in (8, 16):
+        raise ValueError(f"Unsupported TIFF bit depth: {bits}")
+    if not strip_offsets or not strip_counts or not width or not height:
+        raise ValueError("Tiled or malformed TIFF is not supported")
+
+    # Los strips deben ser contiguos para poder mapear la imagen como un único bloque.
+    for offset, count, next_offset in zip(strip_offsets, strip_counts, strip_offsets[1:]):
+        if offset + count != next_offset:
+            raise ValueError("TIFF strips are not contiguous")
+
+    dtype = np.dtype(f"{'i' if sample_format == 2 else 'u'}{bits // 8}").newbyteorder(endian)
+    pixels = np.memmap(path, dtype=dtype, mode="r", offset=strip_offsets[0], shape=(height, width))
+    logger.info(f"TIFF memory-mapped: {width}x{height}, {bits}-bit, photometric={photometric}.")
+    return pixels, photometric == 0
+
+
+# --- DICOM ---
+
+def _read_dicom_length(f: BinaryIO, explicit: bool) -> int:
+    """Lee la longitud de un elemento DICOM (tras su tag), según la codificación del VR."""
+    if explicit:
+        vr = f.read(2)
+        if vr in _DICOM_LONG_VRS:
+            f.seek(2, os.SEEK_CUR)
+            return struct.unpack("<I", f.read(4))[0]
+        return struct.unpack("<H", f.read(2))[0]
+    return struct.unpack("<I", f.read(4))[0]
+
+
+def _skip_dicom_undefined_length(f: BinaryIO, explicit: bool) -> None:
+    """Salta el contenido de una secuencia o ítem de longitud indefinida."""
+    while True:
+        raw_tag = f.read(4)
+        if len(raw_tag) < 4:
+            raise ValueError("Unexpected end of DICOM file inside a sequence")
+        group, element = struct.unpack("<HH", raw_tag)
+        if group == 0xFFFE:
+            # Ítems y delimitadores siempre llevan una longitud de 4 bytes sin VR.
+            (length,) = struct.unpack("<I", f.read(4))
+            if element in (0xE00D, 0xE0DD): # Fin de ítem / fin de secuencia.
+                return
+        else:
+            length = _read_dicom_length(f, explicit)
+        if length == _DICOM_UNDEFINED_LENGTH:
+            _skip_dicom_undefined_length(f, explicit)
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+
+def _open_dicom(f: BinaryIO, path: str) -> Tuple[np.ndarray, bool]:
+    f.seek(DICOM_MAGIC_OFFSET + len(DICOM_MAGIC))
+    transfer_syntax: Optional[str] = None
+    values: Dict[Tuple[int, int], bytes] = {}
+    wanted = {
+        (0x0028, 0x0002), # SamplesPerPixel
+        (0x0028, 0x0004), # PhotometricInterpretation
+        (0x0028, 0x0010), # Rows
+        (0x0028, 0x0011), # Columns
+        (0x0028, 0x0100), # BitsAllocated
+        (0x0028, 0x0103), # PixelRepresentation
+    }
+
+    while True:
+        raw_tag = f.read(4)
+        if len(raw_tag) < 4:
+            raise ValueError("DICOM file has no Pixel Data element")
+        group, element = struct.unpack("<HH", raw_tag)
+        if group != 0x0002 and transfer_syntax is None:
+            raise ValueError("DICOM file has no Transfer Syntax UID")
+        # El grupo 0002 (meta) es siempre explícito; el resto depende del Transfer Syntax.
+        explicit = group == 0x0002 or transfer_syntax == _DICOM_EXPLICIT_LE
+        length = _read_dicom_length(f, explicit)
+
+        if (group, element) == (0x7FE0, 0x0010):
+            if length == _DICOM_UNDEFINED_LENGTH:
+                raise ValueError("Encapsulated (compressed) DICOM Pixel Data is not supported")
+            pixel_offset = f.tell()
+            break
+
+        if length == _DICOM_UNDEFINED_LENGTH:
+            _skip_dicom_undefined_length(f, explicit)
+            continue
+
+        if (group, element) == (0x0002, 0x0010):
+            transfer_syntax = f.read(length).rstrip(b"\x00 ").decode("ascii")
+            if transfer_syntax not in _DICOM_SUPPORTED_SYNTAXES:
+                raise ValueError(f"Unsupported DICOM Transfer Syntax: {transfer_syntax}")
+        elif (group, element) in wanted:
+            values[(group, element)] = f.read(length)
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+    def _us(tag: Tuple[int, int], default: int) -> int:
+        raw = values.get(tag)
+        return struct.unpack("<H", raw[:2])[0] if raw else default
+
+    samples = _us((0x0028, 0x0002), 1)
+    rows = _us((0x0028, 0x0010), 0)
+    cols = _us((0x0028, 0x0011), 0)
+    bits = _us((0x0028, 0x0100), 16)
+    signed = _us((0x0028, 0x0103), 0) == 1
+    photometric = values.get((0x0028, 0x0004), b"MONOCHROME2").rstrip(b"\x00 ").decode("ascii")
+
+    if samples != 1 or not photometric.startswith("MONOCHROME"):
+        raise ValueError(f"Only grayscale DICOM is supported (Photometric={photometric})")
+    if bits not in (8, 16):
+        raise ValueError(f"Unsupported DICOM BitsAllocated: {bits}")
+    if not rows or not cols:
+        raise ValueError("DICOM file has no Rows/Columns")
+
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{bits // 8}")
+    pixels = np.memmap(path, dtype=dtype, mode="r", offset=pixel_offset, shape=(rows, cols))
+    logger.info(f"DICOM memory-mapped: {cols}x{rows}, {bits}-bit, {photometric}.")
+    return pixels, photometric == "MONOCHROME1"
+
+
+def roi_union_bbox(
+    rois: List[np.ndarray],
+    image_shape: Tuple[int, int],
+    margin: int = 0
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Calcula la caja envolvente (x0, y0, x1, y1) de todas las ROIs, recortada a la imagen.
+
+    `x1`/`y1` son exclusivos. `margin` amplía la caja (p.ej. para la dilatación de la máscara).
+    Devuelve None si no hay ROIs.
+    """
+    if not len(rois):
+        return None
+    h, w = image_shape[:2]
+    points = np.concatenate([np.asarray(roi).reshape(-1, 2) for roi in rois])
+    xs = np.clip(points[:, 0], 0, w - 1)
+    ys = np.clip(points[:, 1], 0, h - 1)
+    x0 = max(0, int(xs.min()) - margin)
+    y0 = max(0, int(ys.min()) - margin)
+    x1 = min(w, int(xs.max()) + margin + 1)
+    y1 = min(h, int(ys.max()) + margin + 1)
+    return x0, y0, x1, y1
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import base64
+import binascii
+import json
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+import config
+from schemas import RoiData
+
+logger = logging.getLogger(__name__)
+
+# --- Formato Compacto de ROIs ---
+# OBJETIVO: Evitar que los trazos a mano alzada (miles de vértices) viajen como listas JSON
+#           anidadas que Pydantic valida tupla a tupla.
+# FORMATO (`roi_data` como objeto JSON en lugar de lista):
+#   {
+#     "encoding": "int16-b64",
+#     "offsets": [0, n1, n1 + n2, ...],   # Inicio de cada polígono en número de vértices (+ total al final).
+#     "coords": "<base64>"                # Pares (x, y) int16 little-endian concatenados.
+#   }
+# El formato clásico (lista de listas de [x, y]) se sigue aceptando.
+# En ambos casos el resultado es una lista de arrays NumPy int32 de forma (n, 2).
+
+COMPACT_ENCODING = "int16-b64"
+MIN_POLYGON_VERTICES = 3
+
+
+def decode_roi_payload(roi_data: str) -> List[np.ndarray]:
+    """
+    Decodifica el campo `roi_data` del formulario, en formato compacto o JSON clásico.
+
+    Raises:
+        ValueError: Si el formato compacto es inválido (incluye `json.JSONDecodeError`).
+        pydantic.ValidationError: Si el formato clásico no supera la validación de `RoiData`.
+    """
+    if roi_data.lstrip().startswith("{"):
+        return _decode_compact(json.loads(roi_data))
+    # Formato clásico: se mantiene la validación Pydantic existente.
+    polygons = RoiData.model_validate_json(roi_data).root
+    return [_classic_polygon(polygon, index) for index, polygon in enumerate(polygons)]
+
+
+def _classic_polygon(polygon: List[Tuple[int, int]], index: int) -> np.ndarray:
+    """Polígono clásico como array int32; Pydantic acepta enteros de cualquier tamaño, int32 no."""
+    limits = np.iinfo(np.int32)
+    if any(not limits.min <= value <= limits.max for point in polygon for value in point):
+        raise ValueError(f"Polygon at index {index} has coordinates outside the int32 range")
+    return np.asarray(polygon, dtype=np.int32).reshape(-1, 2)
+
+
+def _decode_compact(payload: Dict[str, Any]) -> List[np.ndarray]:
+    if payload.get("encoding") != COMPACT_ENCODING:
+        raise ValueError(f"Unsupported ROI encoding: {payload.get('encoding')!r}")
+    try:
+        raw = base64.b64decode(payload.get("coords", ""), validate=True)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid base64 ROI coordinates: {e}")
+    if len(raw) % 4:
+        raise ValueError("ROI coordinate buffer is not a whole number of (x, y) int16 pairs")
+
+    # Una sola conversión para todos los vértices; cada polígono es una vista de este array.
+    points = np.frombuffer(raw, dtype="<i2").reshape(-1, 2).astype(np.int32)
+    # `offsets` viene del cliente: sin `dtype`, NumPy no trunca 3.7 a 3 y un dict, `null` o un entero
+    # enorme quedan como objetos (o lanzan ValueError si la lista es irregular).
+    try:
+        offsets = np.asarray(payload.get("offsets", []))
+    except (TypeError, ValueError, OverflowError) as e:
+        raise ValueError(f"ROI offsets must be a list of integers: {e}")
+    if offsets.dtype.kind == "f" and np.all(np.isfinite(offsets)) and np.all(offsets == np.round(offsets)):
+        offsets = offsets.astype(np.int64) # 3.0 (algunos serializadores JSON) es un entero válido.
+    if offsets.dtype.kind not in "iu":
+        raise ValueError("ROI offsets must be a list of integers")
+    if offsets.ndim != 1 or offsets.size < 1 or offsets[0] != 0 or offsets[-1] != len(points):
+        raise ValueError("ROI offsets must start at 0 and end at the total number of vertices")
+    if offsets.size == 1:
+        return [] # `{"offsets": [0], "coords": ""}`: ninguna ROI (no un polígono vacío).
+    counts = np.diff(offsets)
+    if (counts < MIN_POLYGON_VERTICES).any():
+        bad = int(np.argmax(counts < MIN_POLYGON_VERTICES))
+        raise ValueError(f"Polygon at index {bad} must have at least {MIN_POLYGON_VERTICES} vertices, got {int(counts[bad])}")
+    return np.split(points, offsets[1:-1])
+
+
+def encode_rois_compact(rois: Sequence[Sequence[Sequence[int]]]) -> str:
+    """Codifica ROIs al formato compacto (inverso de `decode_roi_payload`). Útil para clientes y scripts."""
+    arrays = [np.asarray(roi, dtype=np.int64).reshape(-1, 2) for roi in rois]
+    points = np.concatenate(arrays) if arrays else np.zeros((0, 2), dtype=np.int64)
+    if points.size and (points.min() < np.iinfo(np.int16).min or points.max() > np.iinfo(np.int16).max):
+        raise ValueError("ROI coordinates exceed the int16 range of the compact encoding")
+    offsets = np.concatenate([[0], np.cumsum([len(a) for a in arrays])]).astype(int).tolist()
+    return json.dumps({
+        "encoding": COMPACT_ENCODING,
+        "offsets": offsets,
+        "coords": base64.b64encode(points.astype("<i2").tobytes()).decode("ascii"),
+    })
+
+
+def simplify_rois(rois: List[np.ndarray], tolerance: float) -> List[np.ndarray]:
+    """
+    Simplifica cada polígono con Douglas-Peucker (`cv2.approxPolyDP`, contorno cerrado).
+
+    POR QUÉ: Un trazo a mano alzada puede tener miles de vértices casi colineales. Con una
+             tolerancia de ~1 px la máscara rasterizada apenas cambia (y la dilatación 3x3 de
+             `_extract_roi_pixels` absorbe la diferencia), pero el polígono queda mucho más corto.
+
+    Args:
+        rois: Polígonos (n, 2) int32.
+        tolerance: Distancia máxima (px) entre el contorno original y el simplificado.
+                   Se limita a `config.ROI_SIMPLIFY_MAX_TOLERANCE_PX`. 0 desactiva la simplificación.
+    """
+    tolerance = min(max(tolerance, 0.0), config.ROI_SIMPLIFY_MAX_TOLERANCE_PX)
+    if tolerance <= 0:
+        return rois
+    simplified = []
+    for polygon in rois:
+        approx = cv2.approxPolyDP(polygon.reshape(-1, 1, 2), tolerance, True).reshape(-1, 2)
+        # Nunca degradar un polígono válido por debajo de 3 vértices.
+        simplified.append(approx if len(approx) >= MIN_POLYGON_VERTICES else polygon)
+    before = sum(len(p) for p in rois)
+    after = sum(len(p) for p in simplified)
+    logger.debug(f"ROI simplification (tolerance={tolerance}px): {before} -> {after} vertices.")
+    return simplified
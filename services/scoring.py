@@ -100,7 +100,9 @@ def calculate_integrated_score(
     classification, interpretation = _get_classification_and_interpretation(total_integrat_arrodonit)
 
     # Crear el objeto de resultado
-    result = AnalysisResult(
+    # `model_construct` omite la validación: todos los campos se calculan aquí mismo a partir
+    # de valores ya validados, y el resultado solo se serializa.
+    result = AnalysisResult.model_construct(
         puntuacio_clinica=clinical_score,
         puntuacio_radio=radio_score,
         puntuacio_digital=digital_score,
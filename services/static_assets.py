@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+import config
+
+# --- Dependencia Opcional: Brotli ---
+# Sin el paquete `brotli` solo se generan variantes gzip.
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# --- Recursos Estáticos con Huella (fingerprinting) ---
+# OBJETIVO: Que las visitas repetidas desde una clínica no vuelvan a pedir (ni revalidar) `app.js`,
+#           `style.css` ni los iconos, y que la primera descarga sea lo más pequeña posible.
+# CÓMO:
+#   - Al arrancar (o en el primer uso) se recorre `STATIC_DIR`: cada archivo recibe una huella (SHA-256 de su
+#     contenido) y un nombre versionado, `css/style.css` -> `css/style.<huella>.css`.
+#   - Las variantes gzip (y brotli, si está instalado) se comprimen una sola vez y se guardan en memoria
+#     (`static/` ocupa unos cientos de KB), solo cuando ahorran al menos `STATIC_MIN_COMPRESSION_SAVING`.
+#   - Las plantillas usan `asset_url('css/style.css')`, que devuelve la URL versionada.
+#   - `FingerprintedStaticFiles` sirve las URLs versionadas desde memoria con la codificación que acepte el
+#     navegador y `Cache-Control: immutable` (un año): si el contenido cambia, cambia la URL.
+#     Las URLs sin huella (p.ej. `og:image`, que enlazan sitios externos) siguen funcionando como
+#     antes, con revalidación por ETag.
+# LIMITACIÓN: Los cambios en `static/` se detectan al reiniciar el proceso (o con `build_manifest()`).
+#             Una URL versionada antigua (página guardada de otra versión) responde 404.
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class Asset(NamedTuple):
+    path: str # Ruta relativa original ("css/style.css").
+    fingerprint: str
+    media_type: str
+    variants: Dict[str, bytes] # Codificación ("br", "gzip", "identity") -> cuerpo.
+
+
+_manifest: Optional[Dict[str, str]] = None # Ruta original -> ruta versionada.
+_assets: Dict[str, Asset] = {} # Ruta versionada -> recurso.
+_build_lock = threading.Lock()
+
+
+def _fingerprinted_name(path: str, fingerprint: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{fingerprint}{ext}"
+
+
+def _compressed_variants(data: bytes, ext: str) -> Dict[str, bytes]:
+    variants = {"identity": data}
+    if ext.lower() not in config.STATIC_COMPRESS_EXTENSIONS:
+        return variants # PNG/GIF ya están comprimidos.
+    candidates = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if BROTLI_AVAILABLE:
+        candidates["br"] = brotli.compress(data, quality=11)
+    for encoding, body in candidates.items():
+        if len(body) <= len(data) * (1 - config.STATIC_MIN_COMPRESSION_SAVING):
+            variants[encoding] = body
+    return variants
+
+
+def build_manifest(directory: Optional[str] = None) -> Dict[str, str]:
+    """Calcula huellas y variantes comprimidas de todos los archivos de `directory` (por defecto `STATIC_DIR`)."""
+    global _manifest
+    directory = directory or config.STATIC_DIR
+    manifest: Dict[str, str] = {}
+    assets: Dict[str, Asset] = {}
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            path = os.path.relpath(full_path, directory).replace(os.sep, "/")
+            with open(full_path, "rb") as f:
+                data = f.read()
+            fingerprint = hashlib.sha256(data).hexdigest()[:config.STATIC_FINGERPRINT_LENGTH]
+            versioned = _fingerprinted_name(path, fingerprint)
+            media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            manifest[path] = versioned
+            assets[versioned] = Asset(path, fingerprint, media_type, _compressed_variants(data, os.path.splitext(name)[1]))
+    with _build_lock:
+        _assets.clear()
+        _assets.update(assets)
+        _manifest = manifest
+    original = sum(len(a.variants["identity"]) for a in assets.values())
+    smallest = sum(min(len(body) for body in a.variants.values()) for a in assets.values())
+    logger.info(f"Static assets: {len(assets)} files fingerprinted, {original / 1024:.0f}KB -> "
+                f"{smallest / 1024:.0f}KB compressed (brotli {'on' if BROTLI_AVAILABLE else 'unavailable'}).")
+    return manifest
+
+
+def versioned_path(path: str) -> str:
+    """Ruta versionada de un recurso de `static/`; la original si no existe (p.ej. recurso nuevo sin reiniciar)."""
+    if _manifest is None:
+        build_manifest()
+    path = path.lstrip("/")
+    return _manifest.get(path, path)
+
+
+def _negotiate(accept_encoding: str, available: Dict[str, bytes]) -> str:
+    """Codificación preferida por el servidor (br > gzip) entre las que acepta el navegador (q > 0)."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        token, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """`StaticFiles` que además sirve desde memoria las URLs versionadas de `build_manifest`."""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        asset = _assets.get(path.replace(os.sep, "/"))
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        encoding = _negotiate(headers.get("accept-encoding", ""), asset.variants)
+        etag = f'"{asset.fingerprint}-{encoding}"'
+        response_headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": etag, "Vary": "Accept-Encoding"}
+        if encoding != "identity":
+            response_headers["Content-Encoding"] = encoding
+        if headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=response_headers)
+        body = asset.variants[encoding]
+        if scope["method"] == "HEAD":
+            response_headers["Content-Length"] = str(len(body))
+            body = b""
+        return Response(body, media_type=asset.media_type, headers=response_headers)
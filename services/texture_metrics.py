@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.spatial import cKDTree
+from scipy.special import ndtr
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Motor de Métricas de Textura 2D (una pasada por ROI) ---
+# OBJETIVO: Calcular varias entropías bidimensionales (DistEn2D, SampEn2D, PermEn2D, DispEn2D) sobre
+#           la misma ROI preprocesada sin repetir el trabajo común. Calcularlas por separado con
+#           EntropyHub repetiría la incrustación de patrones y, sobre todo, las distancias por pares
+#           (O(N^2) en el número de patrones), que dominan el coste.
+# CÓMO:
+#   - Todas las métricas usan los mismos patrones m x m (`DISTEN_M`, `DISTEN_TAU`): una sola vista
+#     `sliding_window_view` de la ROI, sin copias.
+#   - `_RoiContext` calcula cada resultado intermedio la primera vez que una métrica lo pide y lo
+#     reutiliza después (`_shared`). El más caro es la matriz completa de distancias de Chebyshev
+#     entre patrones m x m:
+#       * DistEn2D es el histograma de esas distancias (mismo resultado que `EntropyHub.DistEn2D`
+#         con Norm=2: se calcula sobre la ROI normalizada a [0, 1] igual que la librería).
+#       * SampEn2D cuenta pares con distancia < r para patrones m x m y (m+1) x (m+1). Un patrón
+#         (m+1) x (m+1) es la unión de cuatro patrones m x m desplazados (0 o tau en cada eje), así que
+#         su distancia es el máximo de cuatro entradas de la MISMA matriz: no se recalcula nada.
+#       * PermEn2D y DispEn2D solo necesitan los patrones (orden relativo / símbolos NCDF).
+#   - Las métricas se registran en `METRICS` (nombre -> función); `config.TEXTURE_METRICS` elige las
+#     que se calculan. `dist_en` se calcula siempre: es la que determina la puntuación digital.
+#   - Tiempos por métrica: el trabajo compartido se mide aparte (clave `shared`); el tiempo de cada
+#     métrica es solo su parte propia.
+#   - Todas las ROIs de una petición se preprocesan al mismo `DISTEN_TARGET_SIZE`, así que se calculan
+#     juntas (`compute_batch`, una pila (n, H, W)). Si ninguna métrica seleccionada necesita la matriz
+#     completa, DistEn2D usa el núcleo por lotes `dist_en_batch` (ver más abajo).
+#   - Los búferes grandes (`_buffer`) se reservan una vez por hilo y se reutilizan entre peticiones. Son
+#     de cada hilo (`threading.local`) para que los análisis en hilos (`asyncio.to_thread`) calculen en
+#     paralelo: NumPy libera el GIL en las operaciones sobre los búferes.
+# LIMITACIÓN: La matriz completa de distancias ocupa 8 * P^2 bytes (P = número de patrones; ~126 MB a
+#             64x64 con m=2). Solo se construye si se selecciona `samp_en`.
+#             Un hilo del pool conserva sus búferes entre peticiones (hasta `working_bytes()` por hilo que
+#             haya analizado alguna vez); `memory_budget` solo cuenta los de los análisis en curso.
+
+SHARED_TIMING_KEY = "shared"
+_DISTANCE_BLOCK_ROWS = 256 # Filas de la matriz de distancias por bloque (acota los temporales)
+_FULL_MATRIX_METRICS = frozenset({"samp_en"}) # Métricas que necesitan la matriz completa de distancias
+
+_workspace = threading.local() # `buffers`: nombre -> búfer de trabajo del hilo actual.
+
+
+def _buffer(name: str, shape: Tuple[int, ...], dtype: type = np.float64) -> np.ndarray:
+    """Vista `shape` de un búfer de trabajo del hilo actual, reutilizable (solo crece)."""
+    buffers: Optional[Dict[str, np.ndarray]] = getattr(_workspace, "buffers", None)
+    if buffers is None:
+        buffers = _workspace.buffers = {}
+    size = int(np.prod(shape))
+    buf = buffers.get(name)
+    if buf is None or buf.dtype != dtype or buf.size < size:
+        buf = np.empty(size, dtype=dtype)
+        buffers[name] = buf
+    return buf[:size].reshape(shape)
+
+
+class _RoiContext:
+    """Resultados intermedios de una ROI preprocesada, calculados bajo demanda y compartidos entre métricas."""
+
+    def __init__(self, mat: np.ndarray, m: int, tau: int, bins: Union[str, int]):
+        self.mat = mat # Sin convertir: la normalización se hace en el mismo tipo que EntropyHub (float32).
+        self.m = m
+        self.tau = tau
+        self.bins = bins # Intervalos del histograma de DistEn2D (método o número).
+        self.shared_ms = 0.0
+        self._cache: Dict[str, np.ndarray] = {}
+
+    def _shared(self, key: str, build: Callable[[], np.ndarray]) -> np.ndarray:
+        if key not in self._cache:
+            start = time.perf_counter()
+            self._cache[key] = build()
+            self.shared_ms += (time.perf_counter() - start) * 1000
+        return self._cache[key]
+
+    def templates(self, mat: np.ndarray) -> np.ndarray:
+        """Patrones m x m (con retraso tau) de `mat` como vista (NL, NW, m, m), sin copiar."""
+        span = (self.m - 1) * self.tau + 1
+        return sliding_window_view(mat, (span, span))[:, :, ::self.tau, ::self.tau]
+
+    def unit_mat(self) -> np.ndarray:
+        """ROI normalizada a [0, 1] (como `DistEn2D` con Norm=2)."""
+        return self._shared("unit_mat", lambda: ((self.mat - np.min(self.mat)) / np.ptp(self.mat)).astype(np.float64))
+
+    def distances(self) -> np.ndarray:
+        """Matriz simétrica (P, P) de distancias de Chebyshev entre los patrones m x m de `unit_mat`."""
+        return self._shared("distances", self._build_distances)
+
+    def _build_distances(self) -> np.ndarray:
+        windows = self.templates(self.unit_mat())
+        flat = windows.reshape(-1, self.m * self.m) # Copia contigua (P, m*m).
+        columns = [np.ascontiguousarray(flat[:, k]) for k in range(flat.shape[1])]
+        count = flat.shape[0]
+        dist = _buffer("distances", (count, count))
+        scratch = _buffer("distances_scratch", (min(_DISTANCE_BLOCK_ROWS, count), count))
+        for start in range(0, count, _DISTANCE_BLOCK_ROWS):
+            stop = min(start + _DISTANCE_BLOCK_ROWS, count)
+            out = dist[start:stop]
+            tmp = scratch[:stop - start]
+            np.subtract(columns[0][start:stop, None], columns[0][None, :], out=out)
+            np.abs(out, out=out)
+            for column in columns[1:]:
+                np.subtract(column[start:stop, None], column[None, :], out=tmp)
+                np.abs(tmp, out=tmp)
+                np.maximum(out, tmp, out=out)
+        return dist
+
+
+# --- Métricas registradas ---
+# Cada función recibe el contexto de la ROI y devuelve un float. Parámetros propios en config.py.
+
+def _dist_en(ctx: _RoiContext) -> float:
+    """DistEn2D normalizada por log(número de intervalos) (`EntropyHub.DistEn2D`, Norm=2, Logx=2)."""
+    dist = ctx.distances()
+    count = dist.shape[0]
+    pairs = count * (count - 1) // 2
+    bins = ctx.bins
+    if isinstance(bins, str):
+        n_bins = _histogram_bins(bins, pairs)
+    else:
+        n_bins = int(bins)
+    # Cada par aparece dos veces (matriz simétrica) y la diagonal es 0: se excluye del mínimo
+    # poniéndola a +inf (queda fuera del rango del histograma) y se restaura después.
+    high = float(np.max(dist))
+    np.fill_diagonal(dist, np.inf)
+    try:
+        low = float(np.min(dist))
+        counts = np.zeros(n_bins, dtype=np.int64)
+        for start in range(0, count, _DISTANCE_BLOCK_ROWS):
+            block_counts, _ = np.histogram(dist[start:start + _DISTANCE_BLOCK_ROWS], bins=n_bins, range=(low, high))
+            counts += block_counts
+    finally:
+        np.fill_diagonal(dist, 0.0)
+    probs = (counts // 2) / pairs
+    probs = probs[probs != 0]
+    value = -np.sum(probs * np.log(probs) / np.log(2))
+    return float(value / (np.log(n_bins) / np.log(2)))
+
+
+def _samp_en(ctx: _RoiContext) -> float:
+    """SampEn2D con r = `TEXTURE_SAMPEN_R` * STD de la ROI (`EntropyHub.SampEn2D`, Logx=e)."""
+    dist = ctx.distances()
+    mat, m, tau = ctx.mat, ctx.m, ctx.tau
+    # Distancias calculadas sobre `unit_mat`: r se lleva a la misma escala.
+    radius = config.TEXTURE_SAMPEN_R * np.std(mat) / np.ptp(mat)
+    rows, cols = mat.shape[0] - (m - 1) * tau, mat.shape[1] - (m - 1) * tau # Rejilla de patrones m x m.
+    rows_s, cols_s = rows - tau, cols - tau # Posiciones con patrón (m+1) x (m+1) completo.
+    grid = dist.reshape(rows, cols, rows, cols)
+    matches_m, matches_m1 = 0, 0
+    for a in range(rows_s):
+        base = grid[a, :cols_s, :rows_s, :cols_s]
+        close_m = base < radius
+        matches_m += int(np.count_nonzero(close_m))
+        close_m1 = close_m
+        for da, db in ((tau, 0), (0, tau), (tau, tau)):
+            shifted = grid[a + da, db:db + cols_s, da:da + rows_s, db:db + cols_s]
+            close_m1 = close_m1 & (shifted < radius)
+        matches_m1 += int(np.count_nonzero(close_m1))
+    # Pares (i < j): se descuenta la diagonal (distancia 0 < r) y la simetría.
+    positions = rows_s * cols_s
+    matches_m = (matches_m - positions) // 2
+    matches_m1 = (matches_m1 - positions) // 2
+    if matches_m == 0 or matches_m1 == 0:
+        raise ValueError("SampEn2D is undefined: no template matches within r")
+    return float(-np.log(matches_m1 / matches_m))
+
+
+def _perm_en(ctx: _RoiContext) -> float:
+    """PermEn2D normalizada por log((m*m)!) (`EntropyHub.PermEn2D`, Norm=True)."""
+    size = ctx.m * ctx.m
+    # Orden de lectura por columnas (como la librería); el empate se resuelve igual que en EntropyHub.
+    patterns = ctx.templates(ctx.mat).transpose(0, 1, 3, 2).reshape(-1, size)
+    order = np.argsort(patterns, axis=1, kind="stable")
+    ordered = np.take_along_axis(patterns, order, axis=1)
+    ties = np.diff(ordered, axis=1) == 0
+    for k in range(1, size):
+        order[:, k] = np.where(ties[:, k - 1], order[:, k - 1], order[:, k])
+    probs = _pattern_probabilities(order, size)
+    return float(-np.sum(probs * np.log(probs)) / math.log(math.factorial(size)))
+
+
+def _disp_en(ctx: _RoiContext) -> float:
+    """DispEn2D con `TEXTURE_DISPEN_CLASSES` símbolos NCDF, normalizada por log(c^(m*m))."""
+    classes = config.TEXTURE_DISPEN_CLASSES
+    symbols = ctx._shared(
+        "ncdf_symbols",
+        lambda: np.digitize(ndtr((ctx.mat - np.mean(ctx.mat)) / np.std(ctx.mat)), np.arange(0, 1, 1 / classes))
+    )
+    size = ctx.m * ctx.m
+    probs = _pattern_probabilities(ctx.templates(symbols).reshape(-1, size), classes + 1)
+    return float(-np.sum(probs * np.log(probs)) / (size * math.log(classes)))
+
+
+def _pattern_probabilities(patterns: np.ndarray, base: int) -> np.ndarray:
+    """Frecuencia relativa de cada patrón distinto (filas de enteros en [0, base))."""
+    codes = patterns.astype(np.int64) @ (base ** np.arange(patterns.shape[1], dtype=np.int64))
+    _, counts = np.unique(codes, return_counts=True)
+    return counts / codes.size
+
+
+def _histogram_bins(method: str, pairs: int) -> int:
+    method = method.lower()
+    if method == "sturges":
+        return int(np.ceil(np.log2(pairs) + 1))
+    if method == "rice":
+        return int(np.ceil(2 * pairs ** (1 / 3)))
+    if method == "sqrt":
+        return int(np.ceil(np.sqrt(pairs)))
+    raise ValueError(f"Unsupported DistEn2D binning method: {method}")
+
+
+METRICS: Dict[str, Callable[[_RoiContext], float]] = {
+    "dist_en": _dist_en,
+    "samp_en": _samp_en,
+    "perm_en": _perm_en,
+    "disp_en": _disp_en,
+}
+
+
+# --- Núcleo DistEn2D por lotes ---
+# OBJETIVO: DistEn2D de todas las ROIs de la pila en una sola computación vectorizada, sin construir
+#           la matriz P x P de cada una ni repetir llamadas y temporales por ROI.
+# CÓMO: El histograma solo necesita, por ROI, el mínimo y el máximo de las distancias (bordes de los
+#       intervalos) y después un recorrido por bloques de filas de la mitad superior de la matriz:
+#   - Máximo exacto sin pares: max_{i,j} max_k |x_ik - x_jk| = max_k (max_i x_ik - min_i x_ik).
+#   - Mínimo exacto: distancia al vecino más cercano (Chebyshev) con un árbol k-d, O(P log P).
+#   - Cada bloque calcula las distancias de TODAS las ROIs a la vez (n, filas, columnas) sobre búferes
+#     reutilizados, asigna el intervalo con la misma aritmética que `np.histogram` (intervalos
+#     uniformes + corrección con los bordes) y acumula con un único `np.bincount`.
+#   El tamaño del bloque se ajusta para que los búferes no superen `TEXTURE_BATCH_BUFFER_BYTES`.
+_BATCH_BYTES_PER_CELL = 8 * 3 + 1 # Distancia, temporal e intervalo (8 B) + máscara (1 B)
+_EDGE_EPS = 1e-6 # Distancia (en intervalos) a un borde por debajo de la cual se corrige con los bordes exactos
+
+
+def _exact_bins(
+    values: np.ndarray,
+    rois: np.ndarray,
+    low: np.ndarray,
+    norm: np.ndarray,
+    edges: np.ndarray,
+    n_bins: int
+) -> np.ndarray:
+    """Intervalo de `values` (de las ROIs `rois`) con la corrección por bordes de `np.histogram`."""
+    bins = ((values - low[rois]) * norm[rois]).astype(np.intp)
+    bins[bins == n_bins] -= 1
+    bins -= values < edges[rois, bins]
+    bins += (values >= edges[rois, bins + 1]) & (bins != n_bins - 1)
+    return bins
+
+
+def _template_columns(stack: np.ndarray, m: int, tau: int) -> np.ndarray:
+    """Patrones m x m de cada ROI de la pila normalizada a [0, 1], como columnas contiguas (n, m*m, P)."""
+    mins = np.min(stack, axis=(1, 2), keepdims=True)
+    ptps = np.ptp(stack, axis=(1, 2), keepdims=True)
+    unit = ((stack - mins) / ptps).astype(np.float64) # Igual que `unit_mat` (tipo de entrada, luego float64).
+    span = (m - 1) * tau + 1
+    windows = sliding_window_view(unit, (span, span), axis=(1, 2))[:, :, :, ::tau, ::tau]
+    count = windows.shape[1] * windows.shape[2]
+    return np.ascontiguousarray(windows.reshape(len(stack), count, m * m).transpose(0, 2, 1))
+
+
+def _distance_range(columns: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(mínimo, máximo) de las distancias de Chebyshev entre pares distintos de patrones, por ROI."""
+    high = np.max(np.max(columns, axis=2) - np.min(columns, axis=2), axis=1)
+    low = np.empty(len(columns))
+    for k, roi_columns in enumerate(columns):
+        points = roi_columns.T
+        nearest, _ = cKDTree(points).query(points, k=2, p=np.inf)
+        low[k] = np.min(nearest[:, 1])
+    return low, high
+
+
+def dist_en_batch(
+    stack: np.ndarray,
+    m: Optional[int] = None,
+    tau: Optional[int] = None,
+    bins: Optional[Union[str, int]] = None
+) -> np.ndarray:
+    """
+    DistEn2D (mismo resultado que `_dist_en` / `EntropyHub.DistEn2D`, Norm=2) de una pila (n, H, W) de
+    ROIs preprocesadas del mismo tamaño. Las ROIs homogéneas (ceros) valen 0.
+    `m`, `tau`, `bins`: None = `config.DISTEN_M` / `DISTEN_TAU` / `DISTEN_BINS`.
+    """
+    m, tau, bins = _parameters(m, tau, bins)
+    stack = np.asarray(stack)
+    values = np.zeros(len(stack))
+    active = np.flatnonzero(np.any(stack, axis=(1, 2)))
+    if active.size == 0:
+        return values
+    columns = _template_columns(stack[active], m, tau)
+    n, channels, count = columns.shape
+    pairs = count * (count - 1) // 2
+    n_bins = _histogram_bins(bins, pairs) if isinstance(bins, str) else int(bins)
+    low, high = _distance_range(columns)
+    flat = high <= low # Todas las distancias iguales: un solo intervalo ocupado, entropía 0.
+    span = np.where(flat, 1.0, high - low)
+
+    edges = np.linspace(low, high, n_bins + 1, axis=1) # (n, n_bins + 1), como `np.histogram`.
+    label_offsets = (np.arange(n) * n_bins)[:, None, None]
+    norm = n_bins / span
+    norm_b = norm[:, None, None]
+    low_b = low[:, None, None]
+    filler = (low + span / (2 * n_bins))[:, None, None] # Centro del intervalo 0: nunca cerca de un borde.
+    counts = np.zeros(n * n_bins, dtype=np.int64)
+    masked = 0 # Celdas fuera de la mitad superior (se cuentan en el intervalo 0 y se descuentan).
+
+    rows = max(1, min(count, config.TEXTURE_BATCH_BUFFER_BYTES // (n * count * _BATCH_BYTES_PER_CELL)))
+    lower = np.tril(np.ones((rows, rows), dtype=bool)) # j <= i dentro del bloque diagonal.
+    for start in range(0, count, rows):
+        stop = min(start + rows, count)
+        height, width = stop - start, count - start
+        shape = (n, height, width)
+        dist = _buffer("batch_dist", shape)
+        tmp = _buffer("batch_tmp", shape)
+        idx = _buffer("batch_idx", shape, np.intp)
+        mask = _buffer("batch_mask", shape, np.bool_)
+
+        # Distancias de Chebyshev del bloque (filas start:stop, columnas start:) para todas las ROIs.
+        for c in range(channels):
+            target = dist if c == 0 else tmp
+            np.subtract(columns[:, c, start:stop, None], columns[:, c, None, start:], out=target)
+            np.abs(target, out=target)
+            if c:
+                np.maximum(dist, tmp, out=dist)
+        diagonal_block = dist[:, :, :height]
+        np.copyto(diagonal_block, filler, where=lower[:height, :height])
+        masked += height * (height + 1) // 2
+
+        # Intervalo de cada distancia: f = (d - low) * n_bins / (high - low), como `np.histogram`
+        # con intervalos uniformes. Solo las celdas con f casi entero pueden caer en el intervalo
+        # vecino; a esas (pocas) se les aplica la corrección exacta con los bordes (`_exact_bins`).
+        np.subtract(dist, low_b, out=tmp)
+        np.multiply(tmp, norm_b, out=tmp)
+        idx[...] = tmp # Truncamiento (f >= 0).
+        np.subtract(tmp, idx, out=tmp)
+        np.subtract(tmp, 0.5, out=tmp)
+        np.abs(tmp, out=tmp)
+        np.greater(tmp, 0.5 - _EDGE_EPS, out=mask)
+        near_edge = np.flatnonzero(mask)
+        if near_edge.size:
+            roi_of_cell = near_edge // (height * width)
+            idx.flat[near_edge] = _exact_bins(dist.flat[near_edge], roi_of_cell, low, norm, edges, n_bins)
+        np.add(idx, label_offsets, out=idx) # Etiqueta global: roi * n_bins + intervalo.
+        counts += np.bincount(idx.ravel(), minlength=n * n_bins)
+
+    counts = counts.reshape(n, n_bins)
+    counts[:, 0] -= masked
+    for k in range(n):
+        if flat[k]:
+            continue
+        probs = counts[k] / pairs
+        probs = probs[probs != 0]
+        value = -np.sum(probs * np.log(probs) / np.log(2))
+        values[active[k]] = value / (np.log(n_bins) / np.log(2))
+    return values
+
+
+def working_bytes(
+    shape: Optional[Tuple[int, int]] = None,
+    names: Optional[Iterable[str]] = None,
+    m: Optional[int] = None,
+    tau: Optional[int] = None
+) -> int:
+    """
+    Memoria de trabajo de `compute_batch` con los mismos argumentos (None = `DISTEN_TARGET_SIZE` /
+    `config.TEXTURE_METRICS` / `DISTEN_M` / `DISTEN_TAU`): los búferes del núcleo por lotes o, si alguna
+    métrica necesita la matriz completa, esa matriz.
+    """
+    rows, cols = shape or config.DISTEN_TARGET_SIZE
+    m, tau, _ = _parameters(m, tau, None)
+    span = (m - 1) * tau
+    count = max(rows - span, 0) * max(cols - span, 0)
+    if _FULL_MATRIX_METRICS.intersection(selected_metrics(names)):
+        return 8 * count * (count + min(_DISTANCE_BLOCK_ROWS, count))
+    return min(config.TEXTURE_BATCH_BUFFER_BYTES, count * count * _BATCH_BYTES_PER_CELL)
+
+
+def selected_metrics(names: Optional[Iterable[str]] = None) -> Tuple[str, ...]:
+    """Métricas a calcular: `dist_en` primero y después las pedidas (None = `config.TEXTURE_METRICS`)."""
+    selected = ["dist_en"]
+    for name in (config.TEXTURE_METRICS if names is None else names):
+        if name not in METRICS:
+            raise ValueError(f"Unknown texture metric '{name}'. Available: {', '.join(METRICS)}")
+        if name not in selected:
+            selected.append(name)
+    return tuple(selected)
+
+
+def _parameters(
+    m: Optional[int],
+    tau: Optional[int],
+    bins: Optional[Union[str, int]]
+) -> Tuple[int, int, Union[str, int]]:
+    """Parámetros de DistEn2D explícitos o, si son None, los de config.py."""
+    return (config.DISTEN_M if m is None else m,
+            config.DISTEN_TAU if tau is None else tau,
+            config.DISTEN_BINS if bins is None else bins)
+
+
+def _compute_roi(
+    processed_roi: np.ndarray,
+    names: Tuple[str, ...],
+    parameters: Tuple[int, int, Union[str, int]],
+    known: Optional[Dict[str, float]] = None
+) -> Tuple[Dict[str, Optional[float]], Dict[str, float]]:
+    """Métricas de una ROI con su `_RoiContext`; `known` aporta valores ya calculados (p. ej. por lotes)."""
+    if not np.any(processed_roi):
+        return {name: 0.0 for name in names}, {name: 0.0 for name in names}
+
+    ctx = _RoiContext(processed_roi, *parameters)
+    values: Dict[str, Optional[float]] = {}
+    timings: Dict[str, float] = {}
+    for name in names:
+        if known and name in known:
+            values[name] = known[name]
+            continue
+        start = time.perf_counter()
+        shared_before = ctx.shared_ms
+        try:
+            value = METRICS[name](ctx)
+            if not np.isfinite(value):
+                raise ValueError(f"{name} resulted in NaN or Inf")
+            values[name] = value
+        except Exception as e:
+            logger.warning(f"Texture metric '{name}' failed: {e}")
+            values[name] = None
+        timings[name] = (time.perf_counter() - start) * 1000 - (ctx.shared_ms - shared_before)
+    timings[SHARED_TIMING_KEY] = ctx.shared_ms
+    return values, timings
+
+
+def compute_batch(
+    stack: np.ndarray,
+    names: Optional[Iterable[str]] = None,
+    m: Optional[int] = None,
+    tau: Optional[int] = None,
+    bins: Optional[Union[str, int]] = None
+) -> Tuple[List[Dict[str, Optional[float]]], List[Dict[str, float]]]:
+    """
+    Calcula las métricas seleccionadas sobre una pila (n, H, W) de ROIs preprocesadas
+    (`_preprocess_roi_for_disten`, todas del mismo tamaño). `m`, `tau` y `bins` son los parámetros de
+    los patrones y de DistEn2D (None = los de config.py; `tools.disten_eval` los pasa explícitos).
+
+    Una ROI homogénea (matriz de ceros) vale 0 en todas las métricas. Si una métrica adicional falla,
+    su valor es None y el resto se calcula igualmente; un fallo de DistEn2D se propaga.
+
+    Returns:
+        (valores, tiempos_ms) por ROI: valores sin redondear por métrica; tiempos por métrica más
+        `shared`. Con el núcleo por lotes, el tiempo de `dist_en` es el del lote repartido entre las ROIs.
+    """
+    names = selected_metrics(names)
+    parameters = _parameters(m, tau, bins)
+    stack = np.asarray(stack)
+    if _FULL_MATRIX_METRICS.intersection(names):
+        # La matriz completa ya da DistEn2D gratis: ROI a ROI, compartida con el resto de métricas.
+        results = [_compute_roi(roi, names, parameters) for roi in stack]
+    else:
+        start = time.perf_counter()
+        dist_en = dist_en_batch(stack, *parameters)
+        per_roi_ms = (time.perf_counter() - start) * 1000 / max(1, int(np.count_nonzero(np.any(stack, axis=(1, 2)))))
+        results = []
+        for roi, value in zip(stack, dist_en):
+            values, timings = _compute_roi(roi, names, parameters, known={"dist_en": float(value)})
+            if np.any(roi):
+                timings = {"dist_en": per_roi_ms, **timings}
+            results.append((values, timings))
+    if any(values["dist_en"] is None for values, _ in results):
+        raise ValueError("DistEn2D calculation failed")
+    return [values for values, _ in results], [timings for _, timings in results]
+
+
+def compute(
+    processed_roi: np.ndarray,
+    names: Optional[Iterable[str]] = None
+) -> Tuple[Dict[str, Optional[float]], Dict[str, float]]:
+    """`compute_batch` para una sola ROI."""
+    values, timings = compute_batch(processed_roi[None], names)
+    return values[0], timings[0]
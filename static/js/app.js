@@ -684,10 +684,38 @@ const RoiEditor = (function() {
                  }
              }
          });
-         console.log("[DEBUG] Final ROIs being sent to backend:", JSON.stringify(rois));
+         console.log("[DEBUG] Final ROIs being sent to backend:", rois.length, "ROIs,", rois.reduce((n, r) => n + r.length, 0), "vertices");
          return rois;
      }
 
+     // Codifica las ROIs en el formato compacto del backend (services/roi_codec.py):
+     // pares (x, y) int16 little-endian en base64 + offsets por polígono.
+     // POR QUÉ: los trazos a mano alzada tienen miles de vértices; como JSON anidado
+     //          son pesados de enviar y de validar en el servidor.
+     // Devuelve null si alguna coordenada no cabe en int16 (el llamador usará JSON clásico).
+     function encodeRoisCompact(rois) {
+         const total = rois.reduce((n, r) => n + r.length, 0);
+         const view = new DataView(new ArrayBuffer(total * 4));
+         const offsets = [0];
+         let pos = 0;
+         for (const roi of rois) {
+             for (const [x, y] of roi) {
+                 if (x < -32768 || x > 32767 || y < -32768 || y > 32767) return null;
+                 view.setInt16(pos, x, true);
+                 view.setInt16(pos + 2, y, true);
+                 pos += 4;
+             }
+             offsets.push(pos / 4);
+         }
+         const bytes = new Uint8Array(view.buffer);
+         let binary = '';
+         const CHUNK = 0x8000; // Evita superar el límite de argumentos de String.fromCharCode.
+         for (let i = 0; i < bytes.length; i += CHUNK) {
+             binary += String.fromCharCode.apply(null, bytes.subarray(i, i + CHUNK));
+         }
+         return JSON.stringify({ encoding: 'int16-b64', offsets: offsets, coords: btoa(binary) });
+     }
+
     function setupToolbarListeners() {
          // console.log("Setting up ROI toolbar listeners...");
          document.getElementById('tool-select')?.addEventListener('click', () => setActiveTool('select'));
@@ -702,6 +730,7 @@ const RoiEditor = (function() {
     return {
         initialize: initializeRoiEditor,
         getRoiData: getRoiDataForBackend,
+        encodeRois: encodeRoisCompact,
         setupToolbar: setupToolbarListeners
     };
 
@@ -911,7 +940,7 @@ document.addEventListener('DOMContentLoaded', () => {
              }
 
              try {
-                 roiDataInput.value = JSON.stringify(roiDataArray);
+                 roiDataInput.value = RoiEditor.encodeRois(roiDataArray) || JSON.stringify(roiDataArray);
                  // console.log("ROI data set in hidden input:", roiDataInput.value);
                  navigateStep('step-manual-data');
                  setTimeout(() => openTab(null, 'tab-clinical'), 0);
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+# Los módulos de la aplicación se importan desde la raíz del repositorio (como hace `uvicorn main:app`).
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import config # noqa: E402 (requiere ROOT_DIR en sys.path)
+
+
+@pytest.fixture(autouse=True)
+def _isolated_data_dirs(tmp_path, monkeypatch):
+    """Que ningún test escriba en `data/` (casos, imágenes, capturas, perfiles y cola de trabajos)."""
+    data_dir = tmp_path / "data"
+    monkeypatch.setattr(config, "CASE_STORE_PATH", str(data_dir / "cases.sqlite3"))
+    monkeypatch.setattr(config, "IMAGE_STORE_DIR", str(data_dir / "images"))
+    monkeypatch.setattr(config, "DEBUG_CAPTURE_DIR", str(data_dir / "debug"))
+    monkeypatch.setattr(config, "PROFILING_DIR", str(data_dir / "profiles"))
+    monkeypatch.setattr(config, "JOB_QUEUE_SQLITE_PATH", str(data_dir / "jobs.sqlite3"))
+    monkeypatch.setattr(config, "JOB_QUEUE_SPOOL_DIR", str(data_dir / "jobs"))
+
+
+SAMPLE_IMAGE_PATH = os.path.join(ROOT_DIR, "scaffolding", "test-img", "prova1.jpg")
+MANUAL_FORM_FIELDS = (
+    "fistulae", "gingival_recession", "subgingival_bulbous_enlargement", "gingivitis",
+    "bite_angle_not_correlated_with_age", "teeth_affected", "missing_or_extracted_teeths",
+    "tooth_shape", "tooth_structure", "tooth_surface",
+)
+
+
+@pytest.fixture
+def calculate_form():
+    """Campos del formulario de /calculate y /api/calculate (datos manuales a 0 y dos ROIs)."""
+    from services import roi_codec
+    form = {field: "0" for field in MANUAL_FORM_FIELDS}
+    form["roi_data"] = roi_codec.encode_rois_compact([
+        [[100, 100], [300, 100], [300, 300], [100, 300]],
+        [[400, 400], [600, 400], [600, 600]],
+    ])
+    return form
+
+
+@pytest.fixture
+def sample_jpeg():
+    with open(SAMPLE_IMAGE_PATH, "rb") as f:
+        return f.read()
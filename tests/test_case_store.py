@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import config
+from schemas import AnalysisResult, ManualFormData, RoiAnalysisDetail
+from services import case_store
+
+
+@pytest.fixture
+def store_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "cases.sqlite3")
+    monkeypatch.setattr(config, "CASE_STORE_ENABLED", True)
+    monkeypatch.setattr(config, "CASE_STORE_PATH", path)
+    monkeypatch.setattr(config, "CASE_STORE_FLUSH_INTERVAL_S", 0.01)
+    return path
+
+
+def _result(details):
+    return AnalysisResult(
+        puntuacio_clinica=3, puntuacio_radio=4, puntuacio_digital=5, puntuacio_total_integrada=12,
+        classificacio="low", interpretacio="", max_dist_en_value=0.8, roi_analysis_details=details,
+        quality_tier="reduced",
+    )
+
+
+def test_full_roi_detail_round_trip(store_path):
+    details = [
+        RoiAnalysisDetail(roi_index=1, dist_en=0.8, texture_metrics={"perm_en": 0.5}, texture_timings_ms={"dist_en": 1.0}),
+        RoiAnalysisDetail(roi_index=2, skipped="bound", dist_en_bound=0.7),
+    ]
+    manual = ManualFormData(**{field: 1 for field in case_store.MANUAL_FIELDS})
+    case_store.start_writer()
+    try:
+        case_id = case_store.record_case("horse-1", manual, _result(details), "ab" * 32)
+    finally:
+        case_store.stop_writer()
+
+    case = case_store.get_case(case_id)
+    assert case["quality_tier"] == "reduced"
+    assert case["roi_analysis_details"] == [d.model_dump() for d in details]
+    page = case_store.list_cases(horse_id="horse-1")
+    assert [item["case_id"] for item in page["items"]] == [case_id]
+
+
+def test_legacy_rows_without_detail_json(store_path):
+    case_store.init_store()
+    conn = sqlite3.connect(store_path)
+    conn.execute("INSERT INTO roi_details (case_id, roi_index, dist_en, error) VALUES ('old', 1, 0.5, NULL)")
+    columns = ["case_id", "created_at", *case_store.MANUAL_FIELDS, "puntuacio_clinica", "puntuacio_radio",
+               "puntuacio_digital", "puntuacio_total_integrada", "classificacio", "max_dist_en_value"]
+    conn.execute(f"INSERT INTO cases ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                 ["old", "2024-01-01T00:00:00", *([0] * len(case_store.MANUAL_FIELDS)), 0, 0, 0, 0, "low", 0.5])
+    conn.commit()
+    conn.close()
+    assert case_store.get_case("old")["roi_analysis_details"] == [{"roi_index": 1, "dist_en": 0.5, "error": None}]
+
+
+def test_missing_or_disabled_store_has_no_cases(store_path, monkeypatch):
+    assert case_store.list_cases()["items"] == []
+    assert case_store.get_case("nope") is None
+    # Archivo existente sin tablas (p.ej. creado por otra herramienta).
+    sqlite3.connect(store_path).close()
+    assert case_store.list_cases()["items"] == []
+    assert case_store.get_case("nope") is None
+    monkeypatch.setattr(config, "CASE_STORE_ENABLED", False)
+    assert case_store.list_cases() == {"items": [], "limit": config.CASE_STORE_PAGE_SIZE, "offset": 0, "has_more": False}
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import numpy as np
+
+import config
+from services import image_analysis, image_store
+
+
+def _store(sample_jpeg):
+    img_gray, digest, hit = image_store.ingest(sample_jpeg)
+    image_store.flush(10.0)
+    return img_gray, digest, hit
+
+
+def test_ingest_stores_lossless_png_by_default(sample_jpeg):
+    img_gray, digest, hit = _store(sample_jpeg)
+    assert not hit
+    path = os.path.join(config.IMAGE_STORE_DIR, digest[:2], digest + ".png")
+    assert os.path.getsize(path) < img_gray.nbytes
+    assert image_store.get_metadata(digest)["format"] == "png"
+
+    again, digest_again, hit = image_store.ingest(sample_jpeg)
+    assert hit and digest_again == digest
+    assert np.array_equal(again, image_analysis.decode_to_gray(sample_jpeg))
+
+
+def test_purge_removes_images_unused_for_longer_than_retention(sample_jpeg):
+    _, digest, _ = _store(sample_jpeg)
+    assert image_store.purge(time.time() + config.IMAGE_STORE_RETENTION_S / 2) == 0
+    assert image_store.purge(time.time() + config.IMAGE_STORE_RETENTION_S + 60) == 1
+    assert image_store.load_canonical(digest) is None
+    assert image_store.get_metadata(digest) is None
+
+
+def test_purge_keeps_the_most_recently_used_images_within_the_size_cap(monkeypatch):
+    digests = []
+    for value in range(3):
+        data = f"image-{value}".encode()
+        digest = image_store.sha256_hex(data)
+        image_store._write_canonical(digest, np.full((64, 64), value * 80, dtype=np.uint8), {"sha256": digest})
+        digests.append(digest)
+    # El primero es el más usado recientemente; el segundo, el que menos.
+    base = time.time()
+    for digest, last_used in zip(digests, (base, base - 200, base - 100)):
+        os.utime(os.path.join(config.IMAGE_STORE_DIR, digest[:2], digest + ".png"), (last_used, last_used))
+    sizes = {e["digest"]: e["bytes"] for e in image_store._list_entries()}
+    monkeypatch.setattr(config, "IMAGE_STORE_MAX_BYTES", sizes[digests[0]] + sizes[digests[2]])
+
+    assert image_store.purge() == 1
+    assert image_store.load_canonical(digests[1]) is None
+    assert image_store.load_canonical(digests[0]) is not None
+    assert image_store.load_canonical(digests[2]) is not None
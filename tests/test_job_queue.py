@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import config
+import worker
+from services import analysis_jobs, job_queue
+
+
+@pytest.fixture(params=["sqlite", "spool", "redis"])
+def queue(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "JOB_QUEUE_WORKER_POLL_S", 0.01)
+    if request.param == "sqlite":
+        return job_queue.SqliteJobQueue(str(tmp_path / "jobs.sqlite3"))
+    if request.param == "spool":
+        return job_queue.SpoolJobQueue(str(tmp_path / "jobs"))
+    monkeypatch.setattr(job_queue, "_local_redis_instance", None) # Sustituto en memoria nuevo por test.
+    return job_queue.RedisJobQueue(job_queue.LOCAL_REDIS_URL, "test")
+
+
+def test_submit_claim_complete_fetch(queue):
+    queue.submit("a", {"kind": "encoded", "n": 1}, b"first")
+    queue.submit("b", {"kind": "gray", "n": 2}, b"second")
+    assert queue.stats()["pending"] == 2
+
+    job_id, meta, blob = queue.claim("w1", 0.1)
+    assert (job_id, meta, blob) == ("a", {"kind": "encoded", "n": 1}, b"first") # El más antiguo primero.
+    assert queue.fetch_result("a") is None
+    queue.complete("a", {"digital_score": 3})
+    assert queue.fetch_result("a") == {"digital_score": 3}
+    assert queue.fetch_result("a") is None # El resultado se entrega una sola vez.
+
+    assert queue.claim("w2", 0.1)[0] == "b"
+    assert queue.claim("w2", 0.05) is None
+    assert queue.stats()["pending"] == 0 and queue.stats()["claimed"] == 1
+
+
+def test_requeue_expired_returns_claimed_jobs(queue, monkeypatch):
+    queue.submit("a", {"n": 1}, b"blob")
+    assert queue.claim("dead-worker", 0.1)[0] == "a"
+    assert queue.requeue_expired() == 0 # Dentro de la concesión.
+
+    monkeypatch.setattr(config, "JOB_QUEUE_LEASE_S", -1.0)
+    assert queue.requeue_expired() == 1
+    job_id, meta, blob = queue.claim("w2", 0.1)
+    assert (job_id, meta, blob) == ("a", {"n": 1}, b"blob") # El blob se conserva hasta completar.
+
+
+def test_cancel_discards_pending_claimed_and_results(queue):
+    for job_id in ("a", "b", "c"):
+        queue.submit(job_id, {}, b"")
+    assert queue.claim("w1", 0.1)[0] == "a"
+    assert queue.claim("w1", 0.1)[0] == "b"
+    queue.complete("b", {"ok": True})
+    for job_id in ("a", "b", "c"):
+        queue.cancel(job_id)
+    assert queue.fetch_result("b") is None
+    assert queue.claim("w1", 0.05) is None
+    assert queue.stats() == {"pending": 0, "claimed": 0, "results": 0}
+
+
+def test_sqlite_reuses_one_connection_per_thread(tmp_path):
+    queue = job_queue.SqliteJobQueue(str(tmp_path / "jobs.sqlite3"))
+    conn = queue._connect()
+    assert queue._connect() is conn
+    other = []
+    thread = threading.Thread(target=lambda: other.append(queue._connect()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+
+def test_incomplete_backend_fails_at_instantiation():
+    class NoStats(job_queue.JobQueue):
+        def submit(self, job_id, meta, blob): ...
+        def claim(self, worker_id, timeout): ...
+        def complete(self, job_id, result): ...
+        def fetch_result(self, job_id): ...
+        def cancel(self, job_id): ...
+        def requeue_expired(self): ...
+
+    with pytest.raises(TypeError, match="stats"):
+        NoStats()
+
+
+def test_redis_job_claimed_by_a_dead_worker_is_not_lost(monkeypatch):
+    monkeypatch.setattr(job_queue, "_local_redis_instance", None)
+    queue = job_queue.RedisJobQueue(job_queue.LOCAL_REDIS_URL, "test")
+    queue.submit("a", {"n": 1}, b"blob")
+    # El worker mueve el trabajo a `processing` y muere antes de registrar el instante (ZADD).
+    assert queue.client.blmove(queue._key("pending"), queue._key("processing"), 0.1, "RIGHT", "LEFT") == b"a"
+    assert queue.stats()["claimed"] == 1
+    assert queue.requeue_expired() == 0 # Primera vez que se ve: empieza su concesión.
+    assert queue.client.zscore(queue._key("claimed"), "a") is not None
+
+    monkeypatch.setattr(config, "JOB_QUEUE_LEASE_S", -1.0)
+    assert queue.requeue_expired() == 1
+    assert queue.claim("w2", 0.1) == ("a", {"n": 1}, b"blob")
+
+
+def test_redis_results_expire(monkeypatch):
+    monkeypatch.setattr(job_queue, "_local_redis_instance", None)
+    monkeypatch.setattr(config, "JOB_QUEUE_RESULT_TTL_S", 0.0)
+    queue = job_queue.RedisJobQueue(job_queue.LOCAL_REDIS_URL, "test")
+    queue.submit("a", {}, b"")
+    queue.claim("w1", 0.1)
+    queue.complete("a", {"ok": True})
+    assert queue.stats()["results"] == 0
+    assert queue.fetch_result("a") is None
+
+
+class _FlakyQueue:
+    """Cola que falla las primeras veces en cada operación, como una base de datos bloqueada."""
+
+    name = "flaky"
+
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.completed = []
+        self.jobs = [("a", {"kind": "encoded", "rois": []}, b"")]
+
+    def _maybe_fail(self, operation):
+        if self.failures.get(operation, 0):
+            self.failures[operation] -= 1
+            raise sqlite3.OperationalError("database is locked")
+
+    def requeue_expired(self):
+        self._maybe_fail("requeue_expired")
+        return 0
+
+    def claim(self, worker_id, timeout):
+        self._maybe_fail("claim")
+        return self.jobs.pop() if self.jobs else None
+
+    def complete(self, job_id, result):
+        self._maybe_fail("complete")
+        self.completed.append((job_id, result))
+
+
+def test_worker_survives_queue_errors(monkeypatch):
+    flaky = _FlakyQueue({"requeue_expired": 1, "claim": 2, "complete": 1})
+    monkeypatch.setattr(job_queue, "get_queue", lambda backend=None: flaky)
+    monkeypatch.setattr(worker, "_ERROR_BACKOFF_S", 0.001)
+
+    async def fake_execute(meta, blob):
+        return {"analysis_ms": 1.0}
+
+    monkeypatch.setattr(analysis_jobs, "execute_job", fake_execute)
+    assert asyncio.run(worker.run_worker("w1", max_jobs=1)) == 1
+    assert flaky.completed == [("a", {"analysis_ms": 1.0, "worker_id": "w1"})]
+    assert not any(flaky.failures.values())
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import config
+import main
+from services import memory_budget
+
+
+def _post_concurrently(client, form, image, count):
+    responses = []
+    def post():
+        responses.append(client.post("/api/calculate", data=form, files={"image": ("p.jpg", image, "image/jpeg")}))
+    threads = [threading.Thread(target=post) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+@pytest.fixture
+def one_analysis_budget(sample_jpeg, monkeypatch):
+    """Presupuesto del proceso para un solo análisis de `sample_jpeg` a la vez."""
+    estimate = memory_budget.estimate_decoded_image_bytes(sample_jpeg)
+    monkeypatch.setattr(config, "MEMORY_BUDGET_PROCESS_BYTES", int(estimate * 1.5))
+    monkeypatch.setattr(config, "CASE_STORE_ENABLED", False)
+    monkeypatch.setattr(memory_budget, "_budget", memory_budget._ProcessBudget())
+
+
+def test_concurrent_analyses_queue_for_the_budget(one_analysis_budget, calculate_form, sample_jpeg):
+    with TestClient(main.app) as client:
+        responses = _post_concurrently(client, calculate_form, sample_jpeg, 3)
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    stats = memory_budget.stats()
+    assert stats["queued"] == 2
+    assert stats["reserved_bytes"] == 0
+
+
+def test_queue_timeout_rejects_with_503(one_analysis_budget, calculate_form, sample_jpeg, monkeypatch):
+    monkeypatch.setattr(config, "MEMORY_BUDGET_QUEUE_TIMEOUT_S", 0.01)
+    with TestClient(main.app) as client:
+        responses = _post_concurrently(client, calculate_form, sample_jpeg, 2)
+    assert sorted(r.status_code for r in responses) == [200, 503]
+    assert memory_budget.stats()["rejected_process"] == 1
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import json
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import config
+import main
+from services import profiling
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_sampled_registers_the_thread_only_while_profiling():
+    sampler = profiling.StackSampler(interval=0.001)
+    sampler.start()
+    try:
+        # Como `asyncio.to_thread`: el hilo ejecuta la función en una copia del contexto de la petición.
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(profiling.sampled(_busy), 0.05),
+                                  name="analysis-thread")
+        worker.start()
+        worker.join()
+    finally:
+        sampler.stop()
+    assert "analysis-thread" in sampler.sample_threads
+    assert any(line.startswith("[analysis-thread];") and "_busy" in line for line in sampler.to_collapsed().splitlines())
+    # Sin muestreador activo la función envuelta no registra nada.
+    assert profiling._active_sampler.get() is None
+    assert profiling.sampled(lambda: 7)() == 7
+
+
+def test_profiled_request_includes_analysis_threads(calculate_form, sample_jpeg, monkeypatch):
+    monkeypatch.setattr(config, "CASE_STORE_ENABLED", False)
+    monkeypatch.setattr(config, "PROFILING_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(config, "PROFILING_INTERVAL_S", 0.001)
+    # `main.app` solo registra el middleware con PROFILING_ENABLED al importarse: app propia con las mismas rutas.
+    app = FastAPI()
+    app.middleware("http")(main._profiling_middleware)
+    app.include_router(main.app.router)
+    files = {"image": ("p.jpg", sample_jpeg, "image/jpeg")}
+    with TestClient(app) as client:
+        response = client.post("/api/calculate", data=calculate_form, files=files,
+                               headers={config.PROFILING_HEADER: "secret"})
+    assert response.status_code == 200
+    profile_id = response.headers[profiling.PROFILE_ID_HEADER]
+    with open(profiling.profile_artifact_path(profile_id, "collapsed"), encoding="utf-8") as f:
+        collapsed = f.read()
+    analysis_ms = sum(int(line.rsplit(" ", 1)[1]) for line in collapsed.splitlines()
+                      if "services/image_analysis.py" in line and not line.startswith("[event-loop]"))
+    assert analysis_ms > 0
+    with open(profiling.profile_artifact_path(profile_id, "speedscope"), encoding="utf-8") as f:
+        speedscope = json.load(f)
+    assert len(speedscope["profiles"]) >= 2 # Event loop + al menos un hilo de análisis.
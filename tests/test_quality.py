@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import config
+import main
+from services import memory_budget, quality
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(config, "QUALITY_ADAPTIVE_ENABLED", True)
+    monkeypatch.setattr(config, "QUALITY_HOLD_S", 0.0)
+    monkeypatch.setattr(config, "QUALITY_QUEUE_DEPTH_HIGH", 2)
+    fresh = quality._QualityController()
+    monkeypatch.setattr(quality, "_controller", fresh)
+    return fresh
+
+
+def _select_with_in_flight(controller, in_flight):
+    controller.in_flight = in_flight
+    return quality.select_tier()
+
+
+def test_disabled_is_always_full(controller, monkeypatch):
+    monkeypatch.setattr(config, "QUALITY_ADAPTIVE_ENABLED", False)
+    assert _select_with_in_flight(controller, 50) == (quality.full_tier(), None)
+
+
+def test_steps_down_one_tier_at_a_time_and_stops_at_the_floor(controller):
+    names = [tier.name for tier in quality.tiers()]
+    selected = [_select_with_in_flight(controller, 3)[0].name for _ in range(len(names) + 2)]
+    assert selected == names[1:] + [names[-1]] * 3
+    tier, reason = quality.select_tier()
+    assert "2 other analyses in progress" in reason
+
+
+def test_recovers_when_pressure_drops(controller):
+    for _ in range(len(quality.tiers())):
+        _select_with_in_flight(controller, 3)
+    controller.record_latency(10.0) # Carga reciente: no vuelve directamente a "full".
+    # 1 petición en curso (esta) -> presión 0: sube un nivel cada vez.
+    names = [_select_with_in_flight(controller, 1)[0].name for _ in range(len(quality.tiers()))]
+    assert names == [tier.name for tier in reversed(quality.tiers())][1:] + ["full"]
+
+
+def test_hold_time_limits_tier_changes(controller, monkeypatch):
+    monkeypatch.setattr(config, "QUALITY_HOLD_S", 3600.0)
+    assert _select_with_in_flight(controller, 3)[0].name == quality.tiers()[1].name
+    assert _select_with_in_flight(controller, 3)[0].name == quality.tiers()[1].name
+
+
+def test_high_latency_steps_down(controller, monkeypatch):
+    monkeypatch.setattr(config, "QUALITY_LATENCY_MIN_SAMPLES", 3)
+    for _ in range(3):
+        controller.record_latency(config.QUALITY_LATENCY_HIGH_MS * 2)
+    tier, reason = _select_with_in_flight(controller, 1)
+    assert tier.name == quality.tiers()[1].name
+    assert "latency" in reason
+
+
+def test_idle_resets_to_full(controller):
+    _select_with_in_flight(controller, 3)
+    assert controller.level == 1
+    assert _select_with_in_flight(controller, 1) == (quality.full_tier(), None)
+
+
+def test_sample_roi_pixels_caps_pixel_count():
+    tier = quality.QualityTier("t", (32, 32), 100)
+    assert quality.sample_roi_pixels(quality.np.arange(1000), tier).size <= 100
+    assert quality.sample_roi_pixels(quality.np.arange(50), tier).size == 50
+
+
+def test_concurrent_requests_get_a_degraded_tier(controller, calculate_form, sample_jpeg, monkeypatch):
+    """Con el análisis fuera del event loop, las peticiones simultáneas cuentan como carga."""
+    monkeypatch.setattr(config, "QUALITY_QUEUE_DEPTH_HIGH", 1)
+    monkeypatch.setattr(config, "CASE_STORE_ENABLED", False)
+    # Presupuesto para un solo análisis a la vez: las demás peticiones esperan en cola.
+    estimate = memory_budget.estimate_decoded_image_bytes(sample_jpeg)
+    monkeypatch.setattr(config, "MEMORY_BUDGET_PROCESS_BYTES", int(estimate * 1.5))
+    monkeypatch.setattr(memory_budget, "_budget", memory_budget._ProcessBudget())
+
+    responses = []
+    def post():
+        responses.append(client.post("/api/calculate", data=calculate_form, files={"image": ("p.jpg", sample_jpeg, "image/jpeg")}))
+    with TestClient(main.app) as client:
+        threads = [threading.Thread(target=post) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics = client.get("/api/metrics/quality").json()
+
+    assert [r.status_code for r in responses] == [200] * 4
+    results = [json.loads(r.content) for r in responses]
+    degraded = [r for r in results if r["quality_tier"] != "full"]
+    assert degraded, [r["quality_tier"] for r in results]
+    assert all("other analyses in progress" in r["quality_reason"] for r in degraded)
+    assert metrics["degraded_requests"] == len(degraded)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import json
+
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import config
+import main
+from services import radiograph_io
+
+
+def _tiff(compression: int) -> bytes:
+    pixels = (np.random.default_rng(0).random((700, 700)) * 65535).astype(np.uint16)
+    ok, buffer = cv2.imencode(".tif", pixels, [cv2.IMWRITE_TIFF_COMPRESSION, compression])
+    assert ok
+    return buffer.tobytes()
+
+
+def _post(data, filename, content, content_type="image/tiff"):
+    with TestClient(main.app) as client:
+        response = client.post("/api/calculate", data=data, files={"image": (filename, content, content_type)})
+    assert response.status_code == 200
+    return json.loads(response.content)
+
+
+@pytest.fixture(autouse=True)
+def _no_case_store(monkeypatch):
+    monkeypatch.setattr(config, "CASE_STORE_ENABLED", False)
+
+
+def test_uncompressed_tiff_is_memory_mapped(tmp_path, calculate_form):
+    path = tmp_path / "plain.tif"
+    path.write_bytes(_tiff(1))
+    pixels, inverted = radiograph_io.open_native_radiograph(str(path))
+    assert isinstance(pixels, np.memmap) and pixels.shape == (700, 700) and pixels.dtype == np.uint16
+    result = _post(calculate_form, "plain.tif", path.read_bytes())
+    assert result["image_sha256"] is None # Ruta nativa: no pasa por el almacén de imágenes.
+    assert all(d["error"] is None for d in result["roi_analysis_details"])
+
+
+def test_compressed_tiff_falls_back_to_opencv(tmp_path, calculate_form):
+    path = tmp_path / "lzw.tif"
+    path.write_bytes(_tiff(5)) # LZW, como las que se subían antes de la ruta nativa.
+    with pytest.raises(ValueError, match="Compressed TIFF"):
+        radiograph_io.open_native_radiograph(str(path))
+    result = _post(calculate_form, "lzw.tif", path.read_bytes())
+    assert result["image_sha256"] is not None # Decodificada e ingerida como imagen común.
+    assert all(d["error"] is None for d in result["roi_analysis_details"])
+
+
+def test_malformed_dicom_reports_an_error_detail(calculate_form):
+    dicom = bytes(radiograph_io.DICOM_MAGIC_OFFSET) + radiograph_io.DICOM_MAGIC + b"\x02\x00\x10\x00UI"
+    result = _post(calculate_form, "broken.dcm", dicom, "application/dicom")
+    assert result["puntuacio_digital"] == 0
+    assert result["roi_analysis_details"][0]["error"].startswith("Image loading error")
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services import roi_codec
+
+SQUARE = [[0, 0], [10, 0], [10, 10], [0, 10]]
+TRIANGLE = [[-5, 3], [32767, -32768], [7, 7]]
+
+
+def test_compact_round_trip():
+    rois = roi_codec.decode_roi_payload(roi_codec.encode_rois_compact([SQUARE, TRIANGLE]))
+    assert [roi.tolist() for roi in rois] == [SQUARE, TRIANGLE]
+    assert all(roi.dtype == np.int32 and roi.shape[1] == 2 for roi in rois)
+
+
+def test_classic_format_matches_compact():
+    classic = roi_codec.decode_roi_payload(json.dumps([SQUARE, TRIANGLE]))
+    compact = roi_codec.decode_roi_payload(roi_codec.encode_rois_compact([SQUARE, TRIANGLE]))
+    assert [a.tolist() for a in classic] == [b.tolist() for b in compact]
+
+
+def test_no_rois_decode_to_empty_list():
+    assert roi_codec.decode_roi_payload(roi_codec.encode_rois_compact([])) == []
+
+
+def test_encode_rejects_out_of_range_coordinates():
+    with pytest.raises(ValueError):
+        roi_codec.encode_rois_compact([[[0, 0], [40000, 0], [0, 1]]])
+
+
+def _compact(offsets, coords="A" * 22 + "=="): # 16 bytes: 4 vértices (0, 0)
+    return json.dumps({"encoding": "int16-b64", "offsets": offsets, "coords": coords})
+
+
+@pytest.mark.parametrize("payload", [
+    _compact({"a": 1}),
+    _compact([0, None]),
+    _compact([0, 10 ** 30]),
+    _compact([0, 3.7]), # No se trunca a 3.
+    _compact([0, True]),
+    _compact("0,4"),
+    _compact([[0, 4]]),
+    _compact([1, 4]),
+    _compact([0, 3]),
+    _compact([0, 2, 4]), # Polígonos de menos de 3 vértices
+    _compact([0, 4], coords="not base64!"),
+    _compact([0, 4], coords=123),
+    _compact([0, 4], coords="ñ"),
+    _compact([0, 1], coords="AAA="), # Buffer que no es múltiplo de un par (x, y)
+    json.dumps({"encoding": "float-b64", "offsets": [0], "coords": ""}),
+    "{not json",
+])
+def test_malformed_compact_payloads_raise_value_error(payload):
+    with pytest.raises(ValueError):
+        roi_codec.decode_roi_payload(payload)
+
+
+def test_integral_float_offsets_are_accepted():
+    rois = roi_codec.decode_roi_payload(_compact([0.0, 4.0]))
+    assert [roi.shape for roi in rois] == [(4, 2)]
+
+
+@pytest.mark.parametrize("value", [2 ** 31, -(2 ** 31) - 1, 10 ** 30])
+def test_classic_coordinates_outside_int32_raise_value_error(value):
+    with pytest.raises(ValueError, match="int32"):
+        roi_codec.decode_roi_payload(json.dumps([[[0, 0], [value, 0], [0, 1]]]))
+
+
+@pytest.mark.parametrize("roi_data", [_compact({"a": 1}), json.dumps([[[0, 0], [2 ** 40, 0], [0, 1]]])])
+def test_api_rejects_malformed_rois_with_422(calculate_form, roi_data):
+    calculate_form["roi_data"] = roi_data
+    with TestClient(main.app) as client:
+        api = client.post("/api/calculate", data=calculate_form, files={"image": ("x.png", b"\x89PNG", "image/png")})
+        page = client.post("/calculate", data=calculate_form, files={"image": ("x.png", b"\x89PNG", "image/png")})
+    assert api.status_code == 422
+    assert page.status_code == 422
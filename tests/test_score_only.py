@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import config
+import main
+from services import image_analysis, roi_codec
+
+SQUARES = [(100, 100), (400, 400), (700, 200), (200, 600), (900, 500), (50, 50)]
+
+
+def _rois():
+    return [np.array([[x, y], [x + 150, y], [x + 150, y + 150], [x, y + 150]], dtype=np.int32) for x, y in SQUARES]
+
+
+def test_score_only_matches_full_mode_on_a_radiograph(sample_jpeg):
+    img = image_analysis.decode_to_gray(sample_jpeg)
+    full_max, full_score, full_details = asyncio.run(image_analysis.analyze_gray_image(img, _rois()))
+    max_value, score, details = asyncio.run(image_analysis.analyze_gray_image(img, _rois(), score_only=True))
+    assert score == full_score
+    assert max_value <= full_max
+    assert any(d.skipped == "bound" for d in details)
+    for full, pruned in zip(full_details, details):
+        if pruned.skipped is None:
+            assert pruned.dist_en == full.dist_en
+
+
+@pytest.fixture
+def stub_metrics(monkeypatch):
+    """DistEn2D y cotas fijadas por ROI; registra las llamadas (lotes) al motor de métricas."""
+    values, bounds, calls = {}, {}, []
+    def fake_metrics(processed_rois, roi_indices, tracker=None):
+        calls.append(list(roi_indices))
+        return [(values[i], None, {}, None) for i in roi_indices]
+    def fake_bound(processed_roi, roi_index):
+        return bounds[roi_index], bounds[roi_index]
+    monkeypatch.setattr(image_analysis, "_calculate_texture_metrics_safe", fake_metrics)
+    monkeypatch.setattr(image_analysis, "_screening_bound", fake_bound)
+    return values, bounds, calls
+
+
+def _run_score_only(count):
+    img = np.random.default_rng(0).integers(0, 255, (1200, 1200), dtype=np.uint8)
+    return asyncio.run(image_analysis.analyze_gray_image(img, _rois()[:count], score_only=True))
+
+
+def test_prunes_by_digital_score_and_batches_the_rest(stub_metrics):
+    values, bounds, calls = stub_metrics
+    values.update({1: 0.80, 2: 0.70, 3: 0.90, 4: 0.75})
+    # La ROI 2 tiene cota mayor que el máximo (0.805 > 0.80) pero la misma puntuación digital (4).
+    bounds.update({1: 0.95, 2: 0.805, 3: 0.90, 4: 0.88}) # También fijan el orden (indicador decreciente).
+    max_value, score, details = _run_score_only(4)
+    assert calls == [[1], [3, 4]] # La referencia sola y las que pueden subir la puntuación en un lote.
+    assert [d.skipped for d in details] == [None, "bound", None, None]
+    assert (max_value, score) == (0.90, image_analysis._calculate_digital_score(0.90))
+
+
+def test_saturated_score_skips_everything_else(stub_metrics):
+    values, bounds, calls = stub_metrics
+    values.update({1: 0.99})
+    bounds.update({1: 1.0, 2: 1.0, 3: 1.0})
+    _, score, details = _run_score_only(3)
+    assert score == 10
+    assert calls == [[1]]
+    assert [d.skipped for d in details] == [None, "saturated", "saturated"]
+
+
+def test_api_flags_estimated_digital_score(calculate_form, sample_jpeg, monkeypatch):
+    monkeypatch.setattr(config, "CASE_STORE_ENABLED", False)
+    calculate_form["roi_data"] = roi_codec.encode_rois_compact([roi.tolist() for roi in _rois()])
+    files = {"image": ("p.jpg", sample_jpeg, "image/jpeg")}
+    with TestClient(main.app) as client:
+        full = json.loads(client.post("/api/calculate", data=calculate_form, files=files).content)
+        pruned = json.loads(client.post("/api/calculate", data={**calculate_form, "score_only": "true"}, files=files).content)
+        page = client.post("/calculate", data={**calculate_form, "score_only": "true"}, files=files,
+                           headers={"X-Fragment": "results"})
+    assert full["digital_score_estimated"] is False
+    assert pruned["digital_score_estimated"] is True
+    assert pruned["puntuacio_digital"] == full["puntuacio_digital"]
+    assert "Score-only mode skipped some ROIs" in page.text
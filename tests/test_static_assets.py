@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services import static_assets
+
+CSS = b"body { color: #333; }\n" * 200
+
+
+@pytest.mark.parametrize("accept_encoding, available, expected", [
+    ("gzip, deflate, br", {"identity": b"", "gzip": b"", "br": b""}, "br"), # br > gzip aunque llegue después.
+    ("gzip, br", {"identity": b"", "gzip": b""}, "gzip"), # Sin variante brotli.
+    ("br;q=0, gzip;q=0.5", {"identity": b"", "gzip": b"", "br": b""}, "gzip"),
+    ("GZIP;q=0.0", {"identity": b"", "gzip": b""}, "identity"),
+    ("*", {"identity": b"", "gzip": b""}, "gzip"),
+    ("identity", {"identity": b"", "gzip": b""}, "identity"),
+    ("", {"identity": b"", "gzip": b""}, "identity"),
+])
+def test_negotiate(accept_encoding, available, expected):
+    assert static_assets._negotiate(accept_encoding, available) == expected
+
+
+@pytest.fixture
+def static_dir(tmp_path, monkeypatch):
+    # Manifiesto propio: no toca el del proceso (lo usan las demás pruebas a través de `main`).
+    monkeypatch.setattr(static_assets, "_manifest", None)
+    monkeypatch.setattr(static_assets, "_assets", {})
+    (tmp_path / "css").mkdir()
+    (tmp_path / "css" / "style.css").write_bytes(CSS)
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(64))
+    return tmp_path
+
+
+@pytest.fixture
+def client(static_dir):
+    static_assets.build_manifest(str(static_dir))
+    app = FastAPI()
+    app.mount("/static", static_assets.FingerprintedStaticFiles(directory=str(static_dir)), name="static")
+    return TestClient(app)
+
+
+def test_build_manifest(static_dir):
+    manifest = static_assets.build_manifest(str(static_dir))
+    assert set(manifest) == {"css/style.css", "logo.png"}
+    assert manifest["css/style.css"].startswith("css/style.") and manifest["css/style.css"].endswith(".css")
+    assert static_assets.versioned_path("/css/style.css") == manifest["css/style.css"]
+    assert static_assets.versioned_path("js/new.js") == "js/new.js" # Desconocido: ruta original.
+    css = static_assets._assets[manifest["css/style.css"]]
+    assert gzip.decompress(css.variants["gzip"]) == CSS
+    assert set(static_assets._assets[manifest["logo.png"]].variants) == {"identity"} # PNG: sin comprimir.
+
+
+def test_fingerprinted_url_is_immutable_and_compressed(client):
+    url = "/static/" + static_assets.versioned_path("css/style.css")
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.content == CSS # httpx descomprime el cuerpo.
+    assert response.headers["cache-control"] == static_assets.IMMUTABLE_CACHE_CONTROL
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"].endswith('-gzip"')
+
+    identity = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+    assert identity.headers["etag"] != response.headers["etag"]
+
+
+def test_matching_etag_returns_304(client):
+    url = "/static/" + static_assets.versioned_path("css/style.css")
+    etag = client.get(url, headers={"Accept-Encoding": "gzip"}).headers["etag"]
+    response = client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    # Otra codificación, otra variante: la ETag guardada no vale.
+    assert client.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": etag}).status_code == 200
+
+
+def test_head_reports_length_without_body(client):
+    url = "/static/" + static_assets.versioned_path("css/style.css")
+    response = client.head(url, headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["content-length"] == str(len(CSS))
+
+
+def test_unversioned_and_stale_urls(client):
+    plain = client.get("/static/css/style.css")
+    assert plain.status_code == 200 and plain.content == CSS
+    assert plain.headers.get("cache-control") != static_assets.IMMUTABLE_CACHE_CONTROL
+    assert client.get("/static/css/style.0000000000.css").status_code == 404
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+import config
+from conftest import SAMPLE_IMAGE_PATH
+from services import image_analysis, texture_metrics
+
+EntropyHub = pytest.importorskip("EntropyHub")
+
+
+def _quiet(func, *args, **kwargs):
+    # EntropyHub imprime avisos ("bins were empty"...) directamente por stdout.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def _reference(roi, m, tau, bins):
+    value = _quiet(EntropyHub.DistEn2D, roi, m=m, tau=tau, Bins=bins, Lock=max(roi.shape) <= 128)
+    return float(value[0] if isinstance(value, list) else value)
+
+
+def _first(value):
+    return float(value[0] if isinstance(value, (tuple, list)) else value)
+
+
+# Valor de EntropyHub equivalente a cada métrica registrada, con los parámetros de config.py.
+def _entropyhub_samp_en(roi, m, tau):
+    # `r` explícito: el valor por defecto de la librería (float32 con ROIs float32) no pasa su propia validación.
+    return _first(_quiet(EntropyHub.SampEn2D, roi, m=m, tau=tau, r=float(config.TEXTURE_SAMPEN_R * np.std(roi))))
+
+
+def _entropyhub_perm_en(roi, m, tau):
+    # `Norm=True` de EntropyHub usa `np.math` (eliminado en NumPy 2): se normaliza aquí igual, por ln((m*m)!).
+    return _first(_quiet(EntropyHub.PermEn2D, roi, m=m, tau=tau, Norm=False)) / math.log(math.factorial(m * m))
+
+
+def _entropyhub_disp_en(roi, m, tau):
+    # `disp_en` no es el valor en bruto de la librería: se normaliza por ln(c^(m*m)) = m^2 * ln(c).
+    classes = config.TEXTURE_DISPEN_CLASSES
+    raw = _first(_quiet(EntropyHub.DispEn2D, roi, m=m, tau=tau, c=classes, Typex="NCDF"))
+    return raw / (m * m * math.log(classes))
+
+
+ENTROPYHUB_REFERENCES = {
+    "dist_en": lambda roi, m, tau: _reference(roi, m, tau, config.DISTEN_BINS),
+    "samp_en": _entropyhub_samp_en,
+    "perm_en": _entropyhub_perm_en,
+    "disp_en": _entropyhub_disp_en,
+}
+
+
+def _stack(size=32, count=4):
+    """ROIs preprocesadas de la imagen de ejemplo más una textura aleatoria."""
+    gray = cv2.imread(SAMPLE_IMAGE_PATH, cv2.IMREAD_GRAYSCALE)
+    rng = np.random.default_rng(0)
+    rois = []
+    for index in range(count):
+        y, x = rng.integers(0, min(gray.shape) - 96, size=2)
+        rois.append(image_analysis._preprocess_roi_for_disten(gray[y:y + 96, x:x + 96].ravel(), index, target_size=(size, size)))
+    rois.append(image_analysis._preprocess_roi_for_disten(rng.integers(0, 256, 96 * 96).astype(np.uint8), count, target_size=(size, size)))
+    return np.stack(rois)
+
+
+@pytest.mark.parametrize("m, tau, bins", [(2, 1, "sturges"), (3, 1, "sturges"), (2, 2, "sturges"), (2, 1, 32)])
+def test_batch_matches_entropyhub(m, tau, bins):
+    stack = _stack()
+    values, _ = texture_metrics.compute_batch(stack, names=(), m=m, tau=tau, bins=bins)
+    expected = [_reference(roi, m, tau, bins) for roi in stack]
+    np.testing.assert_allclose([v["dist_en"] for v in values], expected, atol=1e-6)
+    np.testing.assert_allclose(texture_metrics.dist_en_batch(stack, m=m, tau=tau, bins=bins), expected, atol=1e-6)
+
+
+def test_defaults_come_from_config(monkeypatch):
+    stack = _stack(count=2)
+    monkeypatch.setattr(config, "DISTEN_M", 3)
+    monkeypatch.setattr(config, "DISTEN_TAU", 2)
+    np.testing.assert_allclose(texture_metrics.dist_en_batch(stack),
+                               texture_metrics.dist_en_batch(stack, m=3, tau=2, bins=config.DISTEN_BINS))
+
+
+def test_homogeneous_rois_are_zero():
+    stack = _stack(count=1)
+    stack[0] = 0
+    values, _ = texture_metrics.compute_batch(stack, names=(), m=2, tau=1, bins="sturges")
+    assert values[0]["dist_en"] == 0.0
+    assert values[1]["dist_en"] > 0.0
+
+
+def test_concurrent_batches_use_their_own_buffers():
+    stacks = [_stack(size=48, count=3), _stack(size=48, count=3)[::-1].copy(), _stack(size=32, count=2)]
+    expected = [texture_metrics.dist_en_batch(stack) for stack in stacks]
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        for _ in range(3):
+            results = list(pool.map(texture_metrics.dist_en_batch, stacks))
+            for got, want in zip(results, expected):
+                np.testing.assert_array_equal(got, want)
+
+
+def test_working_bytes_follows_the_pattern_parameters(monkeypatch):
+    monkeypatch.setattr(config, "TEXTURE_BATCH_BUFFER_BYTES", 1 << 40) # Sin tope: depende solo de P.
+    cell = texture_metrics._BATCH_BYTES_PER_CELL
+    assert texture_metrics.working_bytes((32, 32), (), m=2, tau=1) == (31 * 31) ** 2 * cell
+    assert texture_metrics.working_bytes((32, 32), (), m=3, tau=2) == (28 * 28) ** 2 * cell
+    monkeypatch.setattr(config, "DISTEN_M", 3)
+    monkeypatch.setattr(config, "DISTEN_TAU", 2)
+    assert texture_metrics.working_bytes((32, 32), ()) == (28 * 28) ** 2 * cell
+
+
+@pytest.fixture(scope="module")
+def production_metrics():
+    """Todas las métricas registradas, a `DISTEN_TARGET_SIZE` y con los parámetros de config.py."""
+    stack = _stack(size=config.DISTEN_TARGET_SIZE[0], count=2)
+    values, _ = texture_metrics.compute_batch(stack, names=tuple(texture_metrics.METRICS))
+    return stack, values
+
+
+def test_every_metric_has_a_reference():
+    assert set(ENTROPYHUB_REFERENCES) == set(texture_metrics.METRICS)
+
+
+@pytest.mark.parametrize("name", sorted(ENTROPYHUB_REFERENCES))
+def test_metric_matches_entropyhub_at_production_size(production_metrics, name):
+    stack, values = production_metrics
+    assert stack.shape[1:] == tuple(config.DISTEN_TARGET_SIZE)
+    for roi, roi_values in zip(stack, values):
+        expected = ENTROPYHUB_REFERENCES[name](roi, config.DISTEN_M, config.DISTEN_TAU)
+        if np.isfinite(expected):
+            assert roi_values[name] == pytest.approx(expected, abs=1e-6)
+        else:
+            assert roi_values[name] is None # SampEn2D indefinida (ningún par a distancia < r): se informa None.
+
+
+def test_disp_en_is_normalized(production_metrics):
+    stack, values = production_metrics
+    m, classes = config.DISTEN_M, config.TEXTURE_DISPEN_CLASSES
+    raw = _first(_quiet(EntropyHub.DispEn2D, stack[0], m=m, tau=config.DISTEN_TAU, c=classes))
+    assert values[0]["disp_en"] == pytest.approx(raw / (m * m * math.log(classes)), abs=1e-9)
+    assert abs(values[0]["disp_en"] - raw) > 1.0 # El valor en bruto está en otra escala.
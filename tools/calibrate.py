@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Calibración de los pesos, máximos y umbrales de la puntuación integrada frente a casos etiquetados.
+
+Uso:
+    python -m tools.calibrate --labels etiquetas.csv                  # Rejilla por defecto
+    python -m tools.calibrate --labels etiquetas.json --weight-step 0.01 --low 8 16 --moderate 18 30 --high 28 38
+    python -m tools.calibrate --synthetic 5000 --output calibracion.json  # Sin datos: casos sintéticos
+
+Formato de las etiquetas (CSV con cabecera o lista JSON), una fila por caso:
+    label                     low | moderate | high | very_high (o 0-3): clasificación de referencia.
+    puntuacio_clinica,
+    puntuacio_radio,
+    puntuacio_digital         Puntuaciones parciales (los mismos nombres que `/api/cases`), o bien
+    case_id                   un caso del almacén de casos (`--case-store`) del que leerlas.
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Permite `python tools/calibrate.py` además de `python -m tools.calibrate`.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+logger = logging.getLogger("tools.calibrate")
+
+# --- Calibración Vectorizada de la Puntuación Integrada ---
+# OBJETIVO: Elegir `SCORE_WEIGHTS`, `MAX_RAW_SCORES` y `CLASSIFICATION_THRESHOLDS` con datos, evaluando
+#           millones de combinaciones en segundos (en lugar de llamar a `calculate_integrated_score`,
+#           que crea un objeto pydantic y escribe varias líneas de log, una vez por combinación y caso).
+# CÓMO:
+#   1. Para cada combinación de pesos y máximos se calcula la puntuación integrada de TODOS los casos con
+#      broadcasting de NumPy, con las mismas operaciones y el mismo orden que `services.scoring`
+#      (`np.round` y `round` redondean igual: mitad al par), así que el resultado es idéntico.
+#   2. La puntuación integrada es un entero 0..MAX_INTEGRATED_SCORE: se resume cada combinación en un
+#      histograma acumulado por clase real (`np.bincount`).
+#   3. La matriz de confusión de CUALQUIER terna de umbrales sale de restas de ese histograma, sin volver a
+#      recorrer los casos: el coste por configuración es constante (16 restas), no proporcional a los casos.
+#   4. Se procesan los pesos por bloques para acotar la memoria y solo se conservan las `--top` mejores.
+
+CLASSES = ("low", "moderate", "high", "very_high")
+SCORE_FIELDS = ("puntuacio_clinica", "puntuacio_radio", "puntuacio_digital")
+OBJECTIVES = ("youden", "balanced_accuracy", "accuracy")
+CHUNK_CELLS = 1 << 24 # Celdas de las matrices de confusión por bloque (~64 MB en int32)
+TIE_BREAK = 1e-7 # Peso de la métrica secundaria al ordenar (válido hasta ~10^6 casos)
+
+
+# --- Datos ---
+
+def _parse_label(value: Any) -> int:
+    text = str(value).strip().lower()
+    if text.isdigit() and int(text) < len(CLASSES):
+        return int(text)
+    if text in CLASSES:
+        return CLASSES.index(text)
+    raise ValueError(f"Unknown label {value!r} (expected one of {', '.join(CLASSES)} or 0-{len(CLASSES) - 1})")
+
+
+def _read_rows(path: str) -> List[Dict[str, Any]]:
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return data["items"] if isinstance(data, dict) else data # Admite una página de /api/cases.
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def load_labelled_cases(path: str, case_store_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns:
+        (scores, labels): `scores` (N, 3) int con las puntuaciones clínica, radiográfica y digital;
+        `labels` (N,) int con el índice de la clase de referencia.
+    """
+    rows = _read_rows(path)
+    missing = [str(row["case_id"]) for row in rows if row.get(SCORE_FIELDS[0]) in (None, "") and row.get("case_id")]
+    stored: Dict[str, Tuple[int, int, int]] = {}
+    if missing:
+        conn = sqlite3.connect(case_store_path)
+        try:
+            for start in range(0, len(missing), 500): # Límite de parámetros de SQLite.
+                batch = missing[start:start + 500]
+                query = f"SELECT case_id, {', '.join(SCORE_FIELDS)} FROM cases WHERE case_id IN ({','.join('?' * len(batch))})"
+                stored.update({row[0]: tuple(row[1:]) for row in conn.execute(query, batch)})
+        finally:
+            conn.close()
+
+    scores, labels = [], []
+    for i, row in enumerate(rows):
+        if row.get(SCORE_FIELDS[0]) not in (None, ""):
+            values = tuple(int(float(row[field])) for field in SCORE_FIELDS)
+        elif str(row.get("case_id")) in stored:
+            values = stored[str(row["case_id"])]
+        else:
+            logger.warning(f"Row {i}: no scores and case {row.get('case_id')!r} not in the case store; skipped.")
+            continue
+        scores.append(values)
+        labels.append(_parse_label(row["label"]))
+    return np.array(scores, dtype=np.int64).reshape(-1, 3), np.array(labels, dtype=np.int64)
+
+
+def synthetic_cases(count: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Casos reproducibles: puntuaciones aleatorias y etiqueta = clasificación actual con ruido de ±1 clase."""
+    rng = np.random.default_rng(seed)
+    scores = np.stack([
+        rng.integers(0, config.MAX_RAW_SCORES["clinical"] + 1, count),
+        rng.integers(0, config.MAX_RAW_SCORES["radio"] + 1, count),
+        rng.choice(sorted(set(config.DIGITAL_SCORE_MAPPING.values())), count),
+    ], axis=1)
+    maxima = np.array([[config.MAX_RAW_SCORES[k] for k in ("clinical", "radio", "digital")]])
+    weights = np.array([[config.SCORE_WEIGHTS[k] for k in ("clinical", "radio", "digital")]])
+    integrated = integrated_scores(scores, weights, maxima)[0]
+    current = np.array([[config.CLASSIFICATION_THRESHOLDS[k] for k in ("low", "moderate", "high")]])
+    labels = classify(integrated[None, :], current)[0]
+    noise = rng.choice([-1, 0, 0, 0, 1], count)
+    return scores, np.clip(labels + noise, 0, len(CLASSES) - 1)
+
+
+# --- Núcleo vectorizado ---
+
+def integrated_scores(scores: np.ndarray, weights: np.ndarray, maxima: np.ndarray) -> np.ndarray:
+    """
+    Puntuación integrada (W, N) para W combinaciones de pesos/máximos (W, 3) y N casos (N, 3).
+    Reproduce `scoring.calculate_*_score` (recorte al máximo) y `calculate_integrated_score`.
+    """
+    max_total = config.MAX_INTEGRATED_SCORE
+    total = np.zeros((weights.shape[0], scores.shape[0]))
+    for k in range(3):
+        maximum = maxima[:, k:k + 1]
+        clipped = np.minimum(scores[None, :, k], maximum)
+        safe_max = np.where(maximum > 0, maximum, 1)
+        total += np.where(maximum > 0, (clipped / safe_max) * (max_total * weights[:, k:k + 1]), 0)
+    return np.minimum(np.round(total), max_total).astype(np.int64)
+
+
+def classify(integrated: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """Clase (0-3) de cada puntuación (W, N) con una terna de umbrales (W, 3), límite superior inclusivo."""
+    return (integrated[:, :, None] > thresholds[:, None, :]).sum(axis=2)
+
+
+def confusion_matrices(integrated: np.ndarray, labels: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """
+    Matrices de confusión (W, T, real, predicha) para W combinaciones de pesos (puntuaciones (W, N))
+    y T ternas de umbrales (T, 3), a partir del histograma acumulado de puntuaciones por clase real.
+    """
+    n_scores = config.MAX_INTEGRATED_SCORE + 1
+    n_weights = integrated.shape[0]
+    n_classes = len(CLASSES)
+    flat = (np.arange(n_weights)[:, None] * n_classes + labels[None, :]) * n_scores + integrated
+    histogram = np.bincount(flat.ravel(), minlength=n_weights * n_classes * n_scores)
+    # cumulative[..., s + 1] = casos con puntuación <= s (cumulative[..., 0] = 0).
+    cumulative = np.zeros((n_weights, n_classes, n_scores + 1), dtype=np.int64)
+    np.cumsum(histogram.reshape(n_weights, n_classes, n_scores), axis=2, out=cumulative[:, :, 1:])
+
+    # Bordes de las clases predichas: (-1, low], (low, moderate], (moderate, high], (high, max].
+    edges = np.concatenate([
+        np.full((len(thresholds), 1), -1), thresholds, np.full((len(thresholds), 1), n_scores - 1)
+    ], axis=1) + 1 # (T, 5), desplazados para indexar `cumulative`.
+    at_edges = cumulative[:, :, edges] # (W, real, T, 5)
+    counts = at_edges[..., 1:] - at_edges[..., :-1] # (W, real, T, predicha)
+    return counts.transpose(0, 2, 1, 3).astype(np.int32)
+
+
+def metrics(confusion: np.ndarray, positive_from: int) -> Dict[str, np.ndarray]:
+    """Sensibilidad/especificidad (positivo = clase >= `positive_from`), exactitud y exactitud equilibrada."""
+    confusion = confusion.astype(np.float64)
+    tp = confusion[..., positive_from:, positive_from:].sum(axis=(-2, -1))
+    fn = confusion[..., positive_from:, :positive_from].sum(axis=(-2, -1))
+    tn = confusion[..., :positive_from, :positive_from].sum(axis=(-2, -1))
+    fp = confusion[..., :positive_from, positive_from:].sum(axis=(-2, -1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sensitivity = tp / (tp + fn)
+        specificity = tn / (tn + fp)
+        per_class = np.diagonal(confusion, axis1=-2, axis2=-1) / confusion.sum(axis=-1)
+    total = confusion.sum(axis=(-2, -1))
+    return {
+        "sensitivity": sensitivity,
+        "specificity": specificity,
+        "youden": sensitivity + specificity - 1,
+        "accuracy": np.trace(confusion, axis1=-2, axis2=-1) / total,
+        "balanced_accuracy": np.nanmean(per_class, axis=-1),
+    }
+
+
+# --- Rejilla ---
+
+def weight_grid(step: float) -> np.ndarray:
+    """Pesos (clínico, radiográfico, digital) no negativos que suman 1, con paso `step`, más los actuales."""
+    n = int(round(1 / step))
+    grid = {(i / n, j / n, (n - i - j) / n) for i in range(n + 1) for j in range(n + 1 - i)}
+    grid.add(tuple(config.SCORE_WEIGHTS[k] for k in ("clinical", "radio", "digital")))
+    return np.array(sorted(grid))
+
+
+def threshold_grid(low: List[int], moderate: List[int], high: List[int]) -> np.ndarray:
+    """Ternas estrictamente crecientes de los rangos inclusivos dados, más los umbrales actuales."""
+    ranges = [range(lo, hi + 1) for lo, hi in (low, moderate, high)]
+    grid = {t for t in itertools.product(*ranges) if t[0] < t[1] < t[2]}
+    grid.add(tuple(config.CLASSIFICATION_THRESHOLDS[k] for k in ("low", "moderate", "high")))
+    return np.array(sorted(grid))
+
+
+def sweep(
+    scores: np.ndarray,
+    labels: np.ndarray,
+    weights: np.ndarray,
+    maxima: np.ndarray,
+    thresholds: np.ndarray,
+    positive_from: int,
+    objective: str,
+    top: int
+) -> List[Dict[str, Any]]:
+    """Evalúa todas las combinaciones (pesos x máximos x umbrales) y devuelve las `top` mejores por `objective`."""
+    settings = np.array([np.concatenate([w, m]) for w in weights for m in maxima]) # (W, 6)
+    chunk = max(1, CHUNK_CELLS // (len(thresholds) * len(CLASSES) ** 2))
+    best: List[Tuple[float, int, int, np.ndarray, Dict[str, float]]] = []
+    for start in range(0, len(settings), chunk):
+        block = settings[start:start + chunk]
+        confusion = confusion_matrices(integrated_scores(scores, block[:, :3], block[:, 3:]), labels, thresholds)
+        values = metrics(confusion, positive_from)
+        # Desempate: la métrica secundaria (en [0, 1]) pesa menos que la menor diferencia posible del objetivo.
+        secondary = "accuracy" if objective == "balanced_accuracy" else "balanced_accuracy"
+        target = np.nan_to_num(values[objective] + TIE_BREAK * np.nan_to_num(values[secondary]), nan=-np.inf).ravel()
+        keep = np.argpartition(-target, min(top, target.size) - 1)[:top] if target.size > top else np.arange(target.size)
+        for flat_index in keep:
+            w, t = divmod(int(flat_index), len(thresholds))
+            best.append((
+                float(target[flat_index]), start + w, t, confusion[w, t],
+                {name: float(v[w, t]) for name, v in values.items()},
+            ))
+        best = sorted(best, key=lambda b: -b[0])[:top]
+    return [_describe(settings[w], thresholds[t], confusion, values) for _, w, t, confusion, values in best]
+
+
+def _describe(setting: np.ndarray, thresholds: np.ndarray, confusion: np.ndarray, values: Dict[str, float]) -> Dict[str, Any]:
+    return {
+        "weights": dict(zip(("clinical", "radio", "digital"), map(float, setting[:3]))),
+        "max_raw_scores": dict(zip(("clinical", "radio", "digital"), map(int, setting[3:]))),
+        "thresholds": dict(zip(("low", "moderate", "high"), map(int, thresholds))),
+        "metrics": values,
+        "confusion": confusion.tolist(), # Filas: clase real; columnas: clase predicha (orden de CLASSES).
+    }
+
+
+def evaluate_current(scores: np.ndarray, labels: np.ndarray, positive_from: int) -> Dict[str, Any]:
+    """Métricas de la configuración actual de config.py (referencia)."""
+    setting = np.array([[config.SCORE_WEIGHTS[k] for k in ("clinical", "radio", "digital")]
+                        + [config.MAX_RAW_SCORES[k] for k in ("clinical", "radio", "digital")]])
+    thresholds = np.array([[config.CLASSIFICATION_THRESHOLDS[k] for k in ("low", "moderate", "high")]])
+    confusion = confusion_matrices(integrated_scores(scores, setting[:, :3], setting[:, 3:]), labels, thresholds)
+    values = metrics(confusion, positive_from)
+    return _describe(setting[0], thresholds[0], confusion[0, 0], {k: float(v[0, 0]) for k, v in values.items()})
+
+
+# --- Informe ---
+
+def _format_result(rank: str, result: Dict[str, Any]) -> str:
+    w, m, t, v = result["weights"], result["max_raw_scores"], result["thresholds"], result["metrics"]
+    return (
+        f"{rank:>4} | {w['clinical']:.2f} {w['radio']:.2f} {w['digital']:.2f} | "
+        f"{m['clinical']:>3} {m['radio']:>3} {m['digital']:>3} | {t['low']:>3} {t['moderate']:>3} {t['high']:>3} | "
+        f"{v['sensitivity']:6.3f} {v['specificity']:6.3f} {v['youden']:6.3f} {v['accuracy']:6.3f} {v['balanced_accuracy']:6.3f}"
+    )
+
+
+def _format_confusion(confusion: List[List[int]]) -> str:
+    width = max(len(c) for c in CLASSES)
+    corner = "real\\pred"
+    lines = [f"{corner:>{width}}  " + " ".join(f"{c:>{width}}" for c in CLASSES)]
+    lines += [f"{CLASSES[i]:>{width}}  " + " ".join(f"{n:>{width}}" for n in row) for i, row in enumerate(confusion)]
+    return "\n".join(lines)
+
+
+def _format_report(current: Dict[str, Any], results: List[Dict[str, Any]]) -> str:
+    header = f"{'rank':>4} | {'weights c/r/d':<14} | {'max c/r/d':<11} | {'thresholds':<11} | {'sens':>6} {'spec':>6} {'youden':>6} {'acc':>6} {'bal':>6}"
+    lines = [header, "-" * len(header), _format_result("cur", current)]
+    lines += [_format_result(str(i + 1), r) for i, r in enumerate(results)]
+    lines += ["", "Confusion matrix (current):", _format_confusion(current["confusion"])]
+    if results:
+        lines += ["", "Confusion matrix (rank 1):", _format_confusion(results[0]["confusion"])]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Vectorized calibration of score weights and classification thresholds.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--labels", help="CSV or JSON file with labelled cases (scores or case_id + label).")
+    source.add_argument("--synthetic", type=int, metavar="N", help="Use N reproducible synthetic cases instead of labels.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic cases.")
+    parser.add_argument("--case-store", default=config.CASE_STORE_PATH, help="Case store used to resolve case_id rows.")
+    parser.add_argument("--weight-step", type=float, default=0.05, help="Step of the weight simplex grid.")
+    parser.add_argument("--max-clinical", type=int, nargs="+", default=[config.MAX_RAW_SCORES["clinical"]], help="Candidate clinical maxima.")
+    parser.add_argument("--max-radio", type=int, nargs="+", default=[config.MAX_RAW_SCORES["radio"]], help="Candidate radiographic maxima.")
+    parser.add_argument("--max-digital", type=int, nargs="+", default=[config.MAX_RAW_SCORES["digital"]], help="Candidate digital maxima.")
+    parser.add_argument("--low", type=int, nargs=2, default=[6, 18], metavar=("MIN", "MAX"), help="Range for the 'low' threshold.")
+    parser.add_argument("--moderate", type=int, nargs=2, default=[18, 32], metavar=("MIN", "MAX"), help="Range for the 'moderate' threshold.")
+    parser.add_argument("--high", type=int, nargs=2, default=[28, 40], metavar=("MIN", "MAX"), help="Range for the 'high' threshold.")
+    parser.add_argument("--positive-from", choices=CLASSES, default="high", help="Lowest class counted as positive for sensitivity/specificity.")
+    parser.add_argument("--objective", choices=OBJECTIVES, default="youden", help="Metric used to rank configurations.")
+    parser.add_argument("--top", type=int, default=10, help="Number of configurations reported.")
+    parser.add_argument("--output", help="Write the current and top configurations (with confusion matrices) as JSON.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format=config.LOGGING_FORMAT)
+    if args.labels:
+        scores, labels = load_labelled_cases(args.labels, args.case_store)
+    else:
+        scores, labels = synthetic_cases(args.synthetic, args.seed)
+    if not len(labels):
+        logger.error("No labelled cases: nothing to calibrate.")
+        return 1
+    for k, name in enumerate(("clinical", "radio", "digital")):
+        if max(getattr(args, f"max_{name}")) > config.MAX_RAW_SCORES[name] and (scores[:, k] == config.MAX_RAW_SCORES[name]).any():
+            logger.warning(f"Stored {name} scores are capped at {config.MAX_RAW_SCORES[name]}; larger maxima cannot be fully evaluated.")
+
+    weights = weight_grid(args.weight_step)
+    maxima = np.array(list(itertools.product(args.max_clinical, args.max_radio, args.max_digital)))
+    thresholds = threshold_grid(args.low, args.moderate, args.high)
+    positive_from = CLASSES.index(args.positive_from)
+    n_configs = len(weights) * len(maxima) * len(thresholds)
+    logger.info(f"{len(labels)} cases (class counts {np.bincount(labels, minlength=len(CLASSES)).tolist()}), "
+                f"{len(weights)} weights x {len(maxima)} maxima x {len(thresholds)} thresholds = {n_configs} configurations.")
+
+    started = time.perf_counter()
+    results = sweep(scores, labels, weights, maxima, thresholds, positive_from, args.objective, args.top)
+    elapsed = time.perf_counter() - started
+    current = evaluate_current(scores, labels, positive_from)
+
+    print(_format_report(current, results))
+    print(f"\n{n_configs} configurations x {len(labels)} cases = {n_configs * len(labels):.3g} pairs in {elapsed:.2f}s "
+          f"(ranked by {args.objective}, positive = {args.positive_from} or above).")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "classes": CLASSES,
+                "positive_from": args.positive_from,
+                "objective": args.objective,
+                "cases": int(len(labels)),
+                "configurations": n_configs,
+                "current": current,
+                "top": results,
+            }, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
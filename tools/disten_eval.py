@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Arnés de evaluación precisión/velocidad de los parámetros de textura (DistEn2D).
+
+Uso:
+    python -m tools.disten_eval                               # Corpus por defecto (scaffolding/test-img)
+    python -m tools.disten_eval --sizes 32 48 64 --m 2 --tau 1 2 --bins sturges 32 --workers 4
+    python -m tools.disten_eval --manifest corpus.json --output resultados.json
+
+Formato del manifiesto (rutas relativas al propio manifiesto):
+    [
+      {"image": "img/caso1.jpg", "rois": [[[x, y], ...], ...], "expected_digital_score": 7},
+      ...
+    ]
+`expected_digital_score` es opcional; si está presente se informa del error frente a la etiqueta.
+Sin manifiesto se generan ROIs cuadradas reproducibles (`--seed`) sobre cada imagen del directorio.
+"""
+import argparse
+import glob
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+# Permite `python tools/disten_eval.py` además de `python -m tools.disten_eval`.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from services import image_analysis, texture_metrics
+from services.memory_budget import MemoryTracker
+
+try:
+    import resource # Solo POSIX: pico de RSS por proceso.
+except ImportError:
+    resource = None
+
+logger = logging.getLogger("tools.disten_eval")
+
+# --- Evaluación de Parámetros de Textura ---
+# OBJETIVO: Elegir `DISTEN_TARGET_SIZE`, `DISTEN_M`, `DISTEN_TAU` y `DISTEN_BINS` con datos:
+#           cada combinación cambia mucho el coste de DistEn2D (O(N^2) en el número de patrones).
+# CÓMO:
+#   1. El proceso principal prepara el corpus UNA vez (carga, escala de grises, reescalado y
+#      `_extract_roi_pixels`), igual que la ruta de producción.
+#   2. Cada combinación de la rejilla se ejecuta en un proceso nuevo (`spawn`, una tarea por
+#      proceso) que aplica `_preprocess_roi_for_disten` a todas las ROIs y calcula DistEn2D de las ROIs
+#      de cada imagen en un lote con el núcleo de producción (`texture_metrics.compute_batch`, con m, tau
+#      y bins explícitos). Así el pico de RSS del proceso corresponde solo a esa combinación.
+#   3. Se compara cada combinación con la de referencia (la configuración actual de config.py):
+#      desviación de DistEn por ROI y cambios en `_calculate_digital_score` por imagen.
+
+DEFAULT_CORPUS_DIR = os.path.join("scaffolding", "test-img")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+Setting = Tuple[int, int, int, Union[str, int]] # (target_size, m, tau, bins)
+
+
+# --- Corpus ---
+
+def _synthetic_rois(shape: Tuple[int, int], count: int, rng: np.random.Generator) -> List[np.ndarray]:
+    """ROIs cuadradas reproducibles (lado = 1/8 del lado menor, mínimo 24 px) dentro de la imagen."""
+    h, w = shape
+    side = max(24, min(h, w) // 8)
+    rois = []
+    for _ in range(count):
+        x0 = int(rng.integers(0, max(1, w - side)))
+        y0 = int(rng.integers(0, max(1, h - side)))
+        rois.append(np.array([[x0, y0], [x0 + side, y0], [x0 + side, y0 + side], [x0, y0 + side]], dtype=np.int32))
+    return rois
+
+
+def _load_entries(manifest: Optional[str], corpus_dir: str) -> List[Dict[str, Any]]:
+    """
+    Lista de entradas {image, rois, expected_digital_score}. Con manifiesto las ROIs son arrays (n, 2);
+    sin él, `rois` es None (se generan al conocer el tamaño de la imagen).
+    """
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, encoding="utf-8") as f:
+            raw = json.load(f)
+        return [{
+            "image": os.path.join(base, item["image"]),
+            "rois": [np.asarray(roi, dtype=np.int32).reshape(-1, 2) for roi in item["rois"]],
+            "expected_digital_score": item.get("expected_digital_score"),
+        } for item in raw]
+
+    paths = sorted(p for p in glob.glob(os.path.join(corpus_dir, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+    return [{"image": path, "rois": None, "expected_digital_score": None} for path in paths]
+
+
+def prepare_corpus(
+    manifest: Optional[str],
+    corpus_dir: str,
+    rois_per_image: int,
+    seed: int
+) -> List[Dict[str, Any]]:
+    """
+    Carga las imágenes y extrae los píxeles de cada ROI con el código de producción.
+
+    Returns:
+        Lista de imágenes: {"image", "expected_digital_score", "roi_pixels": [array 1D uint8 | None]}.
+    """
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for entry in _load_entries(manifest, corpus_dir):
+        with open(entry["image"], "rb") as f:
+            img_prepared = image_analysis._prepare_image(f.read(), MemoryTracker("eval", sample_tracemalloc=False))
+        if img_prepared is None:
+            logger.warning(f"Skipping {entry['image']}: could not decode image.")
+            continue
+        rois = entry["rois"] if entry["rois"] is not None else _synthetic_rois(img_prepared.shape, rois_per_image, rng)
+        corpus.append({
+            "image": entry["image"],
+            "expected_digital_score": entry["expected_digital_score"],
+            "roi_pixels": [image_analysis._extract_roi_pixels(img_prepared, roi) for roi in rois],
+        })
+    logger.info(f"Corpus ready: {len(corpus)} images, {sum(len(c['roi_pixels']) for c in corpus)} ROIs.")
+    return corpus
+
+
+# --- Ejecución de una combinación (proceso hijo) ---
+
+def _read_proc_status_kib(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> Optional[int]:
+    """
+    Reinicia el pico de RSS del proceso (Linux: `clear_refs` = 5) y devuelve el RSS actual en bytes.
+
+    POR QUÉ: Las importaciones (OpenCV, scikit-image) dejan un pico transitorio mayor que el de
+             DistEn2D; sin reiniciarlo, `ru_maxrss` no reflejaría la combinación evaluada.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+    rss = _read_proc_status_kib("VmRSS")
+    return None if rss is None else rss * 1024
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    hwm = _read_proc_status_kib("VmHWM")
+    if hwm is not None:
+        return hwm * 1024
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # Linux: KiB; macOS: bytes.
+
+
+def run_setting(setting: Setting, corpus: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Ejecuta preprocesado + DistEn2D de todas las ROIs del corpus con una combinación de parámetros, como
+    en producción: las ROIs de cada imagen (una petición) se calculan juntas con `compute_batch`.
+    El tiempo por ROI es su preprocesado más su parte del lote.
+    """
+    logging.disable(logging.WARNING) # El pipeline registra cada ROI a nivel INFO/WARNING.
+    size, m, tau, bins = setting
+    # Sin `clear_refs` (no Linux) se usa el pico previo como base: la medida es una cota inferior.
+    rss_before = _reset_peak_rss() or _peak_rss_bytes()
+    values: List[List[Optional[float]]] = []
+    roi_times: List[float] = []
+    errors = 0
+    start = time.perf_counter()
+    for image in corpus:
+        image_values: List[Optional[float]] = [None] * len(image["roi_pixels"])
+        processed, positions, times = [], [], []
+        for roi_index, pixels in enumerate(image["roi_pixels"]):
+            if pixels is None:
+                continue
+            t0 = time.perf_counter()
+            roi = image_analysis._preprocess_roi_for_disten(pixels, roi_index, target_size=(size, size))
+            times.append(time.perf_counter() - t0)
+            if roi is None:
+                errors += 1 # Preprocesado fallido.
+                continue
+            processed.append(roi)
+            positions.append(roi_index)
+        batch_time = 0.0
+        if processed:
+            t0 = time.perf_counter()
+            try:
+                batch_values, _ = texture_metrics.compute_batch(np.stack(processed), names=(), m=m, tau=tau, bins=bins)
+                for roi_index, roi_values in zip(positions, batch_values):
+                    image_values[roi_index] = round(roi_values["dist_en"], 4) # Igual que la ruta de producción.
+            except Exception:
+                errors += len(processed)
+            batch_time = time.perf_counter() - t0
+        roi_times.extend(t + batch_time / len(times) for t in times)
+        values.append(image_values)
+    wall_time = time.perf_counter() - start
+    rss_after = _peak_rss_bytes()
+    return {
+        "setting": {"target_size": size, "m": m, "tau": tau, "bins": bins},
+        "wall_time_s": wall_time,
+        "mean_roi_ms": 1000 * float(np.mean(roi_times)) if roi_times else 0.0,
+        "max_roi_ms": 1000 * float(np.max(roi_times)) if roi_times else 0.0,
+        "peak_rss_growth_bytes": None if rss_before is None or rss_after is None else max(0, rss_after - rss_before),
+        "errors": errors,
+        "values": values,
+    }
+
+
+def _run_setting_star(args: Tuple[Setting, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    return run_setting(*args)
+
+
+# --- Comparación con la referencia ---
+
+def _image_scores(values: List[List[Optional[float]]]) -> List[int]:
+    scores = []
+    for image_values in values:
+        valid = [v for v in image_values if v is not None]
+        scores.append(image_analysis._calculate_digital_score(max(valid) if valid else 0.0))
+    return scores
+
+
+def summarize(results: List[Dict[str, Any]], reference: Setting, corpus: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Añade a cada resultado la desviación respecto a la referencia y los cambios de puntuación digital."""
+    ref_key = _setting_key(reference)
+    ref = next(r for r in results if _setting_key(_as_setting(r["setting"])) == ref_key)
+    ref_values = ref["values"]
+    logging.disable(logging.INFO) # `_calculate_digital_score` registra cada cálculo.
+    ref_scores = _image_scores(ref_values)
+    labels = [image["expected_digital_score"] for image in corpus]
+
+    for result in results:
+        deviations = [
+            abs(v - r)
+            for image_values, image_ref in zip(result["values"], ref_values)
+            for v, r in zip(image_values, image_ref)
+            if v is not None and r is not None
+        ]
+        scores = _image_scores(result["values"])
+        deltas = [abs(s - r) for s, r in zip(scores, ref_scores)]
+        result["digital_scores"] = scores
+        result["mean_abs_deviation"] = float(np.mean(deviations)) if deviations else None
+        result["max_abs_deviation"] = float(np.max(deviations)) if deviations else None
+        result["score_changes"] = sum(d > 0 for d in deltas)
+        result["max_score_delta"] = max(deltas) if deltas else 0
+        result["speedup"] = ref["wall_time_s"] / result["wall_time_s"] if result["wall_time_s"] else None
+        labelled = [(s, l) for s, l in zip(scores, labels) if l is not None]
+        result["label_mae"] = float(np.mean([abs(s - l) for s, l in labelled])) if labelled else None
+        result["is_reference"] = _setting_key(_as_setting(result["setting"])) == ref_key
+    logging.disable(logging.NOTSET)
+    return results
+
+
+def _as_setting(d: Dict[str, Any]) -> Setting:
+    return d["target_size"], d["m"], d["tau"], d["bins"]
+
+
+def _setting_key(setting: Setting) -> Tuple[int, int, int, str]:
+    size, m, tau, bins = setting
+    return size, m, tau, str(bins).lower()
+
+
+def _parse_bins(value: str) -> Union[str, int]:
+    return int(value) if value.isdigit() else value
+
+
+def _format_table(results: List[Dict[str, Any]]) -> str:
+    header = f"{'size':>4} {'m':>2} {'tau':>3} {'bins':>8} | {'time s':>8} {'ms/roi':>8} {'speedup':>7} {'peak MB':>8} | {'mean |d|':>8} {'max |d|':>8} {'score chg':>9} {'max dS':>6} {'label MAE':>9} {'err':>3}"
+    lines = [header, "-" * len(header)]
+    for r in sorted(results, key=lambda r: r["wall_time_s"]):
+        s = r["setting"]
+        peak = f"{r['peak_rss_growth_bytes'] / 2**20:8.1f}" if r["peak_rss_growth_bytes"] is not None else f"{'n/a':>8}"
+        fmt = lambda v, spec: format(v, spec) if v is not None else "n/a"
+        lines.append(
+            f"{s['target_size']:>4} {s['m']:>2} {s['tau']:>3} {str(s['bins']):>8} | "
+            f"{r['wall_time_s']:8.2f} {r['mean_roi_ms']:8.1f} {fmt(r['speedup'], '7.2f'):>7} {peak} | "
+            f"{fmt(r['mean_abs_deviation'], '8.4f'):>8} {fmt(r['max_abs_deviation'], '8.4f'):>8} "
+            f"{r['score_changes']:>9} {r['max_score_delta']:>6} {fmt(r['label_mae'], '9.2f'):>9} {r['errors']:>3}"
+            + ("  <- reference" if r["is_reference"] else "")
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Accuracy-vs-speed evaluation of DistEn2D texture parameters.")
+    parser.add_argument("--manifest", help="JSON corpus manifest with images, ROIs and optional labels.")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR, help="Image directory used when no manifest is given.")
+    parser.add_argument("--rois-per-image", type=int, default=3, help="Synthetic ROIs per image (no manifest).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic ROIs.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 48, 64], help="Square DISTEN_TARGET_SIZE values.")
+    parser.add_argument("--m", type=int, nargs="+", default=[2, 3], help="DistEn2D embedding dimensions.")
+    parser.add_argument("--tau", type=int, nargs="+", default=[1, 2], help="DistEn2D time delays.")
+    parser.add_argument("--bins", type=_parse_bins, nargs="+", default=["Sturges", "Rice"], help="Binning methods or bin counts.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel worker processes.")
+    parser.add_argument("--output", help="Write the full results (including per-ROI values) as JSON.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format=config.LOGGING_FORMAT)
+    reference: Setting = (config.DISTEN_TARGET_SIZE[0], config.DISTEN_M, config.DISTEN_TAU, config.DISTEN_BINS)
+    if config.DISTEN_TARGET_SIZE[0] != config.DISTEN_TARGET_SIZE[1]:
+        logger.warning("Non-square DISTEN_TARGET_SIZE; the reference uses its first dimension.")
+
+    # La referencia siempre forma parte de la rejilla (sin duplicados).
+    grid: Dict[Tuple, Setting] = {_setting_key(reference): reference}
+    for setting in itertools.product(args.sizes, args.m, args.tau, args.bins):
+        grid.setdefault(_setting_key(setting), setting)
+
+    logging.disable(logging.INFO)
+    corpus = prepare_corpus(args.manifest, args.corpus_dir, args.rois_per_image, args.seed)
+    logging.disable(logging.NOTSET)
+    if not corpus:
+        logger.error("Empty corpus: nothing to evaluate.")
+        return 1
+
+    logger.info(f"Evaluating {len(grid)} settings with {args.workers} workers...")
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=args.workers, maxtasksperchild=1) as pool:
+        results = []
+        for result in pool.imap_unordered(_run_setting_star, [(s, corpus) for s in grid.values()]):
+            logger.info(f"Done {result['setting']} in {result['wall_time_s']:.2f}s")
+            results.append(result)
+
+    summarize(results, reference, corpus)
+    print(_format_table(results))
+    if args.workers > 1:
+        print(f"\nNote: timings measured with {args.workers} concurrent workers; use --workers 1 for uncontended numbers.")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "reference": dict(zip(("target_size", "m", "tau", "bins"), reference)),
+                "images": [image["image"] for image in corpus],
+                "results": results,
+            }, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Generador de carga para `/api/calculate` y `/calculate`.
+
+Uso:
+    python -m tools.load_test --start-server --rates 0.5 1 2 --duration 60
+    python -m tools.load_test --base-url http://127.0.0.1:8000 --rates 1 --html-fraction 0.3 --output carga.json
+
+Las peticiones (imagen, número de ROIs, polígonos y puntuaciones manuales) y los instantes de
+llegada se generan a partir de `--seed`: dos ejecuciones con los mismos argumentos envían
+exactamente el mismo tráfico, de modo que se pueden comparar configuraciones de despliegue.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import mimetypes
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Permite `python tools/load_test.py` además de `python -m tools.load_test`.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import config
+from services import options, roi_codec
+from services.memory_budget import image_dimensions
+
+# httpx solo es necesario para esta herramienta (no para la aplicación).
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    httpx = None
+    HTTPX_AVAILABLE = False
+
+logger = logging.getLogger("tools.load_test")
+
+# --- Prueba de Carga ---
+# OBJETIVO: Saber cuántos envíos concurrentes soporta un nodo antes de que la latencia sea inaceptable.
+# CÓMO:
+#   1. Se genera de antemano (con semilla) una planificación de llegadas de Poisson para cada tasa
+#      (`--rates`, peticiones/s) y el contenido de cada petición: imagen de `scaffolding/test-img`,
+#      número de ROIs (`--roi-counts`), polígonos aleatorios dentro de la imagen y puntuaciones
+#      manuales aleatorias tomadas de `services.options`.
+#   2. Carga en bucle abierto: cada petición se lanza en su instante planificado, haya terminado o no
+#      la anterior. La latencia se mide desde el instante PLANIFICADO, así que la espera en el cliente
+#      (conexiones agotadas) también cuenta y no se oculta la saturación (omisión coordinada).
+#   3. Se informa por tasa: throughput, p50/p95/p99, errores por estado y los tiempos por etapa del
+#      servidor (cabecera `Server-Timing`, ver `utils.timing`).
+
+DEFAULT_IMAGE_DIR = os.path.join(ROOT_DIR, "scaffolding", "test-img")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+# --- Generación de tráfico ---
+
+def _load_images(image_dir: str) -> List[Tuple[str, bytes, Tuple[int, int]]]:
+    images = []
+    for path in sorted(glob.glob(os.path.join(image_dir, "*"))):
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        dims = image_dimensions(data)
+        if dims is None:
+            logger.warning(f"Skipping {path}: could not read image dimensions.")
+            continue
+        images.append((os.path.basename(path), data, dims))
+    return images
+
+
+def _random_polygon(rng: np.random.Generator, shape: Tuple[int, int]) -> np.ndarray:
+    """Polígono en estrella (6-24 vértices) de radio 2-8% del lado menor, dentro de la imagen."""
+    h, w = shape
+    radius = rng.uniform(0.02, 0.08) * min(h, w)
+    cx = rng.uniform(radius, w - radius)
+    cy = rng.uniform(radius, h - radius)
+    n = int(rng.integers(6, 25))
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+    radii = radius * rng.uniform(0.6, 1.0, n)
+    return np.stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)], axis=1).round().astype(np.int32)
+
+
+def _random_manual_scores(rng: np.random.Generator) -> Dict[str, str]:
+    fields = {**options.get_clinical_options(), **options.get_radiographic_options()}
+    return {name: str(choices[int(rng.integers(len(choices)))][1]) for name, choices in fields.items()}
+
+
+def build_schedule(
+    rate: float,
+    duration: float,
+    images: List[Tuple[str, bytes, Tuple[int, int]]],
+    roi_counts: List[int],
+    html_fraction: float,
+    roi_encoding: str,
+    seed: int
+) -> List[Dict[str, Any]]:
+    """Planificación determinista de peticiones para una tasa: [{at, path, data, image}]."""
+    # Semilla por tasa: añadir o quitar tasas no altera el tráfico de las demás.
+    rng = np.random.default_rng([seed, int(rate * 1000)])
+    schedule = []
+    at = 0.0
+    while True:
+        at += rng.exponential(1.0 / rate)
+        if at >= duration:
+            break
+        name, _, shape = images[int(rng.integers(len(images)))]
+        rois = [_random_polygon(rng, shape) for _ in range(int(rng.choice(roi_counts)))]
+        data = _random_manual_scores(rng)
+        if roi_encoding == "compact":
+            data["roi_data"] = roi_codec.encode_rois_compact(rois)
+        else:
+            data["roi_data"] = json.dumps([roi.tolist() for roi in rois])
+        path = "/calculate" if rng.random() < html_fraction else "/api/calculate"
+        schedule.append({"at": at, "path": path, "data": data, "image": name, "n_rois": len(rois)})
+    return schedule
+
+
+# --- Ejecución ---
+
+def _parse_server_timing(value: Optional[str]) -> Dict[str, float]:
+    timings = {}
+    for part in (value or "").split(","):
+        name, *params = [p.strip() for p in part.split(";")]
+        for param in params:
+            if param.startswith("dur="):
+                try:
+                    timings[name] = float(param[4:])
+                except ValueError:
+                    pass
+    return timings
+
+
+def _content_type(name: str) -> str:
+    """Tipo MIME que enviaría un navegador para el archivo (por extensión, como `<input type=file>`)."""
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+async def _send(
+    client: "httpx.AsyncClient",
+    item: Dict[str, Any],
+    image_bytes: Dict[str, bytes],
+    t0: float
+) -> Dict[str, Any]:
+    await asyncio.sleep(max(0.0, t0 + item["at"] - time.perf_counter()))
+    scheduled = t0 + item["at"]
+    record = {"path": item["path"], "n_rois": item["n_rois"], "image": item["image"]}
+    try:
+        response = await client.post(
+            item["path"],
+            data=item["data"],
+            files={"image": (item["image"], image_bytes[item["image"]], _content_type(item["image"]))},
+            # El navegador pide a /calculate solo el fragmento de resultados (`main.FRAGMENT_HEADER`).
+            headers={"X-Fragment": "results"} if item["path"] == "/calculate" else None,
+        )
+        record["status"] = response.status_code
+        record["server_timing"] = _parse_server_timing(response.headers.get("server-timing"))
+    except httpx.HTTPError as e:
+        record["status"] = None
+        record["error"] = type(e).__name__
+    record["latency_ms"] = (time.perf_counter() - scheduled) * 1000
+    record["finished_at"] = time.perf_counter() - t0
+    return record
+
+
+async def run_rate(
+    base_url: str,
+    schedule: List[Dict[str, Any]],
+    image_bytes: Dict[str, bytes],
+    max_in_flight: int,
+    timeout: float
+) -> List[Dict[str, Any]]:
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        t0 = time.perf_counter()
+        return await asyncio.gather(*(_send(client, item, image_bytes, t0) for item in schedule))
+
+
+def summarize(rate: float, duration: float, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Throughput, percentiles de latencia, errores y tiempos por etapa del servidor para una tasa."""
+    ok = [r for r in records if r["status"] is not None and 200 <= r["status"] < 300]
+    latencies = np.array([r["latency_ms"] for r in ok]) if ok else np.array([])
+    elapsed = max([duration] + [r["finished_at"] for r in records])
+    statuses: Dict[str, int] = {}
+    for r in records:
+        key = str(r["status"]) if r["status"] is not None else r.get("error", "error")
+        statuses[key] = statuses.get(key, 0) + 1
+
+    stages: Dict[str, List[float]] = {}
+    for r in ok:
+        for name, ms in r.get("server_timing", {}).items():
+            stages.setdefault(name, []).append(ms)
+
+    pct = lambda q: float(np.percentile(latencies, q)) if latencies.size else None
+    return {
+        "rate": rate,
+        "sent": len(records),
+        "succeeded": len(ok),
+        "error_rate": (len(records) - len(ok)) / len(records) if records else 0.0,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency_ms": {"p50": pct(50), "p95": pct(95), "p99": pct(99), "max": float(latencies.max()) if latencies.size else None},
+        "statuses": statuses,
+        "server_stages_ms": {
+            name: {"mean": float(np.mean(v)), "p95": float(np.percentile(v, 95))} for name, v in stages.items()
+        },
+    }
+
+
+def _format_report(summaries: List[Dict[str, Any]]) -> str:
+    fmt = lambda v: f"{v:8.0f}" if v is not None else f"{'n/a':>8}"
+    lines = [f"{'rate/s':>7} {'sent':>5} {'ok':>5} {'err %':>6} {'thr/s':>6} | {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"]
+    lines.append("-" * len(lines[0]))
+    for s in summaries:
+        lat = s["latency_ms"]
+        lines.append(
+            f"{s['rate']:7.2f} {s['sent']:5d} {s['succeeded']:5d} {100 * s['error_rate']:6.1f} {s['throughput_rps']:6.2f} | "
+            f"{fmt(lat['p50'])} {fmt(lat['p95'])} {fmt(lat['p99'])} {fmt(lat['max'])}"
+        )
+    for s in summaries:
+        stages = ", ".join(f"{name} {v['mean']:.1f}/{v['p95']:.1f}" for name, v in s["server_stages_ms"].items())
+        errors = {k: v for k, v in s["statuses"].items() if not k.startswith("2")}
+        lines.append(f"\nrate {s['rate']:.2f}/s server stages (mean/p95 ms): {stages or 'n/a'}")
+        if errors:
+            lines.append(f"rate {s['rate']:.2f}/s errors: {errors}")
+    return "\n".join(lines)
+
+
+# --- Servidor local ---
+
+def _start_server(port: int, workers: int, data_dir: str) -> subprocess.Popen:
+    """Arranca uvicorn con los almacenes de casos e imágenes en `data_dir` (no en el `data/` real)."""
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    env = {
+        **os.environ,
+        "EOTRH_CASE_STORE_PATH": os.path.join(data_dir, "cases.sqlite3"),
+        "EOTRH_IMAGE_STORE_DIR": os.path.join(data_dir, "images"),
+    }
+    logger.info(f"Starting server (stores in {data_dir}): {' '.join(cmd)}")
+    return subprocess.Popen(cmd, cwd=ROOT_DIR, env=env)
+
+
+def _wait_until_ready(base_url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/", timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not become ready within {timeout:.0f}s")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Open-loop load test for /api/calculate and /calculate.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="Server to test.")
+    parser.add_argument("--start-server", action="store_true", help="Start a local uvicorn server for the run (case and image stores in a temp dir).")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --start-server.")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn worker processes for --start-server.")
+    parser.add_argument("--rates", type=float, nargs="+", default=[0.5, 1.0, 2.0], help="Arrival rates (requests/s).")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of arrivals per rate.")
+    parser.add_argument("--roi-counts", type=int, nargs="+", default=[1, 2, 3, 5], help="ROI counts to sample from.")
+    parser.add_argument("--html-fraction", type=float, default=0.2, help="Fraction of requests sent to /calculate.")
+    parser.add_argument("--roi-encoding", choices=["compact", "json"], default="compact", help="roi_data wire format.")
+    parser.add_argument("--image-dir", default=DEFAULT_IMAGE_DIR, help="Directory of JPEG/PNG images.")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Client connection limit.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (s).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for arrivals and request contents.")
+    parser.add_argument("--output", help="Write the summaries and per-request records as JSON.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format=config.LOGGING_FORMAT)
+    logging.getLogger("httpx").setLevel(logging.WARNING) # Una línea por petición.
+    if not HTTPX_AVAILABLE:
+        logger.error("httpx is required for the load test: pip install httpx")
+        return 1
+
+    images = _load_images(args.image_dir)
+    if not images:
+        logger.error(f"No usable images in {args.image_dir}")
+        return 1
+    image_bytes = {name: data for name, data, _ in images}
+
+    server = None
+    server_data = None
+    base_url = args.base_url
+    if args.start_server:
+        base_url = f"http://127.0.0.1:{args.port}"
+        server_data = tempfile.TemporaryDirectory(prefix="eotrh-load-test-")
+        server = _start_server(args.port, args.server_workers, server_data.name)
+    try:
+        _wait_until_ready(base_url)
+        summaries, all_records = [], {}
+        for rate in args.rates:
+            schedule = build_schedule(rate, args.duration, images, args.roi_counts,
+                                      args.html_fraction, args.roi_encoding, args.seed)
+            logger.info(f"Rate {rate}/s: {len(schedule)} requests over {args.duration:.0f}s...")
+            records = asyncio.run(run_rate(base_url, schedule, image_bytes, args.max_in_flight, args.timeout))
+            summaries.append(summarize(rate, args.duration, records))
+            all_records[str(rate)] = records
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+            server_data.cleanup()
+
+    print(_format_report(summaries))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "summaries": summaries, "records": all_records}, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
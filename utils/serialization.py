@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import logging
+from typing import Optional
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+# --- Formatos binarios opcionales ---
+# MessagePack y CBOR son opcionales: si la librería no está instalada, la negociación
+# simplemente no ofrece ese formato (los clientes que acepten JSON lo seguirán recibiendo).
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+try:
+    import cbor2
+    CBOR_AVAILABLE = True
+except ImportError:
+    cbor2 = None
+    CBOR_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MEDIA_JSON = "application/json"
+MEDIA_MSGPACK = "application/msgpack"
+MEDIA_CBOR = "application/cbor"
+
+# Nombres alternativos usados por distintos clientes para MessagePack.
+_MEDIA_ALIASES = {
+    "application/x-msgpack": MEDIA_MSGPACK,
+    "application/vnd.msgpack": MEDIA_MSGPACK,
+}
+
+
+def negotiate_media_type(accept: Optional[str]) -> Optional[str]:
+    """
+    Elige el formato de respuesta a partir de la cabecera `Accept`.
+
+    Respeta los pesos `q` (a igual peso, el orden de aparición). Sin cabecera, o con
+    `*/*` / `application/*`, se responde JSON.
+
+    Returns:
+        El media type elegido, o None si el cliente no acepta ningún formato disponible.
+    """
+    if not accept:
+        return MEDIA_JSON
+
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media, *params = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            candidates.append((-q, position, _MEDIA_ALIASES.get(media.lower(), media.lower())))
+
+    for _, _, media in sorted(candidates):
+        if media in (MEDIA_JSON, "application/*", "*/*"):
+            return MEDIA_JSON
+        if media == MEDIA_MSGPACK and MSGPACK_AVAILABLE:
+            return MEDIA_MSGPACK
+        if media == MEDIA_CBOR and CBOR_AVAILABLE:
+            return MEDIA_CBOR
+    return None
+
+
+def model_response(model: BaseModel, accept: Optional[str], status_code: int = 200) -> Response:
+    """
+    Serializa un modelo Pydantic en el formato negociado y devuelve la respuesta ya codificada.
+
+    POR QUÉ: Devolver `model.dict()` desde el endpoint obliga a FastAPI a recorrer el
+             resultado con `jsonable_encoder` y a codificarlo de nuevo con `json`. Aquí se usa
+             el serializador de Pydantic (compilado una vez por clase, en Rust) directamente
+             a bytes JSON, o a un `dict` de tipos nativos para MessagePack/CBOR.
+    """
+    media_type = negotiate_media_type(accept)
+    if media_type is None:
+        logger.warning(f"No acceptable response format for Accept: {accept!r}")
+        return Response(
+            status_code=406,
+            content=f"Not Acceptable. Supported: {', '.join(supported_media_types())}",
+            media_type="text/plain"
+        )
+    if media_type == MEDIA_MSGPACK:
+        body = msgpack.packb(model.model_dump(), use_bin_type=True)
+    elif media_type == MEDIA_CBOR:
+        body = cbor2.dumps(model.model_dump())
+    else:
+        body = model.model_dump_json()
+    return Response(content=body, status_code=status_code, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def supported_media_types() -> list:
+    """Lista de formatos de respuesta disponibles en este despliegue."""
+    media_types = [MEDIA_JSON]
+    if MSGPACK_AVAILABLE:
+        media_types.append(MEDIA_MSGPACK)
+    if CBOR_AVAILABLE:
+        media_types.append(MEDIA_CBOR)
+    return media_types
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import config
+
+# --- Tiempos por Etapa (cabecera Server-Timing) ---
+# OBJETIVO: Que las herramientas de carga (`tools.load_test`) y el navegador (DevTools > Timing)
+#           vean cuánto tarda cada etapa de una petición en el servidor, sin instrumentación extra.
+# CÓMO: Cada endpoint mide sus etapas con `StageTimer.stage(nombre)` y añade la cabecera
+#       estándar `Server-Timing: etapa;dur=ms, ...` a la respuesta.
+
+
+class StageTimer:
+    """Acumula la duración (ms) de las etapas con nombre de una petición."""
+
+    def __init__(self):
+        self.durations_ms: Dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name: str, duration_ms: float) -> None:
+        self.durations_ms[name] = self.durations_ms.get(name, 0.0) + duration_ms
+
+    def elapsed_ms(self) -> float:
+        """Milisegundos desde que se creó el temporizador (la llegada de la petición al endpoint)."""
+        return (time.perf_counter() - self._start) * 1000
+
+    def header_value(self) -> str:
+        """Valor de la cabecera `Server-Timing`, incluyendo el total de la petición."""
+        total_ms = self.elapsed_ms()
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.durations_ms.items()]
+        parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+    def apply(self, response) -> None:
+        """Añade la cabecera `Server-Timing` a la respuesta si está habilitada en config."""
+        if config.SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = self.header_value()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Proceso de análisis: toma trabajos de la cola compartida (`services.job_queue`), ejecuta el análisis de
+textura y publica el resultado para el servidor web (`ANALYSIS_WORKERS_ENABLED = True` en `config.py`).
+
+Uso:
+    python worker.py                       # Un proceso con el backend de `config.JOB_QUEUE_BACKEND`
+    python worker.py --processes 4         # Cuatro procesos en este nodo
+    python worker.py --backend spool --max-jobs 10
+
+Se pueden arrancar tantos workers como se quiera, en cualquier nodo que vea la misma cola. SIGTERM/SIGINT
+terminan el trabajo en curso antes de salir.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Any, Callable, List, Optional
+
+import config
+from services import analysis_jobs, debug_capture, image_store, job_queue
+
+logger = logging.getLogger("worker")
+
+# Espera máxima de cada `claim`: cada cuánto se comprueba la señal de parada y se reencolan trabajos caducados.
+_CLAIM_TIMEOUT_S = 5.0
+# Reintentos tras un fallo de la cola (base de datos bloqueada, conexión caída...): espera inicial y máxima.
+_ERROR_BACKOFF_S = 1.0
+_ERROR_BACKOFF_MAX_S = 30.0
+
+_stopping = False
+
+
+def _request_stop(signum, frame) -> None:
+    global _stopping
+    _stopping = True
+    logger.info(f"Signal {signum} received; finishing the current job before exiting.")
+
+
+async def _queue_call(operation: Callable[..., Any], *args: Any) -> Any:
+    """
+    Ejecuta una operación de la cola en un hilo. Si falla (p. ej. "database is locked" o una conexión
+    Redis caída), lo registra y reintenta con espera exponencial en lugar de terminar el worker.
+    Retorna None si llega la señal de parada antes de conseguirlo.
+    """
+    delay = _ERROR_BACKOFF_S
+    while True:
+        try:
+            return await asyncio.to_thread(operation, *args)
+        except Exception as e:
+            if _stopping:
+                logger.error(f"Job queue {operation.__name__} failed while stopping: {e}")
+                return None
+            logger.error(f"Job queue {operation.__name__} failed ({type(e).__name__}: {e}); retrying in {delay:.0f}s.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _ERROR_BACKOFF_MAX_S)
+
+
+async def run_worker(worker_id: str, backend: Optional[str] = None, max_jobs: Optional[int] = None) -> int:
+    """Bucle principal: reclamar, analizar, publicar. Retorna el número de trabajos procesados."""
+    queue = job_queue.get_queue(backend)
+    logger.info(f"Worker {worker_id} waiting for jobs on the '{queue.name}' queue.")
+    processed = 0
+    last_requeue = 0.0
+    while not _stopping and (max_jobs is None or processed < max_jobs):
+        if time.monotonic() - last_requeue >= config.JOB_QUEUE_REQUEUE_INTERVAL_S:
+            requeued = await _queue_call(queue.requeue_expired)
+            if requeued:
+                logger.warning(f"Requeued {requeued} job(s) whose worker did not finish within the lease.")
+            last_requeue = time.monotonic()
+        job = await _queue_call(queue.claim, worker_id, _CLAIM_TIMEOUT_S)
+        if job is None:
+            continue
+        job_id, meta, blob = job
+        queued_ms = (time.time() - meta.get("submitted_at", time.time())) * 1000
+        result = await analysis_jobs.execute_job(meta, blob)
+        result["worker_id"] = worker_id
+        # Si la cola no vuelve antes de la parada, el resultado se pierde y el trabajo se reencola tras la concesión.
+        await _queue_call(queue.complete, job_id, result)
+        processed += 1
+        logger.info(f"Job {job_id} ({meta['kind']}, {len(meta['rois'])} ROIs): "
+                    f"queued {queued_ms:.0f} ms, analysis {result['analysis_ms']:.0f} ms.")
+    return processed
+
+
+def _worker_process(worker_id: str, backend: Optional[str], max_jobs: Optional[int]) -> None:
+    """Punto de entrada de cada proceso worker."""
+    logging.basicConfig(level=config.LOGGING_LEVEL, format=config.LOGGING_FORMAT)
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    debug_capture.start_writer()
+    try:
+        asyncio.run(run_worker(worker_id, backend, max_jobs))
+    finally:
+        debug_capture.stop_writer()
+        image_store.flush(10.0)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Texture analysis worker fed from the shared job queue.")
+    parser.add_argument("--backend", choices=["sqlite", "spool", "redis"], help="Override config.JOB_QUEUE_BACKEND.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to run on this node.")
+    parser.add_argument("--max-jobs", type=int, help="Exit after this many jobs (per process).")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}", help="Name used in logs and results.")
+    args = parser.parse_args(argv)
+
+    if args.processes <= 1:
+        _worker_process(args.worker_id, args.backend, args.max_jobs)
+        return 0
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(f"{args.worker_id}-{i}", args.backend, args.max_jobs),
+                                name=f"worker-{i}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    # El padre reenvía la parada como SIGTERM: cada hijo termina su trabajo en curso y sale.
+    forward = lambda signum, frame: [process.terminate() for process in processes if process.is_alive()]
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in processes:
+        process.join()
+    return max((process.exitcode or 0) for process in processes)
+
+
+if __name__ == "__main__":
+    sys.exit(main())